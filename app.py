@@ -1,47 +1,327 @@
-import os, re, json, random, time, requests, logging
-from urllib.parse import quote
+import os, re, json, html, math, random, time, hashlib, requests, logging, queue, threading, sqlite3, zlib
+import contextvars, cProfile, tracemalloc, signal, heapq, gzip, shutil, atexit
+import logging.handlers
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from html.parser import HTMLParser
+from urllib.parse import quote, unquote, urlsplit, urlunsplit, parse_qsl, urlencode
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 load_dotenv()
 
 # === 環境變數 ===
-WP_URL        = os.getenv("WP_URL")
-WP_USER       = os.getenv("WP_USER")
-WP_PASS       = os.getenv("WP_APP_PASS")
-BRAND         = os.getenv("BRAND_NAME", "品牌名稱")
-SITE_NAME     = os.getenv("SITE_NAME", "example.com")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GOOGLE_CSE_ID  = os.getenv("GOOGLE_CSE_ID")
-GENAI_MODEL    = os.getenv("GENAI_MODEL", "gemini-2.5-flash")
-CATEGORY_ID    = int(os.getenv("CATEGORY_ID", "0"))
-
-KEYWORDS  = [k.strip() for k in os.getenv("KEYWORDS", "").split(",") if k.strip()]
-TAGS_BASE = [t.strip() for t in os.getenv("TAGS", "").split(",") if t.strip()]
-POSTS_PER_DAY = int(os.getenv("POSTS_PER_DAY", "1"))
-
-# === SEO 設定 ===
-SEO_BRAND_SUFFIX = os.getenv("SEO_BRAND_SUFFIX", "｜健康誌")
-DEFAULT_SEO_KEYWORDS = [k.strip() for k in os.getenv("DEFAULT_SEO_KEYWORDS", "").split(",") if k.strip()]
+# 常駐模式收到 SIGHUP 時會重新讀取 .env 並再次執行 load_settings()；
+# 連線池、節流、狀態檔路徑等其餘設定需重新啟動才會生效
+def load_settings():
+    global WP_URL, WP_USER, WP_PASS, BRAND, SITE_NAME, GOOGLE_API_KEY, GOOGLE_API_KEYS, GOOGLE_CSE_ID, GENAI_MODEL, CATEGORY_ID
+    global KEYWORDS, KEYWORDS_FILE, TAGS_BASE, POSTS_PER_DAY, SEO_BRAND_SUFFIX, DEFAULT_SEO_KEYWORDS
+    global PUBLISH_WINDOW, QUIET_HOURS, SLOT_JITTER_MINUTES
+    global GENAI_BASE_URL, GENAI_MODELS, CSE_URL
+    WP_URL        = os.getenv("WP_URL")
+    WP_USER       = os.getenv("WP_USER")
+    WP_PASS       = os.getenv("WP_APP_PASS")
+    BRAND         = os.getenv("BRAND_NAME", "品牌名稱")
+    SITE_NAME     = os.getenv("SITE_NAME", "example.com")
+    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    # 多把金鑰（逗號分隔）輪流使用，未設定時只使用 GOOGLE_API_KEY
+    GOOGLE_API_KEYS = [k.strip() for k in os.getenv("GOOGLE_API_KEYS", "").split(",") if k.strip()] or \
+                      ([GOOGLE_API_KEY] if GOOGLE_API_KEY else [])
+    GOOGLE_CSE_ID  = os.getenv("GOOGLE_CSE_ID")
+    GENAI_MODEL    = os.getenv("GENAI_MODEL", "gemini-2.5-flash")
+    # 產文的備援模型（逗號分隔，依序使用）；GENAI_MODEL 逾時或失敗時改用下一個
+    GENAI_MODELS = [GENAI_MODEL]
+    for model in os.getenv("GENAI_FALLBACK_MODELS", "").split(","):
+        if model.strip() and model.strip() not in GENAI_MODELS:
+            GENAI_MODELS.append(model.strip())
+    CATEGORY_ID    = int(os.getenv("CATEGORY_ID", "0"))
 
-USED_FILE = "used_refs.json"
-LOG_FILE = "wp_article_generator.log"
+    KEYWORDS  = [k.strip() for k in os.getenv("KEYWORDS", "").split(",") if k.strip()]
+    # 關鍵字檔（每行一個，可寫成「關鍵字,權重」）；設定後取代 KEYWORDS，適合上萬個關鍵字
+    KEYWORDS_FILE = os.getenv("KEYWORDS_FILE", "").strip()
+    TAGS_BASE = [t.strip() for t in os.getenv("TAGS", "").split(",") if t.strip()]
+    POSTS_PER_DAY = int(os.getenv("POSTS_PER_DAY", "1"))
+
+    # === SEO 設定 ===
+    SEO_BRAND_SUFFIX = os.getenv("SEO_BRAND_SUFFIX", "｜健康誌")
+    DEFAULT_SEO_KEYWORDS = [k.strip() for k in os.getenv("DEFAULT_SEO_KEYWORDS", "").split(",") if k.strip()]
+
+    # === 常駐模式排程 ===
+    # 每天發佈的時段（HH:MM-HH:MM，可跨午夜），POSTS_PER_DAY 篇平均分散在時段內
+    PUBLISH_WINDOW = os.getenv("PUBLISH_WINDOW", "09:00-21:00")
+    # 時段內不發佈的區間，逗號分隔（例如 12:00-13:30）
+    QUIET_HOURS = os.getenv("QUIET_HOURS", "")
+    # 每個發佈時間點的隨機偏移上限（分鐘），避免每天固定在同一時刻送出
+    SLOT_JITTER_MINUTES = float(os.getenv("SLOT_JITTER_MINUTES", "20"))
+
+    # === Google API URLs ===
+    # 可透過環境變數改指向其他端點（例如 bench.py 的本機假伺服器）
+    GENAI_BASE_URL = os.getenv("GENAI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+    CSE_URL   = os.getenv("CSE_URL", "https://www.googleapis.com/customsearch/v1")
+
+load_settings()
+
+# 常駐模式：程式不結束，依 PUBLISH_WINDOW 分散發佈（取代 cron 每天啟動一次）
+DAEMON_MODE = os.getenv("DAEMON_MODE", "0") == "1"
+
+# 多站台設定檔（JSON）；未設定時以上方的 .env 設定作為唯一站台
+SITES_FILE = os.getenv("SITES_FILE", "")
+
+# === Custom Search 設定 ===
+CSE_HL = os.getenv("CSE_HL", "zh-TW")
+# 每篇文章使用的參考連結數
+REFS_PER_ARTICLE = int(os.getenv("REFS_PER_ARTICLE", "2"))
+# 搜尋結果快取的有效時間（小時，0 = 停用快取）與結果池預取門檻
+CSE_CACHE_TTL_HOURS = float(os.getenv("CSE_CACHE_TTL_HOURS", "168"))
+CSE_POOL_MIN = int(os.getenv("CSE_POOL_MIN", "4"))
+
+# === 參考頁面擷取設定 ===
+# REF_FETCH=1 時下載參考連結頁面、擷取主要內文，並將摘錄加入產文提示
+REF_FETCH             = os.getenv("REF_FETCH", "0") == "1"
+REF_FETCH_WORKERS     = int(os.getenv("REF_FETCH_WORKERS", "4"))
+REF_FETCH_TIMEOUT     = float(os.getenv("REF_FETCH_TIMEOUT", "10"))
+REF_FETCH_MAX_BYTES   = int(os.getenv("REF_FETCH_MAX_BYTES", "1048576"))
+# 快取頁面在此時間內直接使用，超過後以 ETag / Last-Modified 重新驗證
+REF_CACHE_FRESH_HOURS = float(os.getenv("REF_CACHE_FRESH_HOURS", "24"))
+# 注入提示的摘錄總字數上限（平均分配給各參考連結）
+REF_EXCERPT_BUDGET    = int(os.getenv("REF_EXCERPT_BUDGET", "3000"))
+
+# === Gemini 設定 ===
+# GEMINI_STREAM=1 時以 SSE 串流接收並即時解析，輸出格式錯誤時提前中止
+GEMINI_STREAM  = os.getenv("GEMINI_STREAM", "0") == "1"
+GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "120"))
+# GEMINI_JSON_MODE=1 時要求結構化 JSON 輸出（responseSchema），僅修正不合格的欄位
+GEMINI_JSON_MODE = os.getenv("GEMINI_JSON_MODE", "0") == "1"
+# 有備援模型時，目前的模型超過門檻仍未回應就對下一個模型發出對沖請求（先回傳有效結果者勝出）
+# 門檻為該模型最近成功請求延遲的 p95（限制在 GEMINI_HEDGE_MIN_SECONDS 與 GEMINI_TIMEOUT 之間）；
+# 樣本數不足 GEMINI_HEDGE_MIN_SAMPLES 時使用 GEMINI_HEDGE_DEFAULT_SECONDS
+GEMINI_HEDGE_DEFAULT_SECONDS = float(os.getenv("GEMINI_HEDGE_DEFAULT_SECONDS", "45"))
+GEMINI_HEDGE_MIN_SECONDS     = float(os.getenv("GEMINI_HEDGE_MIN_SECONDS", "10"))
+GEMINI_HEDGE_MIN_SAMPLES     = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# GEMINI_CONTEXT_CACHE=1 時將每個站台固定的產文指示建立為 cachedContents，之後的請求只引用快取名稱
+# （指示需達到模型的最小快取 token 數，未達時自動改為直接附上指示）
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+# cachedContents 的最小 token 數（Gemini 2.5 Flash 為 1024，Pro 等模型更高）；估計值未達時不送出建立請求
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024"))
+# 快取的存活時間（秒）；剩餘不到 GEMINI_CACHE_REFRESH 秒時延長，已失效時重新建立
+GEMINI_CACHE_TTL     = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+GEMINI_CACHE_REFRESH = int(os.getenv("GEMINI_CACHE_REFRESH", "300"))
+SEO_TITLE_MAX = int(os.getenv("SEO_TITLE_MAX", "70"))
+SEO_DESC_MAX  = int(os.getenv("SEO_DESC_MAX", "150"))
+
+# === 管線模式設定 ===
+# PIPELINE_MODE=1 時搜尋、產文、發佈分別由獨立的 worker pool 處理，並以有界佇列串接
+PIPELINE_MODE       = os.getenv("PIPELINE_MODE", "0") == "1"
+SEARCH_WORKERS      = int(os.getenv("SEARCH_WORKERS", "2"))
+GENERATE_WORKERS    = int(os.getenv("GENERATE_WORKERS", "3"))
+PUBLISH_WORKERS     = int(os.getenv("PUBLISH_WORKERS", "1"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+# === 批次發佈設定 ===
+# WP_BATCH_PUBLISH=1 時收集產文完成的文章，以 /batch/v1（WordPress 5.6+）每批最多 WP_BATCH_SIZE 篇一次送出
+WP_BATCH_PUBLISH = os.getenv("WP_BATCH_PUBLISH", "0") == "1"
+WP_BATCH_SIZE    = int(os.getenv("WP_BATCH_SIZE", "25"))
+
+# 各 API 兩次呼叫之間的平均最小間隔（秒），取代原本每篇固定等待 5 秒
+API_MIN_INTERVAL = {
+    "cse":    float(os.getenv("CSE_MIN_INTERVAL", "1")),
+    "gemini": float(os.getenv("GEMINI_MIN_INTERVAL", "1")),
+    "wp":     float(os.getenv("WP_MIN_INTERVAL", "2")),
+}
+# 各 API 允許的瞬間突發請求數（token bucket 容量）
+API_BURST = {
+    "cse":    int(os.getenv("CSE_BURST", "1")),
+    "gemini": int(os.getenv("GEMINI_BURST", "1")),
+    "wp":     int(os.getenv("WP_BURST", "1")),
+}
 
-# === Google API URLs ===
-GENAI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GENAI_MODEL}:generateContent"
-CSE_URL   = "https://www.googleapis.com/customsearch/v1"
+# === HTTP 連線設定 ===
+HTTP_POOL_SIZE    = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES  = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "1"))
+HTTP_BACKOFF_MAX  = float(os.getenv("HTTP_BACKOFF_MAX", "60"))
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# === WordPress 站台能力 ===
+# 站台能力（已註冊的 meta 欄位、batch 端點、分類法）探測結果的有效時間（小時）
+WP_PROBE_TTL_HOURS = float(os.getenv("WP_PROBE_TTL_HOURS", "168"))
+# 將 TAGS 設為文章的 WordPress 標籤（查詢或建立對應的標籤 ID）；0 = 只在文章內文列出
+WP_ASSIGN_TAGS = os.getenv("WP_ASSIGN_TAGS", "1") == "1"
+
+# === 關鍵字排程 ===
+# 工作被放棄（重試用盡或內容重複）後，該關鍵字暫停挑選的時數；連續失敗時每次加倍，最長 KEYWORD_BACKOFF_MAX_HOURS
+KEYWORD_BACKOFF_HOURS     = float(os.getenv("KEYWORD_BACKOFF_HOURS", "24"))
+KEYWORD_BACKOFF_MAX_HOURS = float(os.getenv("KEYWORD_BACKOFF_MAX_HOURS", "720"))
+
+# === 重複內容偵測 ===
+# DUP_CHECK=1 時以 MinHash 索引比對新文章與站台既有文章，相似度達 DUP_THRESHOLD 視為重複
+DUP_CHECK     = os.getenv("DUP_CHECK", "0") == "1"
+DUP_THRESHOLD = float(os.getenv("DUP_THRESHOLD", "0.4"))
+# 重複時帶著「換個角度」的提示重新產文的次數，仍重複則放棄該關鍵字
+DUP_RETRIES   = int(os.getenv("DUP_RETRIES", "1"))
+# 字元 shingle 長度（中文以連續字元切分）
+DUP_SHINGLE   = int(os.getenv("DUP_SHINGLE", "4"))
+
+# === API 金鑰配額設定 ===
+# 每把金鑰每天的呼叫上限（0 = 不限制）；Custom Search 免費額度為每天 100 次
+CSE_DAILY_LIMIT    = int(os.getenv("CSE_DAILY_LIMIT", "100"))
+GEMINI_DAILY_LIMIT = int(os.getenv("GEMINI_DAILY_LIMIT", "0"))
+# 金鑰收到 429（每分鐘限制）後暫停使用的秒數；每日配額用盡時則暫停到配額重置
+KEY_COOLDOWN_SECONDS = float(os.getenv("KEY_COOLDOWN_SECONDS", "60"))
+# Google API 每日配額的重置時區（太平洋時間午夜）
+QUOTA_TZ = os.getenv("QUOTA_TZ", "America/Los_Angeles")
+
+# === 狀態檔案設定 ===
+# 所有執行期狀態（已使用連結資料庫等）存放於 STATE_DIR
+STATE_DIR = os.getenv("STATE_DIR", ".")
+# 各站台自己的狀態（已使用連結、slug 索引、工作日誌）；搜尋與頁面快取由所有站台共用
+REFS_DB_NAME  = "used_refs.db"
+SLUGS_DB_NAME = "wp_slugs.db"
+JOBS_DB_NAME  = "jobs.db"
+KEYWORDS_DB_NAME = "keywords.db"
+SITE_DB_NAME  = "wp_site.db"
+SIMILAR_DB_NAME = "wp_similar.db"
+CSE_CACHE_DB = os.path.join(STATE_DIR, "cse_cache.db")
+QUOTA_DB = os.path.join(STATE_DIR, "api_quota.db")
+MODEL_STATS_DB = os.path.join(STATE_DIR, "gemini_models.db")
+PAGE_CACHE_DIR = os.path.join(STATE_DIR, "page_cache")
+
+# === 執行指標設定 ===
+# 每次執行的 JSON 報告與 Prometheus textfile collector 檔案存放位置
+METRICS_DIR   = os.getenv("METRICS_DIR", os.path.join(STATE_DIR, "metrics"))
+PROM_TEXTFILE = os.getenv("PROM_TEXTFILE", os.path.join(METRICS_DIR, "wp_article_generator.prom"))
+# 指定單一關鍵字以 cProfile / tracemalloc 剖析其處理過程
+PROFILE_KEYWORD = os.getenv("PROFILE_KEYWORD", "").strip()
+# 同一工作最多嘗試次數（跨執行累計），超過後放棄
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 已使用連結保留天數，超過後可再次被引用（0 = 永久保留）
+REFS_EXPIRE_DAYS = int(os.getenv("REFS_EXPIRE_DAYS", "0"))
+
+# 舊版 JSON 格式，啟動時會自動匯入預設站台的已使用連結資料庫
+USED_FILE = "used_refs.json"
 
 # === 日誌設定 ===
+LOG_FILE  = os.getenv("LOG_FILE", "wp_article_generator.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# text = 原本的單行文字格式；json = 每行一個 JSON 物件，附上 run_id、站台、關鍵字與階段
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# 日誌檔超過 LOG_MAX_BYTES 或跨日時輪替，舊日誌以 gzip 壓縮存放於 LOG_ARCHIVE_DIR，保留 LOG_BACKUP_COUNT 份
+LOG_MAX_BYTES    = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_DAILY = os.getenv("LOG_ROTATE_DAILY", "1") == "1"
+LOG_BACKUP_COUNT = max(1, int(os.getenv("LOG_BACKUP_COUNT", "14")))
+LOG_ARCHIVE_DIR  = os.getenv("LOG_ARCHIVE_DIR", os.path.join(STATE_DIR, "logs"))
+# API 回應等長內容寫入日誌時保留的字元數
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "500"))
+# 單筆日誌訊息的長度上限（其餘截斷），避免整篇文章或大型回應寫進日誌
+LOG_MESSAGE_MAX = 4000
+
+# 目前處理中的工作（站台、關鍵字與階段），供指標、日誌標記與多站台配額分配使用
+current_job = contextvars.ContextVar("current_job", default=None)
+# 日誌標記用的本次執行 ID（建立 RunMetrics 時設定）
+log_context = {"run_id": ""}
+
+def log_excerpt(text, limit=None):
+    """截斷要寫入日誌的長內容（API 回應等），保留開頭並註明原始長度"""
+    limit = LOG_PAYLOAD_CHARS if limit is None else limit
+    if not text or len(text) <= limit:
+        return text
+    return f"{text[:limit]}…（共 {len(text)} 字元）"
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    呼叫端只負責格式化訊息、截斷過長內容並附上工作標記，再放入佇列；
+    寫檔與輸出到控制台由 QueueListener 的背景執行緒處理，不佔用 API 請求的時間
+    """
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if len(record.msg) > LOG_MESSAGE_MAX:
+            record.msg = record.message = log_excerpt(record.msg, LOG_MESSAGE_MAX)
+        job = current_job.get() or {}
+        record.run_id = log_context["run_id"]
+        record.site = job.get("site")
+        record.keyword = job.get("keyword")
+        record.stage = job.get("stage")
+        return record
+
+class JsonLogFormatter(logging.Formatter):
+    """JSON lines 格式：時間、等級、訊息，以及有值的 run_id / site / keyword / stage"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for key in ("run_id", "site", "keyword", "stage"):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        if record.name != "root" and record.name != __name__:
+            entry["logger"] = record.name
+        return json.dumps(entry, ensure_ascii=False)
+
+def _compress_log(source, dest):
+    """
+    輪替時將日誌以 gzip 複製到封存目錄後截斷原檔，而不是改名：
+    docker-compose 以單一檔案掛載日誌，改名會失敗，而截斷後主機端看到的仍是同一個檔案
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    with open(source, "r+b") as f:
+        f.truncate(0)
+
+class ArchivingLogHandler(logging.handlers.RotatingFileHandler):
+    """依大小（LOG_MAX_BYTES）或跨日輪替的日誌檔，舊檔壓縮為 LOG_ARCHIVE_DIR/<檔名>.<n>.gz"""
+
+    def __init__(self, filename):
+        super().__init__(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+        self.namer = lambda name: os.path.join(LOG_ARCHIVE_DIR, os.path.basename(name) + ".gz")
+        self.rotator = _compress_log
+        # 每天由 cron 啟動一次時，以檔案最後修改日判斷是否已跨日
+        self.day = datetime.fromtimestamp(os.path.getmtime(filename)).date() if os.path.exists(filename) else None
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        day = datetime.fromtimestamp(record.created).date()
+        size = self.stream.tell()
+        if size == 0:
+            self.day = day
+            return False
+        if LOG_ROTATE_DAILY and self.day is not None and day != self.day:
+            return True
+        return bool(self.maxBytes) and size >= self.maxBytes
+
+    def doRollover(self):
+        super().doRollover()
+        self.day = None
+
 def setup_logging():
-    """設定日誌記錄"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(LOG_FILE, encoding='utf-8'),
-            logging.StreamHandler()  # 同時輸出到控制台
-        ]
-    )
+    """
+    設定日誌記錄：所有日誌先放入佇列，由背景執行緒寫入可輪替的日誌檔並輸出到控制台；
+    程式結束時會先寫完佇列中剩下的日誌
+    """
+    formatter = JsonLogFormatter() if LOG_FORMAT == "json" else \
+        logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [ArchivingLogHandler(LOG_FILE), logging.StreamHandler()]  # 同時輸出到控制台
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_handler = LogQueueHandler(log_queue)
+    # 佇列中的訊息只含本文（與例外堆疊），時間與等級由寫檔端的 formatter 加上
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), handlers=[queue_handler])
     return logging.getLogger(__name__)
 
 logger = setup_logging()
@@ -49,33 +329,123 @@ logger = setup_logging()
 # ---------------------------------------------------------------
 # SEO 解析工具
 # ---------------------------------------------------------------
+# Gemini 輸出中的標記與對應欄位
+OUTPUT_MARKERS = {
+    "SEO_TITLE:": "seo_title",
+    "SEO_DESC:": "seo_desc",
+    "SEO_KEYWORD:": "seo_keyword",
+    "ARTICLE:": "article",
+}
+_MARKER_RE = re.compile("|".join(re.escape(m) for m in OUTPUT_MARKERS))
+_MARKER_OVERLAP = max(len(m) for m in OUTPUT_MARKERS) - 1
+
+# 第一個標記之前允許的雜訊長度，以及各 SEO 欄位的長度上限（超過即視為格式錯誤）
+OUTPUT_PREAMBLE_LIMIT = 300
+OUTPUT_FIELD_LIMITS = {"seo_title": 300, "seo_desc": 800, "seo_keyword": 300}
+
+# 程式碼區塊標記（```、```json、```html）與分隔線
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_RULE_RE = re.compile(r"(^\s*-{3,}\s*|\s*-{3,}\s*$)")
+
+class GeminiOutputParser:
+    """
+    Gemini 輸出的單次掃描解析器，可逐段餵入串流內容。
+    每段文字只掃描一次標記；進入 ARTICLE 後直接累積內容不再掃描。
+    一旦輸出明顯不符合格式（找不到標記、欄位過長、缺少標題就開始文章、標記重複），
+    會設定 error，串流呼叫端可據此提前中止。
+    解析已完整收到的文字時使用 streaming=False：不套用這些提前中止的判斷，重複的標記以第一次出現的為準。
+    """
+
+    def __init__(self, streaming=True):
+        self.streaming = streaming
+        self.fields = {}
+        self.field = None       # 目前正在累積的欄位（None 表示尚未遇到第一個標記）
+        self.buf = ""           # 尚未歸屬的標頭文字
+        self.scan_pos = 0       # buf 中下一次開始搜尋標記的位置
+        self.article = []       # ARTICLE 之後的內容片段
+        self.error = None
+
+    def feed(self, chunk):
+        """餵入一段文字，回傳目前是否仍符合格式"""
+        if self.error:
+            return False
+        if self.field == "article":
+            self.article.append(chunk)
+            return True
+
+        self.buf += chunk
+        while True:
+            m = _MARKER_RE.search(self.buf, self.scan_pos)
+            if not m:
+                break
+            self._close_field(self.buf[:m.start()])
+            if self.error:
+                return False
+            field = OUTPUT_MARKERS[m.group()]
+            if field in self.fields and self.streaming:
+                self.error = f"重複的標記 {m.group()}"
+                return False
+            if field == "article" and "seo_title" not in self.fields and self.streaming:
+                self.error = "缺少 SEO_TITLE 即開始 ARTICLE"
+                return False
+            self.field = field
+            rest = self.buf[m.end():]
+            self.buf = ""
+            self.scan_pos = 0
+            if field == "article":
+                self.article.append(rest)
+                return True
+            self.buf = rest
+
+        self.scan_pos = max(0, len(self.buf) - _MARKER_OVERLAP)
+        self._check_length()
+        return not self.error
+
+    def _clean(self, value):
+        value = _FENCE_RE.sub("", value)
+        return _RULE_RE.sub("", value).strip()
+
+    def _close_field(self, value):
+        if self.field is None:
+            if self.streaming and len(self._clean(value)) > OUTPUT_PREAMBLE_LIMIT:
+                self.error = "第一個標記前出現過多內容"
+        else:
+            self.fields.setdefault(self.field, self._clean(value))
+
+    def _check_length(self):
+        if not self.streaming:
+            return
+        if self.field is None:
+            if len(self.buf) > OUTPUT_PREAMBLE_LIMIT * 2 and len(self._clean(self.buf)) > OUTPUT_PREAMBLE_LIMIT:
+                self.error = "找不到 SEO_TITLE 等標記"
+        elif len(self.buf) > OUTPUT_FIELD_LIMITS[self.field]:
+            self.error = f"{self.field} 欄位過長"
+
+    def finish(self):
+        """結束解析，回傳欄位字典（缺少的欄位為空字串）"""
+        if self.field == "article":
+            self.fields["article"] = self._clean("".join(self.article))
+        elif not self.error:
+            self._close_field(self.buf)
+        self.buf = ""
+        result = {name: "" for name in OUTPUT_MARKERS.values()}
+        result.update(self.fields)
+        return result
+
 def parse_gemini_output(text):
     """解析 Gemini 輸出，提取 SEO metadata 和文章內容"""
     try:
-        # 提取 SEO 標題
-        seo_title = extract_between(text, "SEO_TITLE:", "SEO_DESC:")
-        if not seo_title:
-            seo_title = extract_after(text, "SEO_TITLE:")
-        
-        # 提取 SEO 描述
-        seo_desc = extract_between(text, "SEO_DESC:", "SEO_KEYWORD:")
-        if not seo_desc:
-            seo_desc = extract_after(text, "SEO_DESC:")
-        
-        # 提取 SEO 關鍵字
-        seo_keyword = extract_between(text, "SEO_KEYWORD:", "ARTICLE:")
-        if not seo_keyword:
-            seo_keyword = extract_after(text, "SEO_KEYWORD:")
-        
-        # 提取文章內容
-        article = extract_after(text, "ARTICLE:")
-        
-        # 清理文字
-        seo_title = seo_title.strip() if seo_title else ""
-        seo_desc = seo_desc.strip() if seo_desc else ""
-        seo_keyword = seo_keyword.strip() if seo_keyword else ""
-        article = article.strip() if article else ""
-        
+        parser = GeminiOutputParser(streaming=False)
+        parser.feed(text)
+        fields = parser.finish()
+        if parser.error:
+            logger.warning(f"Gemini 輸出格式異常: {parser.error}")
+
+        seo_title = fields["seo_title"]
+        seo_desc = fields["seo_desc"]
+        seo_keyword = fields["seo_keyword"]
+        article = fields["article"]
+
         logger.info(f"解析 SEO 資料 - 標題: {seo_title[:50]}..., 描述: {seo_desc[:50]}..., 關鍵字: {seo_keyword}")
         
         return seo_title, seo_desc, seo_keyword, article
@@ -84,32 +454,6 @@ def parse_gemini_output(text):
         logger.error(f"解析 Gemini 輸出失敗: {e}")
         return "", "", "", ""
 
-def extract_between(text, start_marker, end_marker):
-    """提取兩個標記之間的文字"""
-    try:
-        start_idx = text.find(start_marker)
-        if start_idx == -1:
-            return ""
-        start_idx += len(start_marker)
-        
-        end_idx = text.find(end_marker, start_idx)
-        if end_idx == -1:
-            return text[start_idx:].strip()
-        
-        return text[start_idx:end_idx].strip()
-    except:
-        return ""
-
-def extract_after(text, marker):
-    """提取標記之後的文字"""
-    try:
-        idx = text.find(marker)
-        if idx == -1:
-            return ""
-        return text[idx + len(marker):].strip()
-    except:
-        return ""
-
 # ---------------------------------------------------------------
 # 工具
 # ---------------------------------------------------------------
@@ -119,78 +463,1676 @@ def slugify(text):
     text = re.sub(r"-{2,}", "-", text).strip("-")
     return text[:90]
 
-def load_used_refs():
-    if os.path.exists(USED_FILE):
-        with open(USED_FILE, "r") as f:
-            return json.load(f).get("used_urls", [])
-    return []
+# ---------------------------------------------------------------
+# 已使用參考連結資料庫
+# ---------------------------------------------------------------
+# 正規化時移除的追蹤參數
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid", "_ga", "igshid"}
+
+def normalize_url(url):
+    """將 URL 正規化為比對用的鍵值：忽略 scheme、大小寫主機、結尾斜線、片段與追蹤參數"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    ]
+    return urlunsplit(("", host, path, urlencode(sorted(query)), ""))
+
+def open_state_db(path):
+    """開啟狀態用的 SQLite 資料庫（WAL 模式，可跨執行緒共用，自動提交）"""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+class RefStore:
+    """
+    以 SQLite 儲存已使用的參考連結。
+    以正規化 URL 為主鍵，查詢為索引查找；每次新增都是獨立交易（WAL），程式中斷也不會遺失已寫入的紀錄。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS used_refs ("
+            " url_key TEXT PRIMARY KEY, url TEXT NOT NULL, keyword TEXT, used_at TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_used_refs_used_at ON used_refs(used_at)")
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM used_refs WHERE url_key = ?", (normalize_url(url),)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM used_refs").fetchone()[0]
+
+    def add(self, urls, keyword=None, used_at=None):
+        """新增已使用連結（已存在者略過）"""
+        used_at = used_at or datetime.now().isoformat(timespec="seconds")
+        rows = [(normalize_url(u), u, keyword, used_at) for u in urls]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO used_refs VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute("COMMIT")
+
+    def expire(self, days):
+        """刪除超過 days 天的紀錄，回傳刪除筆數"""
+        if days <= 0:
+            return 0
+        cutoff = datetime.fromtimestamp(time.time() - days * 86400).isoformat(timespec="seconds")
+        with self.lock:
+            cur = self.conn.execute("DELETE FROM used_refs WHERE used_at < ?", (cutoff,))
+        return cur.rowcount
+
+    def compact(self, vacuum=False):
+        """將 WAL 合併回主檔，必要時重建資料庫釋放空間"""
+        with self.lock:
+            if vacuum:
+                self.conn.execute("VACUUM")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def migrate_json(self, json_path):
+        """匯入舊版 used_refs.json（依檔案大小與修改時間判斷，只匯入一次）"""
+        if not os.path.exists(json_path):
+            return 0
+        stat = os.stat(json_path)
+        marker = f"{stat.st_size}:{int(stat.st_mtime)}"
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if row and row[0] == marker:
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                urls = json.load(f).get("used_urls", [])
+        except (OSError, ValueError) as e:
+            logger.error(f"讀取 {json_path} 失敗，略過匯入: {e}")
+            return 0
+        self.add(urls, used_at=datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('json_migrated', ?)", (marker,))
+        logger.info(f"已從 {json_path} 匯入 {len(urls)} 筆已使用連結")
+        return len(urls)
+
+    def close(self):
+        self.compact()
+        self.conn.close()
+
+def load_used_refs(site):
+    """開啟站台的已使用連結資料庫，匯入舊版 JSON（僅預設站台）並清除過期紀錄"""
+    os.makedirs(site.state_dir, exist_ok=True)
+    store = RefStore(os.path.join(site.state_dir, REFS_DB_NAME))
+    if site.state_dir == STATE_DIR:
+        store.migrate_json(USED_FILE)
+    expired = store.expire(REFS_EXPIRE_DAYS)
+    if expired:
+        logger.info(f"已清除 {expired} 筆超過 {REFS_EXPIRE_DAYS} 天的已使用連結")
+        store.compact(vacuum=True)
+    return store
+
+# ---------------------------------------------------------------
+# 執行指標：延遲分布、傳輸量與 token 用量
+# ---------------------------------------------------------------
+# 延遲直方圖的區間上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class RunMetrics:
+    """單次執行的指標：每種操作的延遲直方圖、錯誤數、傳輸量，以及每個關鍵字的 Gemini token 用量"""
+
+    def __init__(self, run_id=""):
+        self.run_id = run_id
+        if run_id:
+            log_context["run_id"] = run_id
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.tokens = {}
+        self.posts = {"success": 0, "failure": 0}
+        self.site_posts = {}
+
+    def observe(self, op, seconds, bytes_in=0, bytes_out=0, error=False, retries=0):
+        with self.lock:
+            stat = self.ops.get(op)
+            if stat is None:
+                stat = {"count": 0, "errors": 0, "retries": 0, "sum": 0.0, "bytes_in": 0, "bytes_out": 0,
+                        "buckets": [0] * len(LATENCY_BUCKETS), "samples": []}
+                self.ops[op] = stat
+            stat["count"] += 1
+            stat["errors"] += int(error)
+            stat["retries"] += retries
+            stat["sum"] += seconds
+            stat["bytes_in"] += bytes_in
+            stat["bytes_out"] += bytes_out
+            stat["samples"].append(seconds)
+            for idx, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stat["buckets"][idx] += 1
+                    break
+
+    def record_post(self, site, ok):
+        with self.lock:
+            entry = self.site_posts.setdefault(site, {"success": 0, "failure": 0})
+            entry["success" if ok else "failure"] += 1
+
+    def add_tokens(self, keyword, usage):
+        with self.lock:
+            entry = self.tokens.setdefault(keyword or "-", {"prompt": 0, "output": 0, "cached": 0, "calls": 0})
+            entry["prompt"] += usage.get("promptTokenCount", 0)
+            entry["output"] += usage.get("candidatesTokenCount", 0)
+            entry["cached"] += usage.get("cachedContentTokenCount", 0)
+            entry["calls"] += 1
+
+    def report(self):
+        """產生可序列化的報告字典"""
+        with self.lock:
+            ops = {
+                op: {
+                    "count": stat["count"],
+                    "errors": stat["errors"],
+                    "retries": stat["retries"],
+                    "total_seconds": round(stat["sum"], 3),
+                    "p50_seconds": round(percentile(stat["samples"], 0.5), 3),
+                    "p95_seconds": round(percentile(stat["samples"], 0.95), 3),
+                    "max_seconds": round(max(stat["samples"]), 3),
+                    "bytes_in": stat["bytes_in"],
+                    "bytes_out": stat["bytes_out"],
+                }
+                for op, stat in sorted(self.ops.items())
+            }
+            tokens = {k: dict(v) for k, v in self.tokens.items()}
+            site_posts = {k: dict(v) for k, v in self.site_posts.items()}
+        published = self.posts["success"]
+        total_tokens = sum(t["prompt"] + t["output"] for t in tokens.values())
+        return {
+            "run_id": self.run_id,
+            "started_at": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "duration_seconds": round(time.time() - self.started, 3),
+            "posts": dict(self.posts),
+            "posts_by_site": site_posts,
+            "fair_share": fair_share_report(),
+            "api_quota": api_keys.report() if api_keys is not None else None,
+            "gemini_models": model_stats.report() if model_stats is not None else None,
+            "operations": ops,
+            "gemini": dict(gemini_stats),
+            "tokens_by_keyword": tokens,
+            "tokens_total": total_tokens,
+            "tokens_per_published_post": round(total_tokens / published, 1) if published else None,
+        }
+
+    def prometheus(self):
+        """Prometheus textfile collector 格式"""
+        lines = [
+            "# HELP wp_article_duration_seconds Latency of external calls and pipeline stages.",
+            "# TYPE wp_article_duration_seconds histogram",
+        ]
+        with self.lock:
+            for op, stat in sorted(self.ops.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stat["buckets"]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(f'wp_article_duration_seconds_bucket{{op="{op}",le="{le}"}} {cumulative}')
+                lines.append(f'wp_article_duration_seconds_sum{{op="{op}"}} {stat["sum"]:.6f}')
+                lines.append(f'wp_article_duration_seconds_count{{op="{op}"}} {stat["count"]}')
+            lines += ["# HELP wp_article_errors_total Failed external calls and stages.",
+                      "# TYPE wp_article_errors_total counter"]
+            lines += [f'wp_article_errors_total{{op="{op}"}} {stat["errors"]}' for op, stat in sorted(self.ops.items())]
+            lines += ["# HELP wp_article_bytes_total Bytes sent and received per operation.",
+                      "# TYPE wp_article_bytes_total counter"]
+            for op, stat in sorted(self.ops.items()):
+                lines.append(f'wp_article_bytes_total{{op="{op}",direction="in"}} {stat["bytes_in"]}')
+                lines.append(f'wp_article_bytes_total{{op="{op}",direction="out"}} {stat["bytes_out"]}')
+            lines += ["# HELP wp_article_site_posts Posts published or failed per site in the last run.",
+                      "# TYPE wp_article_site_posts gauge"]
+            for site, posts in sorted(self.site_posts.items()):
+                lines.append(f'wp_article_site_posts{{site="{site}",result="success"}} {posts["success"]}')
+                lines.append(f'wp_article_site_posts{{site="{site}",result="failure"}} {posts["failure"]}')
+            prompt = sum(t["prompt"] for t in self.tokens.values())
+            output = sum(t["output"] for t in self.tokens.values())
+        lines += [
+            "# HELP wp_article_gemini_tokens_total Gemini tokens used in the last run.",
+            "# TYPE wp_article_gemini_tokens_total gauge",
+            f'wp_article_gemini_tokens_total{{type="prompt"}} {prompt}',
+            f'wp_article_gemini_tokens_total{{type="output"}} {output}',
+            "# HELP wp_article_posts Posts published or failed in the last run.",
+            "# TYPE wp_article_posts gauge",
+            f'wp_article_posts{{result="success"}} {self.posts["success"]}',
+            f'wp_article_posts{{result="failure"}} {self.posts["failure"]}',
+            "# HELP wp_article_run_duration_seconds Wall time of the last run.",
+            "# TYPE wp_article_run_duration_seconds gauge",
+            f"wp_article_run_duration_seconds {time.time() - self.started:.3f}",
+            "# HELP wp_article_last_run_timestamp_seconds Start time of the last run.",
+            "# TYPE wp_article_last_run_timestamp_seconds gauge",
+            f"wp_article_last_run_timestamp_seconds {self.started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+def write_atomic(path, text):
+    """先寫入暫存檔再改名，避免讀取端看到寫到一半的檔案"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def write_run_report(run_metrics):
+    """寫入本次執行的 JSON 報告（另存一份 latest.json）與 Prometheus 指標檔"""
+    try:
+        report = json.dumps(run_metrics.report(), ensure_ascii=False, indent=2)
+        write_atomic(os.path.join(METRICS_DIR, f"run-{run_metrics.run_id}.json"), report)
+        write_atomic(os.path.join(METRICS_DIR, "latest.json"), report)
+        if PROM_TEXTFILE:
+            write_atomic(PROM_TEXTFILE, run_metrics.prometheus())
+        logger.info(f"執行報告已寫入: {METRICS_DIR}")
+    except OSError as e:
+        logger.error(f"寫入執行報告失敗: {e}")
+
+def new_run_id():
+    return datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{random.getrandbits(16):04x}"
+
+metrics = RunMetrics()
 
-def save_used_refs(urls):
-    with open(USED_FILE, "w") as f:
-        json.dump({"used_urls": urls}, f, ensure_ascii=False, indent=2)
+# ---------------------------------------------------------------
+# API 金鑰輪替與每日配額
+# ---------------------------------------------------------------
+# 使用金鑰池的 API 與每把金鑰的每日上限
+KEYED_APIS = {"cse": CSE_DAILY_LIMIT, "gemini": GEMINI_DAILY_LIMIT}
+
+class QuotaExhausted(requests.exceptions.RequestException):
+    """所有金鑰的配額都已用盡或暫停中"""
+
+def quota_zone():
+    try:
+        return ZoneInfo(QUOTA_TZ)
+    except (ZoneInfoNotFoundError, ValueError):
+        # 映像檔缺少時區資料時以 UTC-8 近似
+        return timezone(timedelta(hours=-8))
+
+def quota_day():
+    """目前的配額日（依 QUOTA_TZ）"""
+    return datetime.now(quota_zone()).date().isoformat()
+
+def next_quota_reset():
+    """下一次配額重置的時間戳記"""
+    now = datetime.now(quota_zone())
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    return midnight.timestamp()
+
+def key_id(key):
+    """金鑰只以雜湊值寫入狀態檔與日誌"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:10]
+
+def is_daily_quota_error(r):
+    """429/403 回應是否為每日配額用盡（而不是每分鐘限制）"""
+    text = r.text[:2000].lower()
+    return any(marker in text for marker in ("dailylimit", "per day", "perday", "quota exceeded for quota metric"))
+
+class KeyPool:
+    """
+    Google API 金鑰池：記錄每把金鑰在每個 API 的當日用量（跨執行保存，配額日改變時自然歸零），
+    收到 429 或配額錯誤的金鑰暫停使用，請求改用下一把金鑰。
+    """
+
+    def __init__(self, path, keys):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage (key_id TEXT, api TEXT, day TEXT, count INTEGER NOT NULL,"
+            " PRIMARY KEY (key_id, api, day))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cooldown (key_id TEXT, api TEXT, until REAL NOT NULL, PRIMARY KEY (key_id, api))"
+        )
+        self.conn.execute("DELETE FROM usage WHERE day < ?", ((datetime.now() - timedelta(days=7)).date().isoformat(),))
+        self.set_keys(keys)
+
+    def set_keys(self, keys):
+        with self.lock:
+            self.keys = list(dict.fromkeys(keys))
+
+    def _used(self, kid, api, day):
+        row = self.conn.execute("SELECT count FROM usage WHERE key_id = ? AND api = ? AND day = ?",
+                                (kid, api, day)).fetchone()
+        return row[0] if row else 0
+
+    def _cooling_until(self, kid, api):
+        row = self.conn.execute("SELECT until FROM cooldown WHERE key_id = ? AND api = ?", (kid, api)).fetchone()
+        return row[0] if row and row[0] > time.time() else 0
+
+    def acquire(self, api):
+        """選出可用且當日用量最少的金鑰並計入一次用量；沒有可用金鑰時回傳 None"""
+        limit = KEYED_APIS.get(api, 0)
+        day = quota_day()
+        with self.lock:
+            best = None
+            for key in self.keys:
+                kid = key_id(key)
+                if self._cooling_until(kid, api):
+                    continue
+                used = self._used(kid, api, day)
+                if limit and used >= limit:
+                    continue
+                if best is None or used < best[1]:
+                    best = (key, used)
+            if best is None:
+                return None
+            self.conn.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, 1) ON CONFLICT (key_id, api, day) DO UPDATE SET count = count + 1",
+                (key_id(best[0]), api, day)
+            )
+            return best[0]
+
+    def cooldown(self, key, api, daily=False, seconds=None):
+        """暫停金鑰：每日配額用盡時暫停到配額重置，否則依 Retry-After（預設 KEY_COOLDOWN_SECONDS）"""
+        seconds = KEY_COOLDOWN_SECONDS if seconds is None else seconds
+        until = next_quota_reset() if daily else time.time() + seconds
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cooldown VALUES (?, ?, ?)", (key_id(key), api, until))
+        reason = "每日配額用盡，暫停到配額重置" if daily else f"暫停 {seconds:.0f} 秒"
+        logger.warning(f"[{api}] 金鑰 {key_id(key)} {reason}")
+
+    def next_available(self, api):
+        """所有金鑰都暫停時，最早恢復的剩餘秒數（沒有任何金鑰會恢復時回傳 None）"""
+        with self.lock:
+            waits = [self._cooling_until(key_id(key), api) - time.time() for key in self.keys]
+        waits = [w for w in waits if w > 0]
+        return min(waits) if waits else None
+
+    def remaining(self, api):
+        """目前可用金鑰的當日剩餘呼叫數；不限制時回傳 None"""
+        limit = KEYED_APIS.get(api, 0)
+        if not limit:
+            return None
+        day = quota_day()
+        with self.lock:
+            total = 0
+            for key in self.keys:
+                kid = key_id(key)
+                if self._cooling_until(kid, api) > next_quota_reset() - 1:
+                    # 已暫停到配額重置，今天不會再有額度
+                    continue
+                total += max(0, limit - self._used(kid, api, day))
+        return total
+
+    def can_afford(self, cost):
+        """剩餘配額是否足以完成 cost（{api: 呼叫數}）"""
+        for api, calls in cost.items():
+            remaining = self.remaining(api)
+            if remaining is not None and remaining < calls:
+                return False
+        return True
+
+    def report(self):
+        day = quota_day()
+        with self.lock:
+            return {
+                api: {key_id(key): {"used": self._used(key_id(key), api, day),
+                                    "cooling": bool(self._cooling_until(key_id(key), api))} for key in self.keys}
+                for api in KEYED_APIS
+            }
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+# 由 main() / run_daemon() 開啟；未開啟時（例如 bench.py）請求沿用呼叫端提供的金鑰
+api_keys = None
+
+def load_api_keys():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    pool = KeyPool(QUOTA_DB, GOOGLE_API_KEYS)
+    logger.info(f"Google API 金鑰 {len(pool.keys)} 把，今日剩餘配額 - "
+                + ", ".join(f"{api}: {'不限' if pool.remaining(api) is None else pool.remaining(api)}" for api in KEYED_APIS))
+    return pool
+
+def apply_api_key(api, kwargs, key):
+    """將金鑰放入請求（CSE 為查詢參數，Gemini 為標頭）"""
+    if api == "cse":
+        kwargs["params"] = {**(kwargs.get("params") or {}), "key": key}
+    else:
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), "x-goog-api-key": key}
+
+# ---------------------------------------------------------------
+# HTTP 用戶端：連線池、重試與流量限制
+# ---------------------------------------------------------------
+class TokenBucket:
+    """執行緒安全的 token bucket，rate 為每秒補充的 token 數"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個 token，不足時等待到可用為止"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class FairShare:
+    """
+    多站台共用同一個 API 額度時的加權公平排程（virtual time）：
+    等待中的站台依虛擬時間排序，每次放行虛擬時間最小者，放行後其虛擬時間增加 1/權重。
+    閒置後重新加入的站台從目前的虛擬時間起算，不會累積額度造成突發。
+    """
+
+    def __init__(self, weights):
+        self.weights = dict(weights)
+        self.cond = threading.Condition()
+        self.vtime = {}
+        self.waiting = {}
+        self.granted = {}
+        self.clock = 0.0
+        self.busy = False
+
+    def _next(self):
+        return min((site for site, n in self.waiting.items() if n), key=lambda site: self.vtime[site])
+
+    def acquire(self, site, take):
+        """輪到 site 時呼叫 take()（取得底層 token bucket 的額度），同時間只有一個站台在等待額度"""
+        with self.cond:
+            if not self.waiting.get(site):
+                self.vtime[site] = max(self.vtime.get(site, 0.0), self.clock)
+            self.waiting[site] = self.waiting.get(site, 0) + 1
+            while self.busy or self._next() != site:
+                self.cond.wait()
+            self.busy = True
+            self.waiting[site] -= 1
+        try:
+            take()
+        finally:
+            with self.cond:
+                self.clock = self.vtime[site]
+                self.vtime[site] += 1 / self.weights.get(site, 1.0)
+                self.granted[site] = self.granted.get(site, 0) + 1
+                self.busy = False
+                self.cond.notify_all()
+
+# 多站台共用 Google 配額的 API；每個站台的 WordPress 是不同伺服器，依主機分別節流
+FAIR_SHARE_APIS = ("gemini", "cse")
+
+_http_lock = threading.Lock()
+_sessions = {}
+_rate_limiters = {}
+_fair_shares = {}
+
+def configure_fair_share(sites):
+    """多站台時為共用配額的 API 建立加權公平排程；單一站台時不需要"""
+    with _http_lock:
+        _fair_shares.clear()
+        if len(sites) > 1:
+            weights = {site.name: site.weight for site in sites}
+            for api in FAIR_SHARE_APIS:
+                _fair_shares[api] = FairShare(weights)
+
+def fair_share_report():
+    """各 API 放行給每個站台的呼叫次數"""
+    return {api: dict(share.granted) for api, share in _fair_shares.items()}
+
+def get_session(api):
+    """取得指定 API 專用的 requests.Session（保持連線、重複使用 TLS 連線）"""
+    with _http_lock:
+        session = _sessions.get(api)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[api] = session
+        return session
+
+def pace(api, url=None):
+    """
+    依 API_MIN_INTERVAL / API_BURST 為指定 API 取得呼叫額度，必要時等待。
+    WordPress 依主機分別計算；多站台時共用配額的 API 依站台權重輪流取得額度。
+    """
+    key = f"{api}:{urlsplit(url).netloc}" if api == "wp" and url else api
+    with _http_lock:
+        bucket = _rate_limiters.get(key)
+        if bucket is None:
+            interval = API_MIN_INTERVAL.get(api, 0)
+            rate = 1 / interval if interval > 0 else 0
+            bucket = TokenBucket(rate, API_BURST.get(api, 1))
+            _rate_limiters[key] = bucket
+        share = _fair_shares.get(api)
+    job = current_job.get()
+    if share is not None and job and job.get("site"):
+        share.acquire(job["site"], bucket.acquire)
+    else:
+        bucket.acquire()
+
+def parse_retry_after(value):
+    """解析 Retry-After 標頭（秒數或 HTTP 日期），無法解析時回傳 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """計算第 attempt 次重試前的等待時間（指數退避 + full jitter，優先採用 Retry-After）"""
+    if retry_after is not None:
+        return min(retry_after, HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+def connect_failed(e):
+    """連線錯誤是否發生在建立連線階段（連線逾時、連線被拒、DNS 解析失敗），此時請求確定未送達伺服器"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+def api_request(api, method, url, op=None, prepare=None, idempotent=True, pinned_key=None, **kwargs):
+    """
+    所有外部 API 呼叫的共用入口：使用各 API 的連線池與流量限制，
+    遇到 429/5xx 或連線錯誤時以指數退避重試。
+    重試用盡後回傳最後一次的回應（或拋出最後一次的連線例外），由呼叫端判斷狀態碼。
+    idempotent=False 用於重送可能造成重複寫入的請求（建立 WordPress 文章）：只在確定未被處理時重試
+    （429，或建立連線階段就失敗：連線逾時、連線被拒、DNS 解析失敗），5xx、讀取逾時與連線中斷
+    直接回傳或拋出，由呼叫端確認結果後再決定是否重送。
+    op 為指標中的操作名稱（預設為 api），延遲包含所有重試與等待時間。
+    Google API 在金鑰池開啟時由池中選用金鑰；收到 429 或配額錯誤時暫停該金鑰並立即改用下一把。
+    prepare(kwargs) 在每次送出前（選定金鑰後）回傳實際送出的參數，用於與金鑰綁定的內容（Gemini 快取）。
+    pinned_key 固定使用指定的金鑰（操作與金鑰綁定的資源時）：收到 429 時仍暫停該金鑰讓其他請求改用別把，
+    本身則以退避重試同一把金鑰。
+    """
+    session = get_session(api)
+    pool = api_keys if api in KEYED_APIS else None
+    attempt = 0
+    start = time.perf_counter()
+    r = None
+    try:
+        while True:
+            key = None
+            if pinned_key is not None:
+                key = pinned_key
+                apply_api_key(api, kwargs, key)
+            elif pool is not None:
+                key = pool.acquire(api)
+                if key is None:
+                    wait = pool.next_available(api)
+                    if wait is None or wait > HTTP_BACKOFF_MAX:
+                        if r is not None:
+                            return r
+                        raise QuotaExhausted(f"{api} 的所有金鑰配額已用盡或暫停中")
+                    logger.warning(f"[{api}] 所有金鑰暫停中，{wait:.1f} 秒後重試")
+                    time.sleep(wait)
+                    continue
+                apply_api_key(api, kwargs, key)
+            send = prepare(kwargs) if prepare is not None else kwargs
+            pace(api, url)
+            if r is not None:
+                # 換金鑰重送前歸還上一個回應的連線（串流回應尚未讀取本文）
+                r.close()
+            try:
+                r = session.request(method, url, **send)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # POST 逾時可能已在伺服器端生效，不自動重送；非冪等請求只在連線未建立時重送
+                if connect_failed(e):
+                    retryable = True
+                elif not idempotent:
+                    retryable = False
+                else:
+                    retryable = not (method.upper() == "POST" and isinstance(e, requests.exceptions.Timeout))
+                if not retryable or attempt >= HTTP_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"[{api}] 連線錯誤 ({e.__class__.__name__})，{delay:.1f} 秒後重試 ({attempt + 1}/{HTTP_MAX_RETRIES})")
+            else:
+                daily = r.status_code in (403, 429) and key is not None and is_daily_quota_error(r)
+                if pinned_key is not None and pool is not None and (r.status_code == 429 or daily):
+                    pool.cooldown(key, api, daily, parse_retry_after(r.headers.get("Retry-After")))
+                elif key is not None and (r.status_code == 429 or daily):
+                    pool.cooldown(key, api, daily, parse_retry_after(r.headers.get("Retry-After")))
+                    if attempt >= HTTP_MAX_RETRIES:
+                        return r
+                    attempt += 1
+                    continue
+                if r.status_code not in HTTP_RETRY_STATUS or attempt >= HTTP_MAX_RETRIES:
+                    return r
+                # 5xx 時請求可能已在伺服器端生效（例如代理逾時），非冪等請求不自動重送
+                if not idempotent and r.status_code != 429:
+                    return r
+                delay = backoff_delay(attempt, parse_retry_after(r.headers.get("Retry-After")))
+                logger.warning(f"[{api}] 收到狀態碼 {r.status_code}，{delay:.1f} 秒後重試 ({attempt + 1}/{HTTP_MAX_RETRIES})")
+                r.close()
+            attempt += 1
+            time.sleep(delay)
+    finally:
+        bytes_in = bytes_out = 0
+        if r is not None:
+            body = r.request.body
+            bytes_out = len(body) if body else 0
+            # 串流回應尚未讀取本文，以 Content-Length 估計
+            bytes_in = int(r.headers.get("Content-Length", 0) or 0) if kwargs.get("stream") else len(r.content)
+        metrics.observe(op or api, time.perf_counter() - start, bytes_in, bytes_out,
+                        error=r is None or r.status_code >= 400, retries=attempt)
 
 # ---------------------------------------------------------------
 # Google Custom Search：取得新參考連結
 # ---------------------------------------------------------------
-def get_reference_links(keyword, used_list, num_results=5):
-    """搜尋 Google Custom Search 取得參考連結"""
-    logger.info(f"搜尋參考連結，關鍵字: {keyword}")
-    
+def cse_search(keyword, start=1, num=5):
+    """呼叫 Google Custom Search API，回傳結果連結清單；失敗時回傳 None"""
     params = {
         "q": keyword,
         "cx": GOOGLE_CSE_ID,
         "key": GOOGLE_API_KEY,
-        "num": num_results,
-        "hl": "zh-TW"
+        "num": num,
+        "hl": CSE_HL
     }
+    if start > 1:
+        params["start"] = start
     
     try:
-        r = requests.get(CSE_URL, params=params, timeout=20)
+        r = api_request("cse", "GET", CSE_URL, op="cse.search", params=params, timeout=20)
         
         if r.status_code != 200:
             logger.error(f"Google Custom Search API 請求失敗，狀態碼: {r.status_code}")
-            logger.error(f"回應內容: {r.text}")
-            return []
+            logger.error(f"回應內容: {log_excerpt(r.text)}")
+            return None
             
         response_data = r.json()
         items = response_data.get("items", [])
         
-        logger.info(f"找到 {len(items)} 個搜尋結果")
-        
-        new_links = []
-        for item in items:
-            link = item.get("link")
-            if link and link not in used_list:
-                new_links.append(link)
-                logger.debug(f"新增參考連結: {link}")
-            elif link in used_list:
-                logger.debug(f"跳過已使用的連結: {link}")
-                
-        logger.info(f"篩選後得到 {len(new_links)} 個新連結")
-        return new_links[:2]
+        logger.info(f"找到 {len(items)} 個搜尋結果（start={start}）")
+        return [item["link"] for item in items if item.get("link")]
         
     except requests.exceptions.Timeout:
         logger.error("Google Custom Search API 請求超時")
-        return []
+        return None
     except requests.exceptions.RequestException as e:
         logger.error(f"Google Custom Search API 請求失敗: {e}")
-        return []
+        return None
     except Exception as e:
         logger.error(f"搜尋參考連結時發生未知錯誤: {e}")
+        return None
+
+def get_reference_links(keyword, used_list, num_results=5, cache=None):
+    """搜尋 Google Custom Search 取得參考連結（有快取時優先由快取的結果池提供）"""
+    logger.info(f"搜尋參考連結，關鍵字: {keyword}")
+
+    if cache is not None:
+        return cache.take(keyword, used_list, REFS_PER_ARTICLE)
+
+    links = cse_search(keyword, 1, num_results)
+    if not links:
         return []
+    
+    new_links = []
+    for link in links:
+        if link not in used_list:
+            new_links.append(link)
+            logger.debug("新增參考連結: %s", link)
+        else:
+            logger.debug("跳過已使用的連結: %s", link)
+            
+    logger.info(f"篩選後得到 {len(new_links)} 個新連結")
+    return new_links[:REFS_PER_ARTICLE]
+
+# Custom Search API 單頁最多 10 筆、最多可取得前 100 筆結果
+CSE_PAGE_SIZE = 10
+CSE_MAX_START = 91
+
+class SearchCache:
+    """
+    Custom Search 結果的本地快取，每個（關鍵字, 語言）一組結果池並設有 TTL。
+    文章所需的連結直接由結果池提供；池中未使用的連結低於 CSE_POOL_MIN 時才向下一頁（start=11, 21…）預取。
+    self.lock 只保護資料庫存取；預取的 API 呼叫只持有該關鍵字的鎖，不同關鍵字的搜尋可同時進行。
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.keyword_locks = {}
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cse_queries ("
+            " keyword TEXT NOT NULL, lang TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " next_start INTEGER NOT NULL, exhausted INTEGER NOT NULL, PRIMARY KEY (keyword, lang))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cse_pool ("
+            " keyword TEXT NOT NULL, lang TEXT NOT NULL, position INTEGER NOT NULL, url TEXT NOT NULL,"
+            " PRIMARY KEY (keyword, lang, url))"
+        )
+
+    def _query(self, keyword):
+        """取得查詢狀態；不存在或已過期時重設結果池"""
+        row = self.conn.execute(
+            "SELECT fetched_at, next_start, exhausted FROM cse_queries WHERE keyword = ? AND lang = ?",
+            (keyword, CSE_HL)
+        ).fetchone()
+        if row and time.time() - row[0] < CSE_CACHE_TTL_HOURS * 3600:
+            return {"next_start": row[1], "exhausted": bool(row[2])}
+        if row:
+            logger.info(f"搜尋快取已過期，重新查詢: {keyword}")
+        self.conn.execute("DELETE FROM cse_pool WHERE keyword = ? AND lang = ?", (keyword, CSE_HL))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cse_queries VALUES (?, ?, ?, 1, 0)", (keyword, CSE_HL, time.time())
+        )
+        return {"next_start": 1, "exhausted": False}
+
+    def _unused(self, keyword, used_list):
+        """回傳池中尚未使用的連結，並移除已使用者"""
+        rows = self.conn.execute(
+            "SELECT url FROM cse_pool WHERE keyword = ? AND lang = ? ORDER BY position", (keyword, CSE_HL)
+        ).fetchall()
+        unused, used = [], []
+        for (url,) in rows:
+            (used if url in used_list else unused).append(url)
+        if used:
+            self.conn.executemany(
+                "DELETE FROM cse_pool WHERE keyword = ? AND lang = ? AND url = ?",
+                [(keyword, CSE_HL, url) for url in used]
+            )
+        return unused
+
+    def _keyword_lock(self, keyword):
+        with self.lock:
+            return self.keyword_locks.setdefault((keyword, CSE_HL), threading.Lock())
+
+    def _store_page(self, keyword, state, links):
+        """將預取的一頁結果加入結果池並推進查詢狀態"""
+        start = state["next_start"]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO cse_pool VALUES (?, ?, ?, ?)",
+            [(keyword, CSE_HL, start + i, url) for i, url in enumerate(links)]
+        )
+        state["next_start"] = start + CSE_PAGE_SIZE
+        state["exhausted"] = len(links) < CSE_PAGE_SIZE or state["next_start"] > CSE_MAX_START
+        self.conn.execute(
+            "UPDATE cse_queries SET next_start = ?, exhausted = ? WHERE keyword = ? AND lang = ?",
+            (state["next_start"], int(state["exhausted"]), keyword, CSE_HL)
+        )
+
+    def take(self, keyword, used_list, count):
+        """由結果池取出 count 個未使用的連結，必要時預取更深的結果頁"""
+        with self._keyword_lock(keyword):
+            with self.lock:
+                state = self._query(keyword)
+                links = self._unused(keyword, used_list)
+            fetched = 0
+            while len(links) < max(count, CSE_POOL_MIN) and not state["exhausted"]:
+                # API 呼叫（含逾時與重試）不持有資料庫鎖
+                page = cse_search(keyword, state["next_start"], CSE_PAGE_SIZE)
+                if page is None:
+                    break
+                fetched += 1
+                with self.lock:
+                    self._store_page(keyword, state, page)
+                    links = self._unused(keyword, used_list)
+
+            taken = links[:count]
+            with self.lock:
+                self.conn.executemany(
+                    "DELETE FROM cse_pool WHERE keyword = ? AND lang = ? AND url = ?",
+                    [(keyword, CSE_HL, url) for url in taken]
+                )
+
+        source = f"查詢 {fetched} 頁" if fetched else "由快取提供，未呼叫 API"
+        logger.info(f"取得 {len(taken)} 個新連結（{source}），結果池剩餘 {len(links) - len(taken)} 個")
+        return taken
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_search_cache():
+    """開啟 Custom Search 結果快取（CSE_CACHE_TTL_HOURS=0 時停用，回傳 None）"""
+    if CSE_CACHE_TTL_HOURS <= 0:
+        return None
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return SearchCache(CSE_CACHE_DB)
+
+# ---------------------------------------------------------------
+# 參考頁面擷取：並行下載、內文擷取與條件式請求快取
+# ---------------------------------------------------------------
+class MainTextExtractor(HTMLParser):
+    """單次掃描 HTML，擷取標題與段落文字；頁面有 <article>/<main> 時只取其中內容"""
+
+    SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe"}
+    BLOCK_TAGS = {"p", "h1", "h2", "h3", "h4", "li", "blockquote", "td"}
+    MAIN_TAGS = {"article", "main"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.skip = 0
+        self.main = 0
+        self.in_title = False
+        self.current = []
+        self.blocks = []        # (是否位於 article/main 內, 文字)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        elif tag in self.MAIN_TAGS:
+            self.main += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag in self.MAIN_TAGS:
+            self._flush()
+            self.main = max(0, self.main - 1)
+        elif tag == "title":
+            self.in_title = False
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skip:
+            self.current.append(data)
+
+    def _flush(self):
+        text = " ".join("".join(self.current).split())
+        self.current = []
+        # 過短的片段多半是按鈕或選單文字
+        if len(text) >= 10:
+            self.blocks.append((self.main > 0, text))
+
+    def text(self):
+        self._flush()
+        main_blocks = [t for in_main, t in self.blocks if in_main]
+        return "\n".join(main_blocks or [t for _, t in self.blocks])
+
+def extract_main_text(html_text):
+    """回傳 (頁面標題, 主要內文)"""
+    extractor = MainTextExtractor()
+    try:
+        extractor.feed(html_text)
+        extractor.close()
+    except Exception as e:
+        logger.debug("解析參考頁面 HTML 失敗: %s", e)
+    return " ".join(extractor.title.split()), extractor.text()
+
+_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.I)
+
+def read_limited(r):
+    """以串流方式讀取回應本文，超過 REF_FETCH_MAX_BYTES 或時間上限即停止"""
+    deadline = time.monotonic() + REF_FETCH_TIMEOUT
+    data = bytearray()
+    for chunk in r.iter_content(chunk_size=16384):
+        data += chunk
+        if len(data) >= REF_FETCH_MAX_BYTES:
+            logger.debug("參考頁面超過 %d bytes，只讀取前段: %s", REF_FETCH_MAX_BYTES, r.url)
+            break
+        if time.monotonic() > deadline:
+            logger.debug("參考頁面讀取超時，只使用已讀取部分: %s", r.url)
+            break
+    return bytes(data[:REF_FETCH_MAX_BYTES])
+
+def decode_page(r, data):
+    """依 Content-Type 或 <meta charset> 解碼頁面內容"""
+    encoding = requests.utils.get_encoding_from_headers(r.headers)
+    if not encoding or encoding.lower() == "iso-8859-1":
+        m = _CHARSET_RE.search(data[:4096])
+        encoding = m.group(1).decode("ascii") if m else "utf-8"
+    try:
+        return data.decode(encoding, errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+class PageCache:
+    """
+    參考頁面內文的本地快取。
+    內文依 SHA-256 存為檔案（相同內容只存一份）；索引記錄 URL 對應的內文雜湊、ETag 與 Last-Modified。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = open_state_db(os.path.join(directory, "index.db"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, content_hash TEXT NOT NULL, title TEXT, etag TEXT,"
+            " last_modified TEXT, fetched_at REAL NOT NULL)"
+        )
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, content_hash[:2], content_hash + ".txt")
+
+    def lookup(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash, title, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if not row or not os.path.exists(self._path(row[0])):
+            return None
+        return dict(zip(("content_hash", "title", "etag", "last_modified", "fetched_at"), row))
+
+    def read(self, entry):
+        with open(self._path(entry["content_hash"]), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def store(self, url, title, text, etag, last_modified):
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, content_hash, title, etag, last_modified, time.time())
+            )
+
+    def touch(self, url):
+        with self.lock:
+            self.conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_page_cache():
+    """開啟參考頁面快取（REF_FETCH 未啟用時回傳 None）"""
+    if not REF_FETCH:
+        return None
+    return PageCache(PAGE_CACHE_DIR)
+
+def fetch_reference_page(url, cache):
+    """取得單一參考頁面的 (標題, 內文)；優先使用快取，過期時以條件式請求重新驗證"""
+    entry = cache.lookup(url)
+    if entry and time.time() - entry["fetched_at"] < REF_CACHE_FRESH_HOURS * 3600:
+        return entry["title"], cache.read(entry)
+
+    headers = {"User-Agent": "Mozilla/5.0 (compatible; wp-article-generator)", "Accept": "text/html"}
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        r = api_request("pages", "GET", url, op="pages.fetch", headers=headers, stream=True,
+                        timeout=(5, REF_FETCH_TIMEOUT), allow_redirects=True)
+        with r:
+            if r.status_code == 304 and entry:
+                cache.touch(url)
+                logger.debug("參考頁面未變更（304）: %s", url)
+                return entry["title"], cache.read(entry)
+            if r.status_code != 200 or "html" not in r.headers.get("Content-Type", "html"):
+                logger.warning(f"略過參考頁面 {url}（狀態碼 {r.status_code}，{r.headers.get('Content-Type', '')}）")
+                return None
+            title, text = extract_main_text(decode_page(r, read_limited(r)))
+            cache.store(url, title, text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+            return title, text
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"下載參考頁面失敗 {url}: {e}")
+        # 網路錯誤時沿用舊快取
+        return (entry["title"], cache.read(entry)) if entry else None
+
+def fetch_reference_excerpts(refs, cache):
+    """並行下載參考頁面，回傳依 REF_EXCERPT_BUDGET 分配字數的摘錄文字"""
+    if not refs:
+        return ""
+    with ThreadPoolExecutor(max_workers=max(1, min(REF_FETCH_WORKERS, len(refs)))) as pool:
+        pages = list(pool.map(lambda url: fetch_reference_page(url, cache), refs))
+
+    per_ref = REF_EXCERPT_BUDGET // len(refs)
+    parts = []
+    for idx, (url, page) in enumerate(zip(refs, pages), 1):
+        if not page or not page[1]:
+            continue
+        title, text = page
+        excerpt = text[:per_ref]
+        if len(text) > per_ref:
+            # 盡量在句尾截斷
+            cut = max(excerpt.rfind(p) for p in ("。", ". ", "！", "？", "\n"))
+            if cut > per_ref // 2:
+                excerpt = excerpt[:cut + 1]
+            excerpt += "…"
+        parts.append(f"[{idx}] {title or url}（{url}）\n{excerpt}")
+
+    logger.info(f"取得 {len(parts)}/{len(refs)} 個參考頁面摘錄，共 {sum(len(p) for p in parts)} 字元")
+    return "\n\n".join(parts)
 
 # ---------------------------------------------------------------
 # Gemini 產文
 # ---------------------------------------------------------------
-def gemini_generate_article(keyword, brand, site_name, refs):
-    """使用 Gemini AI 生成文章，包含詳細的錯誤處理和日誌記錄"""
-    logger.info(f"開始生成文章，關鍵字: {keyword}")
+# 本次執行的 Gemini 用量統計（產文失敗率與每篇發佈文章的 token 成本）
+gemini_stats = {"calls": 0, "repair_calls": 0, "prompt_tokens": 0, "output_tokens": 0,
+                "articles": 0, "failures": 0, "hedges": 0, "fallback_wins": 0, "cached_tokens": 0,
+                "duplicates": 0}
+_gemini_stats_lock = threading.Lock()
+
+def record_gemini_usage(response_data, repair=False):
+    """累計一次 Gemini 呼叫的 token 用量（usageMetadata）"""
+    usage = response_data.get("usageMetadata") or {}
+    job = current_job.get()
+    metrics.add_tokens(job["keyword"] if job else None, usage)
+    with _gemini_stats_lock:
+        gemini_stats["calls"] += 1
+        if repair:
+            gemini_stats["repair_calls"] += 1
+        gemini_stats["prompt_tokens"] += usage.get("promptTokenCount", 0)
+        gemini_stats["output_tokens"] += usage.get("candidatesTokenCount", 0)
+        gemini_stats["cached_tokens"] += usage.get("cachedContentTokenCount", 0)
+
+def log_gemini_stats(published):
+    """輸出本次執行的產文失敗率與每篇發佈文章的 token 成本"""
+    stats = dict(gemini_stats)
+    attempts = stats["articles"] + stats["failures"]
+    if not attempts:
+        return
+    tokens = stats["prompt_tokens"] + stats["output_tokens"]
+    summary = (
+        f"Gemini 統計 - 呼叫: {stats['calls']} 次（修正 {stats['repair_calls']} 次）, "
+        f"產文失敗: 每 100 個關鍵字 {stats['failures'] * 100 / attempts:.1f} 次, tokens: {tokens}"
+    )
+    if published:
+        summary += f"（每篇發佈 {tokens / published:.0f}）"
+    if stats["duplicates"]:
+        summary += f", 與既有文章重複: {stats['duplicates']} 篇"
+    if stats["cached_tokens"]:
+        summary += f", 快取命中的 prompt tokens: {stats['cached_tokens']}"
+    logger.info(summary)
+
+class ModelStats:
+    """
+    每個 Gemini 模型最近的請求延遲與成功與否（跨執行保存），
+    用來計算對沖請求的門檻，讓門檻隨各模型實際的延遲分布調整。
+    """
+    WINDOW = 200
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT NOT NULL,"
+            " seconds REAL NOT NULL, ok INTEGER NOT NULL, at TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS samples_model ON samples (model, id)")
+        self.samples = {}
+        for model, seconds, ok in self.conn.execute("SELECT model, seconds, ok FROM samples ORDER BY id"):
+            self.samples.setdefault(model, deque(maxlen=self.WINDOW)).append((seconds, bool(ok)))
+
+    def record(self, model, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(model, deque(maxlen=self.WINDOW)).append((seconds, ok))
+            self.conn.execute("INSERT INTO samples (model, seconds, ok, at) VALUES (?, ?, ?, ?)",
+                              (model, seconds, int(ok), datetime.now().isoformat(timespec="seconds")))
+            # 只保留每個模型最近 WINDOW 筆
+            self.conn.execute(
+                "DELETE FROM samples WHERE model = ? AND id <= "
+                "(SELECT id FROM samples WHERE model = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (model, model, self.WINDOW),
+            )
+
+    def threshold(self, model):
+        """對沖門檻（秒）：最近成功請求延遲的 p95"""
+        with self.lock:
+            latencies = [seconds for seconds, ok in self.samples.get(model, ()) if ok]
+        if len(latencies) < GEMINI_HEDGE_MIN_SAMPLES:
+            return GEMINI_HEDGE_DEFAULT_SECONDS
+        return min(GEMINI_TIMEOUT, max(GEMINI_HEDGE_MIN_SECONDS, percentile(latencies, 0.95)))
+
+    def report(self):
+        with self.lock:
+            samples = {model: list(entries) for model, entries in self.samples.items()}
+        report = {}
+        for model, entries in samples.items():
+            latencies = [seconds for seconds, ok in entries if ok]
+            report[model] = {
+                "samples": len(entries),
+                "success_rate": round(len(latencies) / len(entries), 3) if entries else None,
+                "p50_seconds": round(percentile(latencies, 0.5), 3),
+                "p95_seconds": round(percentile(latencies, 0.95), 3),
+                "hedge_after_seconds": round(self.threshold(model), 3),
+            }
+        return report
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+# 由 main() / run_daemon() 開啟；未開啟時（例如 bench.py）使用 GEMINI_HEDGE_DEFAULT_SECONDS 且不保存統計
+model_stats = None
+
+def load_model_stats():
+    os.makedirs(STATE_DIR, exist_ok=True)
+    stats = ModelStats(MODEL_STATS_DB)
+    if len(GENAI_MODELS) > 1:
+        logger.info("Gemini 模型備援: " + " → ".join(
+            f"{model}（{stats.threshold(model):.0f} 秒後對沖）" for model in GENAI_MODELS[:-1]) + f" → {GENAI_MODELS[-1]}")
+    return stats
+
+def gemini_url(model, stream=False):
+    if stream:
+        return f"{GENAI_BASE_URL}/models/{model}:streamGenerateContent?alt=sse"
+    return f"{GENAI_BASE_URL}/models/{model}:generateContent"
+
+def gemini_hedged(call):
+    """
+    依 GENAI_MODELS 的順序產文：目前的模型超過門檻仍未回應時，對下一個模型發出對沖請求，
+    失敗時立即改用下一個模型；先回傳有效結果者勝出，其餘請求取消。
+    call(model, cancel) 在背景執行緒執行，回傳結果或 None（失敗），應在 cancel 被設定後盡快放棄。
+    串流請求會在下一個 chunk 到達時關閉連線；非串流請求無法中斷，只會丟棄其結果。
+    回傳 (結果, 模型)；全部失敗時回傳 (None, None)，最後一個例外會重新拋出。
+    """
+    def measured(model, cancel):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = call(model, cancel)
+            return result
+        finally:
+            # 被取消的請求沒有完整的延遲，不列入統計
+            if not cancel.is_set() and model_stats is not None:
+                model_stats.record(model, time.perf_counter() - started, result is not None)
+
+    models = GENAI_MODELS
+    if len(models) == 1:
+        return measured(models[0], threading.Event()), models[0]
+
+    results = queue.Queue()
+    cancels = []
+
+    def launch(index):
+        model = models[index]
+        cancel = threading.Event()
+        cancels.append(cancel)
+
+        def attempt():
+            try:
+                results.put((index, measured(model, cancel), None))
+            except Exception as e:
+                results.put((index, None, e))
+
+        # 每個執行緒各自複製 contextvars，讓指標與公平排程仍能取得目前的工作
+        threading.Thread(target=contextvars.copy_context().run, args=(attempt,),
+                         name=f"gemini-{model}", daemon=True).start()
+
+    def threshold(model):
+        return model_stats.threshold(model) if model_stats is not None else GEMINI_HEDGE_DEFAULT_SECONDS
+
+    launch(0)
+    launched, running = 1, 1
+    hedge_at = time.monotonic() + threshold(models[0])
+    last_error = None
+    try:
+        while running:
+            timeout = max(0, hedge_at - time.monotonic()) if launched < len(models) else None
+            try:
+                index, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning(f"Gemini 模型 {models[launched - 1]} 超過 {threshold(models[launched - 1]):.1f} 秒未回應，"
+                               f"對沖請求 {models[launched]}")
+                with _gemini_stats_lock:
+                    gemini_stats["hedges"] += 1
+                launch(launched)
+                hedge_at = time.monotonic() + threshold(models[launched])
+                launched += 1
+                running += 1
+                continue
+
+            running -= 1
+            if result is not None:
+                if index:
+                    logger.info(f"由備援模型 {models[index]} 完成產文")
+                    with _gemini_stats_lock:
+                        gemini_stats["fallback_wins"] += 1
+                return result, models[index]
+
+            if error is not None:
+                last_error = error
+            logger.warning(f"Gemini 模型 {models[index]} 產文失敗" + (f": {error}" if error else ""))
+            if launched < len(models) and running == 0:
+                # 沒有進行中的請求時立即改用下一個模型
+                launch(launched)
+                hedge_at = time.monotonic() + threshold(models[launched])
+                launched += 1
+                running += 1
+    finally:
+        for cancel in cancels:
+            cancel.set()
+
+    if last_error is not None:
+        raise last_error
+    return None, None
+
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+class ContextCache:
+    """
+    Gemini 顯式快取（cachedContents）：站台固定的產文指示（systemInstruction）只上傳一次，
+    之後的請求以快取名稱引用，省下每篇重複送出的 prompt tokens 與首個 token 的等待。
+    快取屬於建立它的 Google Cloud 專案，因此依 金鑰 × 模型 × 指示內容 分別建立；
+    剩餘時間不足 GEMINI_CACHE_REFRESH 秒時延長 TTL，已被刪除或過期時重新建立。
+    建立失敗時該次請求直接附上指示。cachedContents 有最小 token 數（GEMINI_CACHE_MIN_TOKENS，
+    Gemini 2.5 Flash 為 1024），內建的產文指示只有約 300 字、遠低於此值：估計 token 數未達時不送出建立請求，
+    直接附上指示；估計達到但仍被拒絕（400）時本次執行不再嘗試。
+    建立與延長的請求不持有鎖：同一個快取同時只有一個 worker 送出，其他 worker 等它完成
+    （延長期間舊快取仍有效，直接使用），不同快取之間互不等待。
+    """
+    RETRY_SECONDS = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}       # ident -> threading.Event，建立或延長中的快取
+        self.unsupported = set()
+
+    @staticmethod
+    def _tokens(instruction):
+        """粗估指示的 token 數：CJK 字元約一字一個 token，其餘約四個字元一個 token"""
+        text = "".join(part.get("text", "") for part in instruction.get("parts", []))
+        cjk = len(_CJK_RE.findall(text))
+        return cjk + (len(text) - cjk) // 4
+
+    @staticmethod
+    def _ident(key, model, instruction):
+        digest = hashlib.sha256(json.dumps(instruction, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return key_id(key), model, digest.hexdigest()[:16]
+
+    def _call(self, method, url, key, op, body=None):
+        # 快取屬於建立它的金鑰，固定使用該金鑰；流量限制與退避重試同其他 Gemini 請求
+        try:
+            return api_request("gemini", method, url, op=op, pinned_key=key, json=body, timeout=30,
+                               headers={"Content-Type": "application/json; charset=utf-8"})
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Gemini 快取請求失敗（{op}）: {e}")
+            return None
+
+    def _create(self, key, model, instruction):
+        body = {"model": f"models/{model}", "displayName": "wp-article-instruction",
+                "systemInstruction": instruction, "ttl": f"{GEMINI_CACHE_TTL}s"}
+        r = self._call("POST", f"{GENAI_BASE_URL}/cachedContents", key, "gemini.cache_create", body)
+        if r is None:
+            return None
+        if r.status_code != 200:
+            logger.warning(f"建立 Gemini 快取失敗，狀態碼: {r.status_code}，改為直接附上指示: {log_excerpt(r.text, 200)}")
+            return False if r.status_code == 400 else None
+        name = r.json().get("name")
+        logger.info(f"已建立 Gemini 快取 {name}（{model}，TTL {GEMINI_CACHE_TTL} 秒）")
+        return name
+
+    def _extend(self, key, name):
+        r = self._call("PATCH", f"{GENAI_BASE_URL}/{name}", key, "gemini.cache_extend", {"ttl": f"{GEMINI_CACHE_TTL}s"})
+        return r is not None and r.status_code == 200
+
+    def get(self, key, model, instruction):
+        """回傳可用的快取名稱；沒有可用快取時回傳 None"""
+        ident = self._ident(key, model, instruction)
+        while True:
+            with self.lock:
+                if ident in self.unsupported:
+                    return None
+                if ident not in self.entries and ident not in self.pending:
+                    tokens = self._tokens(instruction)
+                    if tokens < GEMINI_CACHE_MIN_TOKENS:
+                        logger.info(f"產文指示約 {tokens} tokens，未達快取最小值 {GEMINI_CACHE_MIN_TOKENS}，"
+                                    f"不建立 Gemini 快取（{model}）")
+                        self.unsupported.add(ident)
+                        return None
+                entry = self.entries.get(ident)
+                now = time.time()
+                if entry and entry["until"] - GEMINI_CACHE_REFRESH > now:
+                    return entry["name"]
+                live = entry["name"] if entry and entry["name"] and entry["until"] > now else None
+                pending = self.pending.get(ident)
+                if pending is None:
+                    self.pending[ident] = threading.Event()
+                    break
+            if live:
+                return live
+            pending.wait()
+
+        try:
+            if live and self._extend(key, live):
+                name, until = live, time.time() + GEMINI_CACHE_TTL
+            else:
+                name = self._create(key, model, instruction)
+                until = time.time() + GEMINI_CACHE_TTL
+                if name is None:
+                    # 暫時性錯誤：一段時間內直接附上指示，之後再試
+                    until = time.time() + self.RETRY_SECONDS + GEMINI_CACHE_REFRESH
+            with self.lock:
+                if name is False:
+                    self.unsupported.add(ident)
+                    return None
+                self.entries[ident] = {"name": name, "key": key, "until": until}
+            return name
+        finally:
+            with self.lock:
+                self.pending.pop(ident).set()
+
+    def bind(self, kwargs, model):
+        """api_request 的 prepare：依實際使用的金鑰把 systemInstruction 換成快取引用"""
+        body = kwargs.get("json") or {}
+        instruction = body.get("systemInstruction")
+        key = (kwargs.get("headers") or {}).get("x-goog-api-key")
+        if not GEMINI_CONTEXT_CACHE or instruction is None or not key:
+            return kwargs
+        name = self.get(key, model, instruction)
+        if name is None:
+            return kwargs
+        body = {k: v for k, v in body.items() if k != "systemInstruction"}
+        body["cachedContent"] = name
+        return {**kwargs, "json": body}
+
+    def rejected(self, r):
+        """請求引用的快取已不存在（被刪除、過期或屬於其他專案）時使其失效，回傳快取名稱"""
+        if r.status_code not in (400, 403, 404) or not r.request.body or "cache" not in r.text.lower():
+            return None
+        try:
+            name = json.loads(r.request.body).get("cachedContent")
+        except ValueError:
+            return None
+        if not name:
+            return None
+        with self.lock:
+            for ident, entry in list(self.entries.items()):
+                if entry["name"] == name:
+                    del self.entries[ident]
+        logger.warning(f"Gemini 快取 {name} 已失效（狀態碼 {r.status_code}），重新建立後重送")
+        return name
+
+    def close(self):
+        """刪除本次建立的快取（快取依存放時間計費）"""
+        with self.lock:
+            entries = [e for e in self.entries.values() if e["name"]]
+            self.entries.clear()
+        for entry in entries:
+            self._call("DELETE", f"{GENAI_BASE_URL}/{entry['name']}", entry["key"], "gemini.cache_delete")
+
+context_cache = ContextCache()
+
+def gemini_post(url, op, headers, body, model, **kwargs):
+    """送出 Gemini 請求（套用快取）；引用的快取已失效時重送一次"""
+    for attempt in range(2):
+        r = api_request("gemini", "POST", url, op=op, headers=headers, json=body,
+                        prepare=lambda kw: context_cache.bind(kw, model), **kwargs)
+        if attempt or context_cache.rejected(r) is None:
+            return r
+        r.close()
+
+def gemini_generate(headers, body, repair=False, model=None, cancel=None):
+    """以 generateContent 一次取得完整回應，回傳文字（失敗或已取消時回傳 None）"""
+    url = gemini_url(model or GENAI_MODEL)
+    logger.info(f"發送請求到 Gemini API，URL: {url}")
+    r = gemini_post(url, "gemini.repair" if repair else "gemini.generate", headers, body, model or GENAI_MODEL,
+                    timeout=GEMINI_TIMEOUT)
+    if cancel is not None and cancel.is_set():
+        # 對沖請求已由其他模型勝出；token 已經產生，仍計入用量
+        if r.status_code == 200:
+            record_gemini_usage(r.json(), repair)
+        logger.info(f"已由其他模型完成，捨棄 {model} 的回應")
+        return None
     
-    refs_text = "\n".join(f"- {r}" for r in refs) if refs else "（無特定參考連結）"
+    # 檢查 HTTP 狀態碼
+    if r.status_code != 200:
+        logger.error(f"Gemini API 請求失敗，狀態碼: {r.status_code}")
+        logger.error(f"回應內容: {log_excerpt(r.text)}")
+        return None
+        
+    response_data = r.json()
+    logger.info("Gemini API 請求成功")
+    record_gemini_usage(response_data, repair)
+    
+    # 檢查回應結構
+    if "candidates" not in response_data or not response_data["candidates"]:
+        logger.error(f"Gemini API 回應格式異常: {response_data}")
+        return None
+        
+    candidate = response_data["candidates"][0]
+    if "content" not in candidate or "parts" not in candidate["content"]:
+        logger.error(f"Gemini API 候選回應格式異常: {candidate}")
+        return None
+        
+    text = candidate["content"]["parts"][0]["text"]
+    logger.info(f"收到 Gemini 回應，長度: {len(text)} 字元")
+    return text
+
+def gemini_stream_generate(headers, body, model=None, cancel=None):
+    """
+    以 streamGenerateContent（SSE）接收回應並即時解析 SEO 欄位。
+    輸出一旦不符合格式（或 cancel 被設定）就關閉連線，不再為之後會被丟棄的 token 付費。
+    回傳 (全文, 欄位字典)，失敗時回傳 (None, None)。
+    """
+    parser = GeminiOutputParser()
+    pieces = []
+    usage = None
+    started = time.perf_counter()
+    deadline = time.monotonic() + GEMINI_TIMEOUT
+
+    url = gemini_url(model or GENAI_MODEL, stream=True)
+    logger.info(f"發送串流請求到 Gemini API，URL: {url}")
+    r = gemini_post(url, "gemini.stream_first_byte", headers, body, model or GENAI_MODEL,
+                    stream=True, timeout=(10, GEMINI_TIMEOUT))
+    with r:
+        if r.status_code != 200:
+            logger.error(f"Gemini API 請求失敗，狀態碼: {r.status_code}")
+            logger.error(f"回應內容: {log_excerpt(r.text)}")
+            return None, None
+
+        r.encoding = "utf-8"
+        try:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = json.loads(line[5:])
+                if "usageMetadata" in data:
+                    usage = data
+                for candidate in data.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        chunk = part.get("text")
+                        if chunk:
+                            pieces.append(chunk)
+                            parser.feed(chunk)
+
+                if parser.error:
+                    received = sum(len(p) for p in pieces)
+                    logger.error(f"Gemini 輸出格式錯誤，提前中止串流: {parser.error}（已接收 {received} 字元）")
+                    logger.error(f"原始回應: {''.join(pieces)[:500]}...")
+                    return None, None
+                if time.monotonic() > deadline:
+                    logger.error("Gemini API 串流超過時間上限，中止請求")
+                    return None, None
+                if cancel is not None and cancel.is_set():
+                    logger.info(f"已由其他模型完成，中止 {model} 的串流")
+                    return None, None
+        finally:
+            # 每個 SSE 事件的 usageMetadata 為累計值，只記錄最後收到的一個（提前中止時同樣計入）
+            if usage:
+                record_gemini_usage(usage)
+            metrics.observe("gemini.stream_total", time.perf_counter() - started,
+                            bytes_in=sum(len(p.encode("utf-8")) for p in pieces), error=bool(parser.error))
+
+    text = "".join(pieces)
+    logger.info(f"收到 Gemini 串流回應，長度: {len(text)} 字元")
+    return text, parser.finish()
+
+# 結構化輸出（JSON 模式）欄位與內部欄位名稱的對應
+JSON_FIELDS = {
+    "seo_title": "seo_title",
+    "seo_desc": "seo_desc",
+    "focus_keyword": "seo_keyword",
+    "article_html": "article",
+}
+JSON_FIELD_DESCRIPTIONS = {
+    "seo_title": "SEO 標題",
+    "seo_desc": "SEO 描述",
+    "focus_keyword": "焦點關鍵字，1-3 個，用逗號分隔",
+    "article_html": "文章內容（HTML）",
+}
+
+def json_response_schema(fields):
+    """建立只包含指定欄位的 responseSchema"""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            name: {"type": "STRING", "description": JSON_FIELD_DESCRIPTIONS[name]} for name in fields
+        },
+        "required": list(fields),
+        "propertyOrdering": list(fields),
+    }
+
+def validate_article_fields(data, suffix):
+    """檢查結構化輸出的各欄位（suffix 為站台的標題品牌後綴），回傳 {欄位: 問題說明}（全部合格時為空字典）"""
+    problems = {}
+    title = (data.get("seo_title") or "").strip()
+    if not title:
+        problems["seo_title"] = "缺少標題"
+    elif len(title) > SEO_TITLE_MAX:
+        problems["seo_title"] = f"超過 {SEO_TITLE_MAX} 字（目前 {len(title)} 字）"
+    elif not title.endswith(suffix):
+        problems["seo_title"] = f"必須以「{suffix}」結尾"
+
+    desc = (data.get("seo_desc") or "").strip()
+    if not desc:
+        problems["seo_desc"] = "缺少描述"
+    elif len(desc) > SEO_DESC_MAX:
+        problems["seo_desc"] = f"超過 {SEO_DESC_MAX} 字（目前 {len(desc)} 字）"
+
+    keywords = [k for k in re.split(r"[,，、]", data.get("focus_keyword") or "") if k.strip()]
+    if not 1 <= len(keywords) <= 3:
+        problems["focus_keyword"] = "需要 1-3 個關鍵字"
+
+    article = (data.get("article_html") or "").strip()
+    if len(article) < 100 or "<" not in article:
+        problems["article_html"] = "文章內容過短或不是 HTML"
+    return problems
+
+def gemini_generate_json(headers, prompt, fields, repair=False, model=None, cancel=None, instruction=None):
+    """以 JSON 模式呼叫 Gemini 並一次解析，回傳字典（失敗時回傳 None）"""
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": json_response_schema(fields),
+        },
+    }
+    if instruction is not None:
+        body["systemInstruction"] = instruction
+    text = gemini_generate(headers, body, repair, model, cancel)
+    if text is None:
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        logger.error(f"Gemini JSON 輸出無法解析: {e}")
+        logger.error(f"原始回應: {text[:500]}...")
+        return None
+    if not isinstance(data, dict):
+        logger.error(f"Gemini JSON 輸出不是物件: {text[:200]}")
+        return None
+    return data
+
+def repair_article_fields(headers, keyword, data, problems, suffix, model=None):
+    """只針對不合格的 SEO 欄位發出小型修正請求，不重新生成整篇文章"""
+    fields = list(problems)
+    excerpt = re.sub(r"<[^>]+>", "", data.get("article_html", ""))[:600]
+    issues = "\n".join(f"- {name}：目前為「{data.get(name, '')}」，問題：{reason}" for name, reason in problems.items())
     prompt = f"""
 主題：{keyword}
 
-請生成以下四個部分（繁體中文）：
+以下是一篇文章的 SEO 欄位，其中這些欄位不符合要求：
+{issues}
+
+要求：
+- seo_title：{SEO_TITLE_MAX} 字內，必須以「{suffix}」結尾
+- seo_desc：{SEO_DESC_MAX} 字內，吸引點擊
+- focus_keyword：1-3 個，用逗號分隔
+
+文章摘要：
+{excerpt}
+
+請只輸出修正後的欄位（繁體中文）。
+"""
+    logger.info(f"修正 SEO 欄位: {', '.join(fields)}")
+    return gemini_generate_json(headers, prompt, fields, repair=True, model=model)
+
+def gemini_generate_structured(headers, prompt, keyword, suffix, model=None, cancel=None, instruction=None):
+    """
+    JSON 模式產文：一次解析並驗證；只有 SEO 欄位不合格時發出小型修正請求（使用同一個模型）。
+    回傳欄位字典（與 GeminiOutputParser.finish() 相同的鍵），文章本身不合格時回傳 None。
+    """
+    data = gemini_generate_json(headers, prompt, list(JSON_FIELDS), model=model, cancel=cancel, instruction=instruction)
+    if data is None:
+        return None
+
+    problems = validate_article_fields(data, suffix)
+    if "article_html" in problems:
+        logger.error(f"Gemini 文章內容不合格: {problems['article_html']}")
+        return None
+    if problems:
+        logger.warning(f"SEO 欄位不合格: {problems}")
+        fixed = repair_article_fields(headers, keyword, data, problems, suffix, model)
+        if fixed:
+            data.update({k: v for k, v in fixed.items() if k in problems and v})
+            remaining = validate_article_fields(data, suffix)
+            if remaining:
+                logger.warning(f"修正後仍不合格，沿用預設處理: {remaining}")
+
+    return {JSON_FIELDS[name]: (data.get(name) or "").strip() for name in JSON_FIELDS}
+
+@lru_cache(maxsize=64)
+def article_instruction(brand, site_name, suffix, json_mode):
+    """
+    站台固定的產文指示（systemInstruction）：每個站台只組一次，請求之間只有主題與參考資料會改變，
+    也讓相同的前綴可以被 Gemini 快取（顯式或隱式）重複使用。
+    """
+    if json_mode:
+        text = f"""請依使用者提供的主題，以繁體中文撰寫一篇文章，並提供以下欄位：
+- seo_title：SEO 標題，{SEO_TITLE_MAX} 字內，必須以「{suffix}」結尾
+- seo_desc：SEO 描述，{SEO_DESC_MAX} 字內，吸引點擊
+- focus_keyword：焦點關鍵字，1-3 個，用逗號分隔
+- article_html：文章內容，HTML 格式，800-1200 字，含<h2>/<h3>/<p>段落
+
+條件：
+- 文章開頭或結尾自然出現一次品牌「{brand}」與站名「{site_name}」
+- 可選擇性地在文章末尾加入參考資料區塊（格式：<h3>參考資料</h3><ul><li><a href="連結">標題</a></li></ul>），只使用使用者提供的參考資料來源
+- 若使用者提供參考資料內容摘錄，僅供撰寫參考，請以自己的文字改寫，不要直接複製
+"""
+    else:
+        text = f"""請依使用者提供的主題，生成以下四個部分（繁體中文）：
 1. SEO 標題（70 字內）
 2. SEO 描述（150 字內）
 3. 焦點關鍵字（1~3 個）
@@ -199,50 +2141,86 @@ def gemini_generate_article(keyword, brand, site_name, refs):
 條件：
 - 文章開頭或結尾自然出現一次品牌「{brand}」與站名「{site_name}」
 - HTML格式，含<h2>/<h3>/<p>段落
-- 可選擇性地在文章末尾加入參考資料區塊（格式：<h3>參考資料</h3><ul><li><a href="連結">標題</a></li></ul>）
-- 參考資料來源：{refs_text}
+- 可選擇性地在文章末尾加入參考資料區塊（格式：<h3>參考資料</h3><ul><li><a href="連結">標題</a></li></ul>），只使用使用者提供的參考資料來源
+- 若使用者提供參考資料內容摘錄，僅供撰寫參考，請以自己的文字改寫，不要直接複製
 
 輸出格式如下：
 ---
-SEO_TITLE: [SEO 標題，70字內，必須以「{SEO_BRAND_SUFFIX}」結尾]
+SEO_TITLE: [SEO 標題，70字內，必須以「{suffix}」結尾]
 SEO_DESC: [SEO 描述，150字內，吸引點擊]
 SEO_KEYWORD: [焦點關鍵字，1-3個，用逗號分隔]
 ---
 ARTICLE:
 [文章內容，HTML格式，800-1200字，不包含參考資料區塊]
 """
+    return {"parts": [{"text": text}]}
+
+def article_prompt(keyword, refs_text, excerpts="", avoid=()):
+    """每篇文章不同的部分：主題、參考資料來源與摘錄；avoid 為內容過於相似而需避開的既有文章標題"""
+    return f"""主題：{keyword}
+
+參考資料來源：
+{refs_text}
+{excerpts_block(excerpts)}{avoid_block(avoid)}"""
+
+def avoid_block(titles):
+    """重新產文時的差異化提示（沒有需避開的文章時為空字串）"""
+    if not titles:
+        return ""
+    listed = "\n".join(f"- {t}" for t in titles)
+    return f"""
+站上已有內容高度相似的文章：
+{listed}
+請換一個不同的切入角度、段落結構與小標題撰寫，不要沿用上述文章的重點順序與用語。
+"""
+
+def excerpts_block(excerpts):
+    """參考頁面摘錄的提示區塊（沒有摘錄時為空字串）"""
+    if not excerpts:
+        return ""
+    return f"""
+參考資料內容摘錄（僅供撰寫參考，請以自己的文字改寫，不要直接複製）：
+{excerpts}
+"""
+
+def gemini_generate_article(keyword, site, refs, excerpts="", avoid=()):
+    """使用 Gemini AI 生成文章，包含詳細的錯誤處理和日誌記錄"""
+    logger.info(f"開始生成文章，關鍵字: {keyword}")
+    brand, site_name, suffix = site.brand, site.site_name, site.seo_brand_suffix
+    
+    refs_text = "\n".join(f"- {r}" for r in refs) if refs else "（無特定參考連結）"
+    prompt = article_prompt(keyword, refs_text, excerpts, avoid)
+    instruction = article_instruction(brand, site_name, suffix, GEMINI_JSON_MODE)
     
     headers = {
         "Content-Type": "application/json; charset=utf-8",
         "x-goog-api-key": GOOGLE_API_KEY
     }
-    body = {"contents": [{"parts": [{"text": prompt}]}]}
-    
-    try:
-        logger.info(f"發送請求到 Gemini API，URL: {GENAI_URL}")
-        r = requests.post(GENAI_URL, headers=headers, json=body, timeout=120)
-        
-        # 檢查 HTTP 狀態碼
-        if r.status_code != 200:
-            logger.error(f"Gemini API 請求失敗，狀態碼: {r.status_code}")
-            logger.error(f"回應內容: {r.text}")
+    body = {"systemInstruction": instruction, "contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    def generate(model, cancel):
+        """以指定模型產文一次，回傳 (全文, 欄位字典或 None)；輸出不可用時回傳 None，交由備援模型處理"""
+        if GEMINI_JSON_MODE:
+            fields = gemini_generate_structured(headers, prompt, keyword, suffix, model, cancel, instruction)
+            return (fields["article"], fields) if fields else None
+        if GEMINI_STREAM:
+            text, fields = gemini_stream_generate(headers, body, model, cancel)
+            return (text, fields) if text is not None else None
+        text = gemini_generate(headers, body, model=model, cancel=cancel)
+        if text is None:
             return None
-            
-        response_data = r.json()
-        logger.info("Gemini API 請求成功")
-        
-        # 檢查回應結構
-        if "candidates" not in response_data or not response_data["candidates"]:
-            logger.error(f"Gemini API 回應格式異常: {response_data}")
+        fields = dict(zip(("seo_title", "seo_desc", "seo_keyword", "article"), parse_gemini_output(text)))
+        if not fields["seo_title"] or not fields["article"]:
+            logger.error(f"Gemini 模型 {model} 回應缺少必要欄位 - 標題: {bool(fields['seo_title'])}, "
+                         f"內容: {bool(fields['article'])}")
             return None
-            
-        candidate = response_data["candidates"][0]
-        if "content" not in candidate or "parts" not in candidate["content"]:
-            logger.error(f"Gemini API 候選回應格式異常: {candidate}")
+        return text, fields
+
+    try:
+        result, model = gemini_hedged(generate)
+        if result is None:
             return None
-            
-        text = candidate["content"]["parts"][0]["text"]
-        logger.info(f"收到 Gemini 回應，長度: {len(text)} 字元")
+        text, fields = result
         
     except UnicodeEncodeError as e:
         logger.error(f"編碼錯誤: {e}")
@@ -261,27 +2239,16 @@ ARTICLE:
         logger.error(f"Gemini API 請求發生未知錯誤: {e}")
         return None
 
-    # 使用新的解析器處理 Gemini 回應
+    # Gemini 回應已在 generate 中解析完成（解析器會自行去除程式碼區塊標記）
     try:
-        # 清理 markdown 程式碼區塊標記
-        cleaned_text = text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]  # 移除 ```json
-        if cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text[3:]   # 移除 ```
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]  # 移除結尾的 ```
-        
-        cleaned_text = cleaned_text.strip()
-        logger.info(f"清理後的文字長度: {len(cleaned_text)} 字元")
-        
-        # 使用新的解析器
-        seo_title, seo_desc, seo_keyword, article = parse_gemini_output(cleaned_text)
+        seo_title, seo_desc, seo_keyword, article = (
+            fields["seo_title"], fields["seo_desc"], fields["seo_keyword"], fields["article"]
+        )
         
         # 驗證必要欄位
         if not seo_title or not article:
             logger.error(f"Gemini 回應缺少必要欄位 - 標題: {bool(seo_title)}, 內容: {bool(article)}")
-            logger.error(f"原始回應: {cleaned_text[:500]}...")
+            logger.error(f"原始回應: {text[:500]}...")
             return None
             
         # 檢查內容品質
@@ -290,33 +2257,33 @@ ARTICLE:
         
         # 如果 SEO 描述為空，使用預設
         if not seo_desc:
-            seo_desc = f"{keyword} 健康懶人包 - {SEO_BRAND_SUFFIX}"
+            seo_desc = f"{keyword} 健康懶人包 - {suffix}"
             logger.warning("使用預設 SEO 描述")
         
         # 如果 SEO 關鍵字為空，使用預設
         if not seo_keyword:
-            seo_keyword = ",".join(DEFAULT_SEO_KEYWORDS[:3])
+            seo_keyword = ",".join(site.default_seo_keywords[:3])
             logger.warning("使用預設 SEO 關鍵字")
         
         # 驗證和修正 SEO 標題
-        if not seo_title.endswith(SEO_BRAND_SUFFIX):
-            seo_title = f"{seo_title}{SEO_BRAND_SUFFIX}"
+        if not seo_title.endswith(suffix):
+            seo_title = f"{seo_title}{suffix}"
             logger.info(f"已為標題加入品牌後綴: {seo_title}")
         
         # 組合文章內容（包含參考資料）
-        content_html = assemble_html(article, refs, brand, site_name, TAGS_BASE)
+        content_html = assemble_html(article, refs, brand, site_name, site.tags)
         
         # 建立回傳物件
         obj = {
             "seo_title": seo_title,
             "meta_desc": seo_desc,
             "content": content_html,
-            "tags": DEFAULT_SEO_KEYWORDS,
+            "tags": site.default_seo_keywords,
             "references": refs,
             "focus_keyword": seo_keyword
         }
             
-        logger.info(f"文章生成成功 - 標題: {seo_title[:50]}...")
+        logger.info(f"文章生成成功（{model}）- 標題: {seo_title[:50]}...")
         
     except Exception as e:
         logger.error(f"處理 Gemini 回應時發生錯誤: {e}")
@@ -328,20 +2295,355 @@ ARTICLE:
 # ---------------------------------------------------------------
 # WordPress 工具
 # ---------------------------------------------------------------
-def wp_post_exists_by_slug(slug):
-    search_url = WP_URL + f"?search={quote(slug)}&per_page=3"
-    r = requests.get(search_url, auth=(WP_USER, WP_PASS), timeout=15)
+# 查詢 slug 時涵蓋的文章狀態（草稿、排程文章同樣佔用 slug）
+WP_SLUG_STATUSES = "publish,future,draft,pending,private"
+
+def normalize_slug(slug):
+    """WordPress 以百分比編碼儲存非 ASCII slug，比對前先解碼並轉小寫"""
+    return unquote(slug or "").lower()
+
+def wp_existing_slugs(site, slugs):
+    """以單一 ?slug= 請求查詢多個 slug，回傳已存在者的集合；查詢失敗時回傳 None"""
+    params = {"slug": ",".join(slugs), "status": WP_SLUG_STATUSES, "_fields": "slug", "per_page": 100}
+    r = api_request("wp", "GET", site.wp_url, op="wp.slug_check", params=params, auth=site.wp_auth, timeout=15)
     if r.status_code != 200:
-        return False
+        logger.warning(f"查詢 slug 失敗，狀態碼: {r.status_code}")
+        return None
+    return {normalize_slug(item.get("slug")) for item in r.json()}
+
+def wp_post_exists_by_slug(site, slug):
+    existing = wp_existing_slugs(site, [slug])
+    return bool(existing) and normalize_slug(slug) in existing
+
+def wp_lookup_post(site, slug):
+    """
+    依 slug 取得已存在的文章，找不到時回傳 None；查詢失敗時拋出 requests 例外。
+    只以 slug 比對：slug 在保留時已確認未被使用，不比對標題（title.rendered 經過 wptexturize，
+    引號、連字號與刪節號會與送出的標題不同）
+    """
+    params = {"slug": slug, "status": WP_SLUG_STATUSES, "_fields": "id,slug,link,title"}
+    r = api_request("wp", "GET", site.wp_url, op="wp.slug_lookup", params=params, auth=site.wp_auth, timeout=15)
+    r.raise_for_status()
     for item in r.json():
-        if item.get("slug") == slug:
-            return True
-    return False
+        if normalize_slug(item.get("slug")) == normalize_slug(slug):
+            return item
+    return None
 
-def safe_publish_to_wp(title, content_html, meta_desc, slug, focus_keyword=""):
-    """安全發送文章至 WordPress，偵測 Yoast 欄位封鎖後自動重試"""
-    logger.info(f"準備發佈文章到 WordPress: {title}")
-    
+def wp_find_post_by_slug(site, slug):
+    """同 wp_lookup_post，查詢失敗時記錄警告並回傳 None"""
+    try:
+        return wp_lookup_post(site, slug)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"查詢文章 {slug} 失敗: {e}")
+        return None
+
+class SlugIndex:
+    """
+    WordPress 既有 slug 的本地索引。
+    首次使用時分頁讀取全部文章的 slug，之後以 modified_after 增量同步；
+    碰撞檢查與後綴選擇都在記憶體中完成。
+    """
+
+    def __init__(self, path, site):
+        self.lock = threading.Lock()
+        self.site = site
+        self.conn = open_state_db(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS slugs (slug TEXT PRIMARY KEY)")
+        self.slugs = {row[0] for row in self.conn.execute("SELECT slug FROM slugs")}
+        # 已保留、尚未確認發佈的 slug（多個發佈 worker 之間避免選到同一個）
+        self.reserved = set()
+
+    def __contains__(self, slug):
+        return normalize_slug(slug) in self.slugs
+
+    def release(self, slug):
+        """歸還保留的 slug（工作已發佈、失敗或放棄）；已發佈的 slug 由索引記錄，失敗的可供之後的文章使用"""
+        with _slug_lock:
+            self.reserved.discard(slug)
+
+    def __len__(self):
+        return len(self.slugs)
+
+    def add(self, slugs):
+        new = {normalize_slug(s) for s in slugs if s} - self.slugs
+        if not new:
+            return
+        with self.lock:
+            self.slugs |= new
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO slugs VALUES (?)", [(s,) for s in new])
+            self.conn.execute("COMMIT")
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def sync(self):
+        """從 WordPress 同步 slug：尚未建立索引時完整讀取，否則只讀取上次同步後修改過的文章"""
+        since = self._get_meta("synced_gmt")
+        params = {"_fields": "slug,modified_gmt", "per_page": 100, "status": WP_SLUG_STATUSES,
+                  "orderby": "modified", "order": "asc"}
+        if since:
+            params["modified_after"] = since + "+00:00"
+        logger.info("增量同步 WordPress slug 索引..." if since else "建立 WordPress slug 索引...")
+
+        latest = since
+        page = 1
+        total_pages = 1
+        count = 0
+        while page <= total_pages:
+            params["page"] = page
+            r = api_request("wp", "GET", self.site.wp_url, op="wp.slug_sync", params=params, auth=self.site.wp_auth,
+                            timeout=30)
+            if r.status_code != 200:
+                logger.warning(f"同步 slug 索引失敗，狀態碼: {r.status_code}，將沿用現有索引")
+                return False
+            items = r.json()
+            self.add(item.get("slug") for item in items)
+            for item in items:
+                modified = item.get("modified_gmt")
+                if modified and (latest is None or modified > latest):
+                    latest = modified
+            count += len(items)
+            total_pages = int(r.headers.get("X-WP-TotalPages", "1") or 1)
+            page += 1
+
+        if latest:
+            self._set_meta("synced_gmt", latest)
+        logger.info(f"slug 索引同步完成，讀取 {count} 篇，索引共 {len(self.slugs)} 個 slug")
+        return True
+
+    def candidates(self, base, count, exclude=()):
+        """依 WordPress 命名慣例（base、base-2、base-3…）列出本地索引中尚未使用的 slug"""
+        found = []
+        n = 1
+        while len(found) < count:
+            slug = base if n == 1 else f"{base[:90 - len(str(n)) - 1]}-{n}"
+            if slug not in self and slug not in exclude:
+                found.append(slug)
+            n += 1
+        return found
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_slug_index(site):
+    """開啟站台的 slug 索引並與 WordPress 同步"""
+    os.makedirs(site.state_dir, exist_ok=True)
+    index = SlugIndex(os.path.join(site.state_dir, SLUGS_DB_NAME), site)
+    try:
+        index.sync()
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"同步 slug 索引時發生錯誤，將沿用現有索引: {e}")
+    return index
+
+# Yoast SEO 的 meta 欄位（需以 wordpress-yoast-setup.php 註冊到 REST API）
+YOAST_META_KEYS = ("_yoast_wpseo_title", "_yoast_wpseo_metadesc", "_yoast_wpseo_focuskw")
+
+def wp_rest_root(site):
+    """由文章端點（.../wp-json/wp/v2/posts）推得 REST API 根路徑；無法判斷時回傳 None"""
+    url = site.wp_url.rstrip("/")
+    return url[:url.index("/wp/v2/")] if "/wp/v2/" in url else None
+
+class WpProfile:
+    """
+    WordPress 站台的能力與標籤 ID 快取（每個站台一份，存放於站台狀態目錄）。
+    能力（已註冊的 meta 欄位、batch 端點、文章可用的分類法）探測一次後保存，
+    超過 WP_PROBE_TTL_HOURS 或發佈結果與紀錄不符時重新探測；
+    標籤名稱對應的 term ID 保存在本地，缺少的名稱以一次查詢、一次（batch）建立解析。
+    """
+
+    def __init__(self, path, site):
+        self.lock = threading.Lock()
+        self.site = site
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS terms (taxonomy TEXT, name TEXT, term_id INTEGER NOT NULL,"
+            " PRIMARY KEY (taxonomy, name))"
+        )
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'capabilities'").fetchone()
+        self.caps = json.loads(row[0]) if row else None
+        # 本次執行無法查到也無法建立的名稱（例如帳號沒有建立標籤的權限），不再重試
+        self.unresolved = set()
+
+    def _save_caps(self, caps):
+        self.caps = caps
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('capabilities', ?)", (json.dumps(caps),))
+
+    def probe(self, force=False):
+        """探測站台能力並保存；探測失敗時沿用先前的結果（沒有結果時維持未知）"""
+        if not force and self.caps:
+            age = datetime.now() - datetime.fromisoformat(self.caps["probed_at"])
+            if age < timedelta(hours=WP_PROBE_TTL_HOURS):
+                return self.caps
+        root = wp_rest_root(self.site)
+        if root is None:
+            logger.warning(f"無法由 WP_URL 推得 REST API 根路徑，略過站台能力探測: {self.site.wp_url}")
+            return self.caps
+
+        caps = {"meta": [], "batch": False, "batch_max": 0, "taxonomies": {},
+                "probed_at": datetime.now().isoformat(timespec="seconds")}
+        auth = self.site.wp_auth
+        try:
+            # 文章端點的 schema 列出已註冊到 REST API 的 meta 欄位
+            r = api_request("wp", "OPTIONS", self.site.wp_url, op="wp.probe", auth=auth, timeout=15)
+            r.raise_for_status()
+            schema = r.json().get("schema") or {}
+            caps["meta"] = sorted((schema.get("properties", {}).get("meta") or {}).get("properties") or {})
+
+            r = api_request("wp", "GET", f"{root}/", op="wp.probe", params={"_fields": "namespaces"}, auth=auth,
+                            timeout=15)
+            r.raise_for_status()
+            if "batch/v1" in (r.json().get("namespaces") or []):
+                r = api_request("wp", "OPTIONS", f"{root}/batch/v1", op="wp.probe", auth=auth, timeout=15)
+                if r.status_code == 200:
+                    endpoints = r.json().get("endpoints") or [{}]
+                    limit = endpoints[0].get("args", {}).get("requests", {}).get("maxItems", 25)
+                    caps["batch"], caps["batch_max"] = True, int(limit)
+
+            r = api_request("wp", "GET", f"{root}/wp/v2/taxonomies", op="wp.probe", params={"type": "post"},
+                            auth=auth, timeout=15)
+            r.raise_for_status()
+            caps["taxonomies"] = {slug: info.get("rest_base") or slug for slug, info in r.json().items()}
+        except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+            logger.warning(f"[{self.site.name}] WordPress 站台能力探測失敗，沿用先前的結果: {e}")
+            return self.caps
+
+        missing = [key for key in YOAST_META_KEYS if key not in caps["meta"]]
+        logger.info(f"[{self.site.name}] WordPress 站台能力 - Yoast meta: "
+                    + (f"未註冊 {', '.join(missing)}" if missing else "已註冊")
+                    + f", batch: {'最多 ' + str(caps['batch_max']) + ' 筆' if caps['batch'] else '不支援'}"
+                    + f", 分類法: {', '.join(caps['taxonomies']) or '無'}")
+        with self.lock:
+            self._save_caps(caps)
+        return caps
+
+    def writable_meta(self, meta_fields):
+        """只保留站台已註冊的 meta 欄位；尚未探測成功時全部保留（由 403 後重送處理）"""
+        if self.caps is None:
+            return meta_fields
+        return {key: value for key, value in meta_fields.items() if key in self.caps["meta"]}
+
+    def meta_blocked(self):
+        """發佈時 meta 欄位被拒絕：記錄為不可寫入，之後的文章直接不送 meta"""
+        with self.lock:
+            caps = dict(self.caps or {"batch": False, "batch_max": 0, "taxonomies": {"post_tag": "tags"},
+                                      "probed_at": datetime.now().isoformat(timespec="seconds")})
+            caps["meta"] = []
+            self._save_caps(caps)
+        logger.warning(f"[{self.site.name}] Yoast meta 欄位無法寫入，之後的文章不再附上 meta 欄位")
+
+    def batch_unavailable(self):
+        """/batch/v1 實際上不可用（外掛停用或被防火牆擋下）：記錄後改為逐篇發佈"""
+        with self.lock:
+            if self.caps and self.caps.get("batch"):
+                self._save_caps({**self.caps, "batch": False, "batch_max": 0})
+
+    def rest_base(self, taxonomy):
+        if self.caps is None:
+            return {"post_tag": "tags", "category": "categories"}.get(taxonomy)
+        return self.caps["taxonomies"].get(taxonomy)
+
+    def term_ids(self, names, taxonomy="post_tag"):
+        """回傳名稱對應的 term ID（依名稱順序，略過無法解析者）；缺少的名稱先查詢既有的，再一次建立"""
+        names = list(dict.fromkeys(n.strip() for n in names if n and n.strip()))
+        rest_base = self.rest_base(taxonomy)
+        if not names or not rest_base:
+            return []
+        with self.lock:
+            known = dict(self.conn.execute("SELECT name, term_id FROM terms WHERE taxonomy = ?", (taxonomy,)))
+            missing = [n for n in names if n.lower() not in known and (taxonomy, n.lower()) not in self.unresolved]
+            if missing:
+                found = self._resolve(taxonomy, rest_base, missing)
+                self.conn.execute("BEGIN")
+                self.conn.executemany("INSERT OR REPLACE INTO terms VALUES (?, ?, ?)",
+                                      [(taxonomy, name.lower(), term_id) for name, term_id in found.items()])
+                self.conn.execute("COMMIT")
+                known.update({name.lower(): term_id for name, term_id in found.items()})
+                self.unresolved |= {(taxonomy, n.lower()) for n in missing if n not in found}
+        return [known[n.lower()] for n in names if n.lower() in known]
+
+    def forget_terms(self, taxonomy="post_tag"):
+        """term ID 已失效（例如標籤在後台被刪除）時清除本地快取，下次重新解析"""
+        with self.lock:
+            self.conn.execute("DELETE FROM terms WHERE taxonomy = ?", (taxonomy,))
+            self.unresolved = {item for item in self.unresolved if item[0] != taxonomy}
+
+    def _resolve(self, taxonomy, rest_base, names):
+        root = wp_rest_root(self.site)
+        auth = self.site.wp_auth
+        found = {}
+        try:
+            # slug 參數會經過 sanitize_title，自動建立的標籤可直接以名稱查到
+            r = api_request("wp", "GET", f"{root}/wp/v2/{rest_base}", op="wp.terms_lookup", auth=auth, timeout=15,
+                            params={"slug": ",".join(names), "per_page": 100, "_fields": "id,name"})
+            if r.status_code == 200:
+                by_name = {html.unescape(item["name"]).lower(): item["id"] for item in r.json()}
+                found = {n: by_name[n.lower()] for n in names if n.lower() in by_name}
+
+            create = [n for n in names if n not in found]
+            if create:
+                found.update(self._create_terms(root, rest_base, create))
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError) as e:
+            # 回應不是預期的 JSON（例如快取外掛或防火牆回傳的 HTML）時與網路錯誤同樣處理，該篇不附標籤
+            logger.warning(f"[{self.site.name}] 解析 WordPress 標籤失敗: {e}")
+        if len(found) < len(names):
+            logger.warning(f"[{self.site.name}] 無法取得標籤: {', '.join(n for n in names if n not in found)}")
+        else:
+            logger.info(f"[{self.site.name}] 已解析 {len(found)} 個標籤")
+        return found
+
+    def _create_terms(self, root, rest_base, names):
+        """建立標籤；站台支援 batch 時每批一個請求。已存在的標籤由 term_exists 錯誤取得 ID"""
+        results = []
+        if self.caps and self.caps["batch"]:
+            size = self.caps["batch_max"] or 25
+            for i in range(0, len(names), size):
+                chunk = names[i:i + size]
+                items = [{"method": "POST", "path": f"/wp/v2/{rest_base}", "body": {"name": n}} for n in chunk]
+                r = api_request("wp", "POST", f"{root}/batch/v1", op="wp.terms_create", auth=self.site.wp_auth,
+                                json={"requests": items}, timeout=30)
+                if r.status_code not in (200, 207):
+                    logger.warning(f"batch 建立標籤失敗，狀態碼: {r.status_code}")
+                    continue
+                responses = r.json().get("responses") or []
+                results += [(n, item.get("status"), item.get("body") or {}) for n, item in zip(chunk, responses)]
+        else:
+            for name in names:
+                r = api_request("wp", "POST", f"{root}/wp/v2/{rest_base}", op="wp.terms_create",
+                                auth=self.site.wp_auth, json={"name": name}, timeout=15)
+                results.append((name, r.status_code, r.json() if r.content else {}))
+
+        found = {}
+        for name, status, body in results:
+            if status == 201:
+                found[name] = body.get("id")
+            elif body.get("code") == "term_exists":
+                found[name] = (body.get("data") or {}).get("term_id")
+            else:
+                logger.warning(f"建立標籤「{name}」失敗，狀態碼: {status}，{body.get('message', '')}")
+        return {name: term_id for name, term_id in found.items() if term_id}
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_wp_profile(site):
+    """開啟站台的能力與標籤快取，必要時重新探測"""
+    os.makedirs(site.state_dir, exist_ok=True)
+    profile = WpProfile(os.path.join(site.state_dir, SITE_DB_NAME), site)
+    profile.probe()
+    return profile
+
+def build_post_payload(site, title, content_html, meta_desc, slug, focus_keyword="", profile=None, tags=True):
+    """
+    建立發佈文章的 payload（單篇發佈與 batch 共用）。
+    有站台資訊（profile）時只附上已註冊的 meta 欄位，tags 為 True 時設定標籤 ID。
+    """
     # 建立基本 payload
     payload = {
         "title": title,
@@ -352,9 +2654,9 @@ def safe_publish_to_wp(title, content_html, meta_desc, slug, focus_keyword=""):
     }
     
     # 加入分類
-    if CATEGORY_ID > 0:
-        payload["categories"] = [CATEGORY_ID]
-        logger.info(f"指定分類 ID: {CATEGORY_ID}")
+    if site.category_id > 0:
+        payload["categories"] = [site.category_id]
+        logger.info(f"指定分類 ID: {site.category_id}")
     
     # 加入 Yoast SEO meta 欄位
     meta_fields = {
@@ -365,19 +2667,85 @@ def safe_publish_to_wp(title, content_html, meta_desc, slug, focus_keyword=""):
     if focus_keyword:
         meta_fields["_yoast_wpseo_focuskw"] = focus_keyword
     
-    payload["meta"] = meta_fields
+    if profile is not None:
+        meta_fields = profile.writable_meta(meta_fields)
+    if meta_fields:
+        payload["meta"] = meta_fields
+
+    # 加入標籤
+    if profile is not None and WP_ASSIGN_TAGS and tags:
+        tag_ids = profile.term_ids(site.tags)
+        if tag_ids:
+            payload["tags"] = tag_ids
+    return payload
+
+def wp_create_post(site, payload, op, check_first=False):
+    """
+    送出建立文章的 POST，回傳 (回應, 已存在的文章)，兩者只有一個不是 None。
+    建立文章不是冪等操作，api_request 不會因 5xx 或逾時自動重送；結果不明（5xx、逾時、連線中斷）
+    或 check_first 時，先以保留的 slug 確認文章是否已建立，確定不存在才重送，最多 HTTP_MAX_RETRIES 次。
+    slug 查詢失敗時拋出例外，不在結果不明的情況下重送。
+    """
+    slug = payload["slug"]
+    unclear = check_first
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if unclear:
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            existing = wp_lookup_post(site, slug)
+            if existing:
+                logger.info(f"以 slug 確認文章已建立，不再送出 {op}: {existing.get('link', slug)}")
+                return None, existing
+        try:
+            r = api_request("wp", "POST", site.wp_url, op=op, idempotent=False, auth=site.wp_auth,
+                            json=payload, timeout=60)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            logger.warning(f"[wp] {op} 結果不明 ({e.__class__.__name__})，以 slug 確認後再決定是否重送")
+            unclear = True
+            continue
+        if r.status_code < 500 or attempt >= HTTP_MAX_RETRIES:
+            return r, None
+        logger.warning(f"[wp] {op} 收到狀態碼 {r.status_code}，以 slug 確認後再決定是否重送")
+        unclear = True
+
+def safe_publish_to_wp(site, title, content_html, meta_desc, slug, focus_keyword="", profile=None):
+    """
+    安全發送文章至 WordPress，偵測 Yoast 欄位封鎖後自動重試。
+    有站台資訊（profile）時一般情況下一個請求就能完成。
+    每個建立文章的請求都經由 wp_create_post：結果不明或改送其他內容前先以 slug 確認，不會重複發文。
+    """
+    logger.info(f"準備發佈文章到 WordPress: {title}")
     
     try:
-        logger.info("嘗試發送包含 Yoast SEO meta 欄位的文章...")
-        r = requests.post(WP_URL, auth=(WP_USER, WP_PASS), json=payload, timeout=60)
+        payload = build_post_payload(site, title, content_html, meta_desc, slug, focus_keyword, profile)
+
+        logger.info("嘗試發送包含 Yoast SEO meta 欄位的文章..." if "meta" in payload else "發送文章（站台未註冊 Yoast meta 欄位）...")
+        r, existing = wp_create_post(site, payload, "wp.publish")
+        if existing:
+            return existing
+
+        # 標籤 ID 已失效（標籤在後台被刪除）：清除快取並以不含標籤的內容重送
+        if r.status_code == 400 and "tags" in payload and "tags" in r.text:
+            logger.warning("標籤 ID 無效，清除標籤快取後重新發送...")
+            profile.forget_terms()
+            payload.pop("tags")
+            r, existing = wp_create_post(site, payload, "wp.publish_retry_no_tags", check_first=True)
+            if existing:
+                return existing
         
         # 檢查是否為 403 錯誤且與 meta 欄位相關
-        if r.status_code == 403 and ("meta" in r.text.lower() or "forbidden" in r.text.lower()):
+        if r.status_code == 403 and "meta" in payload and ("meta" in r.text.lower() or "forbidden" in r.text.lower()):
             logger.warning("⚠️ Yoast SEO 欄位未開啟，跳過 meta 欄位重新發送...")
+            if profile is not None:
+                profile.meta_blocked()
             
             # 移除 meta 欄位重新發送
             payload.pop("meta", None)
-            r = requests.post(WP_URL, auth=(WP_USER, WP_PASS), json=payload, timeout=60)
+            r, existing = wp_create_post(site, payload, "wp.publish_retry_no_meta", check_first=True)
+            if existing:
+                return existing
             
             if r.status_code == 201:
                 logger.info(f"✅ WordPress 發佈成功（無 meta 欄位）: {title}")
@@ -385,17 +2753,17 @@ def safe_publish_to_wp(title, content_html, meta_desc, slug, focus_keyword=""):
                 return r.json()
             else:
                 logger.error(f"❌ WordPress 發佈失敗（無 meta 欄位），狀態碼: {r.status_code}")
-                logger.error(f"錯誤回應: {r.text}")
+                logger.error(f"錯誤回應: {log_excerpt(r.text)}")
                 return None
         
         elif r.status_code == 201:
-            logger.info(f"✅ WordPress 發佈成功（含 meta 欄位）: {title}")
+            logger.info(f"✅ WordPress 發佈成功（{'含' if 'meta' in payload else '無'} meta 欄位）: {title}")
             logger.info(f"文章 URL: {r.json().get('link', 'N/A')}")
             return r.json()
         
         else:
             logger.error(f"❌ WordPress 發佈失敗，狀態碼: {r.status_code}")
-            logger.error(f"錯誤回應: {r.text}")
+            logger.error(f"錯誤回應: {log_excerpt(r.text)}")
             return None
             
     except requests.exceptions.Timeout:
@@ -408,15 +2776,232 @@ def safe_publish_to_wp(title, content_html, meta_desc, slug, focus_keyword=""):
         logger.error(f"發佈到 WordPress 時發生未知錯誤: {e}")
         return None
 
-def wp_publish(title, content_html, meta_desc, slug):
+def wp_publish(site, title, content_html, meta_desc, slug, profile=None):
     """向後相容的發佈函數"""
-    return safe_publish_to_wp(title, content_html, meta_desc, slug)
+    return safe_publish_to_wp(site, title, content_html, meta_desc, slug, profile=profile)
 
 # ---------------------------------------------------------------
 # HTML 組合
 # ---------------------------------------------------------------
+# 參考資料區塊的標題
+_REF_HEADING_RE = re.compile(r"參考(資料|來源|文獻|連結)|資料來源|延伸閱讀|^\s*(references?|sources?)\s*:?\s*$", re.I)
+# 模型偶爾混入的 Markdown：粗體、行首的標題符號與程式碼區塊標記
+_MD_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_MD_HEADING_RE = re.compile(r"(?m)^[ \t]*#{1,6}[ \t]+")
+_MD_FENCE_RE = re.compile(r"```[a-zA-Z]*")
+_WS_RE = re.compile(r"\s+")
+_SAFE_URL_RE = re.compile(r"^(https?:|mailto:|/|#)", re.I)
+
+class ArticleSanitizer(HTMLParser):
+    """
+    單次掃描模型輸出的文章 HTML：只保留允許的標籤與屬性、補齊未關閉與刪除多餘的結束標籤、
+    去除殘留的 Markdown 與多餘空白，並刪除重複的參考資料區塊與區塊中重複的連結。
+    開啟中的元素以堆疊加上各標籤的位置索引維護，每個 token 只處理常數次，處理時間與文章長度成正比。
+    """
+
+    ALLOWED_TAGS = {"p", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "strong", "em", "a", "blockquote", "br", "hr",
+                    "table", "thead", "tbody", "tr", "th", "td", "code", "pre", "img", "figure", "figcaption",
+                    "sup", "sub"}
+    RENAME_TAGS = {"h1": "h2", "b": "strong", "i": "em"}
+    # 連同內容一起刪除的元素；其餘不允許的標籤（div、span、section 等）只去掉標籤、保留內容
+    DROP_TAGS = {"script", "style", "iframe", "object", "embed", "noscript", "svg", "canvas", "head", "title",
+                 "template", "form", "button", "select", "textarea"}
+    # 沒有結束標籤的元素（含 DROP_TAGS 中的 embed）
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track",
+                 "wbr"}
+    ALLOWED_ATTRS = {"a": {"href", "title", "target", "rel"}, "img": {"src", "alt", "width", "height"},
+                     "th": {"colspan", "rowspan"}, "td": {"colspan", "rowspan"}}
+    HEADINGS = {"h2", "h3", "h4", "h5", "h6"}
+    # 開始時會結束未關閉 <p> 的區塊元素
+    BLOCK_TAGS = {"p", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "table", "blockquote", "pre", "hr", "figure"}
+    # 只包含子元素的容器，其中的空白文字沒有意義
+    CONTAINER_TAGS = {"ul", "ol", "table", "thead", "tbody", "tr"}
+    # 前後空白可以去掉的元素
+    SPACELESS_TAGS = {"p", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "table", "thead", "tbody", "tr", "th", "td",
+                      "blockquote", "figure", "figcaption", "hr", "br", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.stack = []
+        self.where = {}          # 標籤 -> 該標籤在 stack 中的位置（由外而內）
+        self.skip = 0
+        self.captures = []       # 暫存輸出中的標題與參考資料項目（決定保留或刪除後再寫出）
+        self.drop_depth = None   # 刪除重複參考資料區塊時：區塊標題所在的 stack 深度
+        self.drop_list = False   # 重複區塊標題後的清單是否已開始
+        self.refs_level = None   # 目前位於保留的參考資料區塊中：區塊標題的層級
+        self.refs_seen = False
+        self.cited = set()
+
+    # --- 輸出 ---
+    def _emit(self, text):
+        if self.drop_depth is None:
+            self.out.append(text)
+
+    def _emit_tag(self, tag, text):
+        # 區塊元素前後的空白沒有意義，去掉前一段文字結尾的空白
+        if tag in self.SPACELESS_TAGS and tag != "pre" and self.out and self.out[-1].endswith(" ") \
+                and not self._open("pre"):
+            self.out[-1] = self.out[-1].rstrip(" ")
+        self._emit(text)
+
+    def _push(self, tag, attrs_text):
+        self._emit_tag(tag, f"<{tag}{attrs_text}>")
+        if tag in self.VOID_TAGS:
+            return
+        self.where.setdefault(tag, []).append(len(self.stack))
+        self.stack.append(tag)
+
+    def _pop(self):
+        tag = self.stack.pop()
+        self.where[tag].pop()
+        if self.drop_depth is not None and len(self.stack) < self.drop_depth:
+            # 包住重複區塊的元素結束，重複區塊也隨之結束
+            self.drop_depth = None
+        self._emit_tag(tag, f"</{tag}>")
+        if self.captures and self.captures[-1]["depth"] == len(self.stack):
+            self._finish_capture(self.captures.pop())
+
+    def _close(self, tag):
+        """關閉最內層的 tag 以及其中尚未關閉的元素"""
+        depth = self.where[tag][-1]
+        while len(self.stack) > depth:
+            self._pop()
+
+    def _open(self, tag):
+        return bool(self.where.get(tag))
+
+    def _last(self, *tags):
+        return max((self.where[t][-1] for t in tags if self.where.get(t)), default=-1)
+
+    # --- 參考資料區塊 ---
+    def _start_capture(self, kind, tag):
+        self.captures.append({"kind": kind, "tag": tag, "depth": len(self.stack), "outer": self.out,
+                              "text": [], "hrefs": []})
+        self.out = []
+
+    def _finish_capture(self, cap):
+        body, self.out = self.out, cap["outer"]
+        if cap["kind"] == "heading":
+            level = int(cap["tag"][1])
+            if _REF_HEADING_RE.search("".join(cap["text"])):
+                if self.refs_seen:
+                    # 重複的參考資料區塊：刪除標題與緊接其後的清單
+                    self.drop_depth, self.drop_list = len(self.stack), False
+                    return
+                self.refs_seen, self.refs_level = True, level
+        elif cap["kind"] == "ref_item":
+            urls = {normalize_url(h) for h in cap["hrefs"]}
+            if urls and urls <= self.cited:
+                return
+            self.cited |= urls
+        self.out.extend(body)
+
+    # --- HTMLParser 事件 ---
+    def handle_starttag(self, tag, attrs):
+        if self.skip or tag in self.DROP_TAGS:
+            self.skip += tag not in self.VOID_TAGS
+            return
+        tag = self.RENAME_TAGS.get(tag, tag)
+        if tag not in self.ALLOWED_TAGS:
+            return
+        if self.drop_depth is not None and len(self.stack) == self.drop_depth:
+            if tag in ("ul", "ol") and not self.drop_list:
+                self.drop_list = True
+            else:
+                self.drop_depth = None
+        if tag in self.HEADINGS and self.refs_level is not None and int(tag[1]) <= self.refs_level:
+            self.refs_level = None
+        if tag in self.BLOCK_TAGS and self._open("p"):
+            self._close("p")
+        elif tag == "li" and self._last("li") > self._last("ul", "ol"):
+            self._close("li")
+        elif tag in ("td", "th") and self._last("td", "th") > self._last("tr"):
+            self._close(self.stack[self._last("td", "th")])
+        elif tag == "tr" and self._last("tr") > self._last("table"):
+            self._close("tr")
+
+        allowed = self.ALLOWED_ATTRS.get(tag, ())
+        attrs_text = ""
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            value = value.strip()
+            if name in ("href", "src") and not _SAFE_URL_RE.match(value):
+                continue
+            attrs_text += f' {name}="{html.escape(value)}"'
+            if name == "href" and self.captures and self.captures[-1]["kind"] == "ref_item":
+                self.captures[-1]["hrefs"].append(value)
+
+        if tag in self.HEADINGS:
+            self._start_capture("heading", tag)
+        elif tag == "li" and self.refs_level is not None:
+            self._start_capture("ref_item", tag)
+        self._push(tag, attrs_text)
+
+    def handle_startendtag(self, tag, attrs):
+        # 自我關閉的 <svg/>、<script/> 等沒有內容，直接略過，不進入刪除狀態
+        if self.skip or tag in self.DROP_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if self.RENAME_TAGS.get(tag, tag) not in self.VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.skip:
+            self.skip -= tag in self.DROP_TAGS and tag not in self.VOID_TAGS
+            return
+        tag = self.RENAME_TAGS.get(tag, tag)
+        # 沒有對應開始標籤的結束標籤直接忽略
+        if tag in self.ALLOWED_TAGS and self._open(tag):
+            self._close(tag)
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if self._open("pre"):
+            self._emit(html.escape(data, quote=False))
+            return
+        data = _MD_FENCE_RE.sub("", _MD_HEADING_RE.sub("", data))
+        data = _WS_RE.sub(" ", data)
+        prev = self.out[-1] if self.out else ""
+        if data[:1] == " " and (not prev or prev.endswith(" ") or self._tag_name(prev) in self.SPACELESS_TAGS):
+            data = data[1:]
+        if not data or (data == " " and self.stack and self.stack[-1] in self.CONTAINER_TAGS):
+            return
+        if self.drop_depth is not None and len(self.stack) == self.drop_depth and data != " ":
+            self.drop_depth = None
+        if self.captures:
+            self.captures[-1]["text"].append(data)
+        self._emit(_MD_BOLD_RE.sub(r"<strong>\1</strong>", html.escape(data, quote=False)))
+
+    @staticmethod
+    def _tag_name(piece):
+        if not piece.startswith("<") or not piece.endswith(">"):
+            return None
+        return piece[1:-1].lstrip("/").split(" ", 1)[0]
+
+    def result(self):
+        self.close()
+        while self.stack:
+            self._pop()
+        return "".join(self.out).strip()
+
+def sanitize_article_html(content_html):
+    """清理模型輸出的文章 HTML，並記錄處理時間與清理前後的大小（執行報告的 html.sanitize）"""
+    start = time.perf_counter()
+    parser = ArticleSanitizer()
+    parser.feed(content_html)
+    cleaned = parser.result()
+    before, after = len(content_html.encode("utf-8")), len(cleaned.encode("utf-8"))
+    metrics.observe("html.sanitize", time.perf_counter() - start, bytes_in=before, bytes_out=after)
+    if before > after:
+        logger.debug(f"HTML 清理: {before} → {after} bytes（-{(before - after) * 100 / before:.1f}%）")
+    return cleaned
+
 def assemble_html(content_html, refs, brand, site_name, tags):
-    """組合文章 HTML，只加入標籤和品牌簽名，不強制加入參考資料"""
+    """組合文章 HTML，只加入標籤和品牌簽名，不強制加入參考資料；模型產出的部分先經過清理"""
+    content_html = sanitize_article_html(content_html)
     
     tag_block = ""
     if tags:
@@ -427,17 +3012,331 @@ def assemble_html(content_html, refs, brand, site_name, tags):
     # 只加入標籤和品牌簽名，讓 AI 自己決定是否包含參考資料
     return content_html + tag_block + sig
 
+# ---------------------------------------------------------------
+# 重複內容偵測
+# ---------------------------------------------------------------
+# MinHash（one permutation hashing）：每個 shingle 只算一次 CRC32，依值分到 DUP_BINS 個區間各取最小值；
+# LSH 將簽章切成 DUP_BANDS 段、每段 DUP_ROWS 個值，任一段完全相同的文章才進一步比對。
+# 42 x 3 的設定下相似度 0.4 的文章有 94% 機率成為候選，0.5 以上超過 99%；不相關的文章（相似度 0.05 以下）幾乎不會成為候選
+DUP_BANDS = 42
+DUP_ROWS = 3
+DUP_BINS = DUP_BANDS * DUP_ROWS
+# 去除標籤與標點後少於此字數的文章不建立簽章（太短無法可靠比對）
+DUP_MIN_CHARS = 200
+_EMPTY_BIN = 0xFFFFFFFF
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# assemble_html 附加在每篇文章後的標籤與品牌簽名（所有文章都相同，不列入比對）
+_BOILERPLATE_RE = re.compile(r"<p><em>標籤：</em>.*?</p>|<p style=[\"']color:#666;[\"']>本文由.*?</p>", re.S)
+
+def article_text(content_html):
+    """比對用的純文字：去除固定附加區塊、HTML 標籤、空白與標點，英文轉小寫"""
+    text = _TAG_RE.sub(" ", _BOILERPLATE_RE.sub("", content_html or ""))
+    return _NON_WORD_RE.sub("", html.unescape(text)).lower()
+
+def minhash(content_html):
+    """文章的 MinHash 簽章（DUP_BINS 個整數）；內容過短時回傳 None"""
+    text = article_text(content_html)
+    if len(text) < DUP_MIN_CHARS:
+        return None
+    # 以 UTF-32 編碼一次，每個字元固定 4 bytes，shingle 直接切 bytes 再以 CRC32 雜湊
+    data = text.encode("utf-32-le")
+    width = 4 * DUP_SHINGLE
+    sig = [_EMPTY_BIN] * DUP_BINS
+    for h in map(zlib.crc32, {data[i:i + width] for i in range(0, len(data) - width + 4, 4)}):
+        b = h % DUP_BINS
+        v = h // DUP_BINS
+        if v < sig[b]:
+            sig[b] = v
+    return sig
+
+def minhash_similarity(a, b):
+    """
+    以簽章相同的區間比例估計兩篇文章 shingle 集合的 Jaccard 相似度。
+    兩篇都沒有 shingle 落入的空區間不代表內容相同，不列入計算
+    """
+    same = used = 0
+    for x, y in zip(a, b):
+        if x != _EMPTY_BIN or y != _EMPTY_BIN:
+            used += 1
+            same += x == y
+    return same / used if used else 0.0
+
+class SimilarityIndex:
+    """
+    站台文章的 MinHash + LSH 索引，用來在發佈前找出與既有文章幾乎相同的新文章。
+    首次使用時分頁串流讀取 WordPress 全部文章建立索引，之後以 modified_after 增量同步；
+    簽章存於 SQLite，LSH 分桶在啟動時於記憶體重建，每次比對只需檢查少數候選。
+    產文完成、尚未發佈的文章先以 job:<id> 暫存於記憶體，讓同時產文的 worker 互相比對；
+    發佈後由 commit 寫入資料庫，失敗或放棄時由 release 移除。
+    """
+
+    def __init__(self, path, site):
+        self.lock = threading.Lock()
+        self.site = site
+        self.conn = open_state_db(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (key TEXT PRIMARY KEY, title TEXT, sig BLOB NOT NULL)")
+        self.docs = {}
+        # (段落編號, 段落值) -> 文章 key；大多數分桶只有一篇，多篇時改存清單
+        self.buckets = {}
+        for key, title, blob in self.conn.execute("SELECT key, title, sig FROM docs"):
+            self._insert(key, title, array("I", blob).tolist())
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _bands(sig):
+        for band in range(DUP_BANDS):
+            rows = sig[band * DUP_ROWS:(band + 1) * DUP_ROWS]
+            # 整段都是空區間的分桶會讓所有短文章互相成為候選，不建立
+            if any(v != _EMPTY_BIN for v in rows):
+                yield (band, *rows)
+
+    def _insert(self, key, title, sig):
+        if key in self.docs:
+            self._remove(key)
+        self.docs[key] = (title, sig)
+        for band in self._bands(sig):
+            found = self.buckets.get(band)
+            if found is None:
+                self.buckets[band] = key
+            elif isinstance(found, list):
+                found.append(key)
+            else:
+                self.buckets[band] = [found, key]
+
+    def _remove(self, key):
+        _, sig = self.docs.pop(key)
+        for band in self._bands(sig):
+            found = self.buckets.get(band)
+            if isinstance(found, list):
+                found.remove(key)
+                if len(found) == 1:
+                    self.buckets[band] = found[0]
+            elif found == key:
+                del self.buckets[band]
+
+    def _nearest(self, sig):
+        candidates = set()
+        for band in self._bands(sig):
+            found = self.buckets.get(band)
+            if isinstance(found, list):
+                candidates.update(found)
+            elif found is not None:
+                candidates.add(found)
+        best = None
+        for key in candidates:
+            title, other = self.docs[key]
+            similarity = minhash_similarity(sig, other)
+            if similarity >= DUP_THRESHOLD and (best is None or similarity > best[0]):
+                best = (similarity, title, key)
+        return best
+
+    def claim(self, job_key, title, content_html):
+        """
+        比對新文章：與既有文章相似度達 DUP_THRESHOLD 時回傳 (相似度, 標題, key)；
+        否則以 job_key 暫存於記憶體（發佈後由 commit 寫入資料庫）並回傳 None
+        """
+        start = time.perf_counter()
+        sig = minhash(content_html)
+        if sig is None:
+            return None
+        with self.lock:
+            match = self._nearest(sig)
+            if match is None:
+                self._insert(job_key, title, sig)
+        metrics.observe("dup.check", time.perf_counter() - start)
+        return match
+
+    def commit(self, job_key, post_id, title, content_html):
+        """文章已發佈：將暫存的簽章改以 post:<id> 寫入資料庫（上次執行產文的工作在此計算簽章）"""
+        with self.lock:
+            entry = self.docs.get(job_key)
+            if entry is not None:
+                self._remove(job_key)
+                sig = entry[1]
+            else:
+                sig = minhash(content_html)
+            if sig is None:
+                return
+            self._store([(f"post:{post_id}", title, sig)])
+
+    def release(self, job_key):
+        """工作失敗或放棄：移除 claim 暫存的簽章，之後產出的文章不再與它比對"""
+        with self.lock:
+            if job_key in self.docs:
+                self._remove(job_key)
+
+    def _store(self, docs):
+        self.conn.execute("BEGIN")
+        self.conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?)",
+                              [(key, title, array("I", sig).tobytes()) for key, title, sig in docs])
+        self.conn.execute("COMMIT")
+        for key, title, sig in docs:
+            self._insert(key, title, sig)
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def sync(self):
+        """
+        從 WordPress 同步文章簽章：尚未建立索引時串流讀取全部文章，否則只讀取上次同步後修改過的文章。
+        依修改時間由舊到新分頁處理，每頁寫入後即更新同步點，中斷後下次從該頁接續
+        """
+        since = self._get_meta("synced_gmt")
+        params = {"_fields": "id,title,content,modified_gmt", "per_page": 100, "status": WP_SLUG_STATUSES,
+                  "orderby": "modified", "order": "asc"}
+        logger.info("增量同步文章相似度索引..." if since else "建立文章相似度索引（讀取站台既有文章）...")
+
+        page = 1
+        total_pages = 1
+        count = 0
+        while page <= total_pages:
+            params["page"] = page
+            if since:
+                params["modified_after"] = since + "+00:00"
+            r = api_request("wp", "GET", self.site.wp_url, op="wp.similar_sync", params=params,
+                            auth=self.site.wp_auth, timeout=60)
+            if r.status_code != 200:
+                logger.warning(f"同步文章相似度索引失敗，狀態碼: {r.status_code}，將沿用現有索引")
+                return False
+            docs = []
+            latest = since
+            for item in r.json():
+                title = html.unescape((item.get("title") or {}).get("rendered", ""))
+                sig = minhash((item.get("content") or {}).get("rendered", ""))
+                if sig is not None:
+                    docs.append((f"post:{item['id']}", title, sig))
+                modified = item.get("modified_gmt")
+                if modified and (latest is None or modified > latest):
+                    latest = modified
+                count += 1
+            with self.lock:
+                self._store(docs)
+                if latest:
+                    self._set_meta("synced_gmt", latest)
+            total_pages = int(r.headers.get("X-WP-TotalPages", "1") or 1)
+            page += 1
+
+        logger.info(f"文章相似度索引同步完成，讀取 {count} 篇，索引共 {len(self.docs)} 篇")
+        return True
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_similarity_index(site):
+    """開啟站台的文章相似度索引並與 WordPress 同步（未啟用 DUP_CHECK 時回傳 None）"""
+    if not DUP_CHECK:
+        return None
+    os.makedirs(site.state_dir, exist_ok=True)
+    index = SimilarityIndex(os.path.join(site.state_dir, SIMILAR_DB_NAME), site)
+    try:
+        index.sync()
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"同步文章相似度索引時發生錯誤，將沿用現有索引: {e}")
+    return index
+
+# ---------------------------------------------------------------
+# 站台設定
+# ---------------------------------------------------------------
+def split_list(value):
+    """設定檔中的清單可寫成陣列或逗號分隔字串"""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(v).strip() for v in value or [] if str(v).strip()]
+
+def read_keywords_file(path):
+    """
+    讀取關鍵字檔，回傳 {關鍵字: 權重}。每行一個關鍵字，可寫成「關鍵字,權重」（預設 1，權重越高越常被挑選；
+    0 表示暫停使用），空行與 # 開頭的行略過
+    """
+    keywords = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keyword, _, weight = line.partition(",")
+            try:
+                weight = float(weight) if weight.strip() else 1.0
+            except ValueError:
+                raise ValueError(f"{path} 第 {lineno} 行的權重不是數字: {line}")
+            if keyword.strip() and weight > 0:
+                keywords[keyword.strip()] = weight
+    logger.info(f"從 {path} 載入 {len(keywords)} 個關鍵字")
+    return keywords
+
+class Site:
+    """
+    單一 WordPress 站台的設定。未指定的欄位沿用 .env 的全域設定，
+    因此單站台部署（未設定 SITES_FILE）時行為與過去相同，狀態仍存放於 STATE_DIR。
+    """
+
+    def __init__(self, name="default", state_dir=None, weight=1, wp_url=None, wp_user=None, wp_app_pass=None,
+                 brand_name=None, site_name=None, seo_brand_suffix=None, category_id=None, keywords=None,
+                 keywords_file=None, tags=None, default_seo_keywords=None, posts_per_day=None):
+        self.name = name
+        self.state_dir = state_dir or STATE_DIR
+        self.weight = max(0.01, float(weight))
+        self.wp_url = wp_url or WP_URL
+        self.wp_auth = (wp_user or WP_USER, wp_app_pass or WP_PASS)
+        self.brand = brand_name or BRAND
+        self.site_name = site_name or SITE_NAME
+        self.seo_brand_suffix = SEO_BRAND_SUFFIX if seo_brand_suffix is None else seo_brand_suffix
+        self.category_id = int(CATEGORY_ID if category_id is None else category_id)
+        # {關鍵字: 權重}；站台自己的 keywords_file / keywords 優先，其次為 .env 的 KEYWORDS_FILE / KEYWORDS
+        if keywords_file or (keywords is None and KEYWORDS_FILE):
+            self.keywords = read_keywords_file(keywords_file or KEYWORDS_FILE)
+        else:
+            self.keywords = dict.fromkeys(KEYWORDS if keywords is None else split_list(keywords), 1.0)
+        self.tags = TAGS_BASE[:] if tags is None else split_list(tags)
+        self.default_seo_keywords = DEFAULT_SEO_KEYWORDS[:] if default_seo_keywords is None else split_list(default_seo_keywords)
+        self.posts_per_day = int(POSTS_PER_DAY if posts_per_day is None else posts_per_day)
+
+    def __repr__(self):
+        return f"Site({self.name})"
+
+def load_sites():
+    """
+    讀取 SITES_FILE 定義的站台清單，格式：
+      {"sites": [{"name": "health", "wp_url": "...", "keywords": [...], "weight": 2, ...}, ...]}
+    每個站台的狀態存放於 STATE_DIR/sites/<name>/。未設定 SITES_FILE 時回傳以 .env 設定組成的單一站台。
+    """
+    if not SITES_FILE:
+        return [Site()]
+    with open(SITES_FILE, "r", encoding="utf-8") as f:
+        entries = json.load(f).get("sites", [])
+    sites = []
+    for entry in entries:
+        entry = dict(entry)
+        name = slugify(str(entry.pop("name", ""))) or f"site-{len(sites) + 1}"
+        if any(site.name == name for site in sites):
+            raise ValueError(f"站台名稱重複: {name}")
+        entry.setdefault("state_dir", os.path.join(STATE_DIR, "sites", name))
+        sites.append(Site(name, **entry))
+    if not sites:
+        raise ValueError(f"{SITES_FILE} 中沒有任何站台")
+    logger.info(f"載入 {len(sites)} 個站台: " + ", ".join(f"{site.name}(權重 {site.weight:g})" for site in sites))
+    return sites
+
 # ---------------------------------------------------------------
 # 環境變數檢查
 # ---------------------------------------------------------------
-def check_env_vars():
-    """檢查環境變數是否包含非 ASCII 字元"""
+def check_env_vars(site):
+    """檢查環境變數（與站台設定）是否包含非 ASCII 字元"""
     env_vars = {
-        "WP_URL": WP_URL,
-        "WP_USER": WP_USER, 
-        "WP_PASS": WP_PASS,
-        "BRAND_NAME": BRAND,
-        "SITE_NAME": SITE_NAME,
+        "WP_URL": site.wp_url,
+        "WP_USER": site.wp_auth[0], 
+        "WP_PASS": site.wp_auth[1],
+        "BRAND_NAME": site.brand,
+        "SITE_NAME": site.site_name,
         "GOOGLE_API_KEY": GOOGLE_API_KEY,
         "GOOGLE_CSE_ID": GOOGLE_CSE_ID,
         "GENAI_MODEL": GENAI_MODEL
@@ -445,111 +3344,1172 @@ def check_env_vars():
     
     for name, value in env_vars.items():
         if value and not value.isascii():
-            logger.warning(f"環境變數 {name} 包含非 ASCII 字元: {repr(value)}")
+            logger.warning(f"[{site.name}] 環境變數 {name} 包含非 ASCII 字元: {repr(value)}")
             logger.warning(f"這可能導致 HTTP 請求失敗")
 
 # ---------------------------------------------------------------
-# 主流程
+# 工作日誌（中斷後可接續執行）
 # ---------------------------------------------------------------
-def main():
-    """主程式流程，包含完整的錯誤處理和日誌記錄"""
-    logger.info("=== WordPress 文章自動生成器開始執行 ===")
-    
-    # 檢查環境變數
-    check_env_vars()
-    
-    used_refs = load_used_refs()
-    random.shuffle(KEYWORDS)
-    
-    success_count = 0
-    failure_count = 0
-    
-    for keyword in KEYWORDS[:POSTS_PER_DAY]:
-        logger.info(f"開始處理主題: {keyword}")
-        
-        try:
-            # 搜尋參考連結
-            refs = get_reference_links(keyword, used_refs)
-            if not refs:
-                logger.warning(f"沒找到新連結，使用預設參考資料")
-                # 使用預設參考資料
-                default_refs = [
-                    "https://www.healthline.com",
-                    "https://pubmed.ncbi.nlm.nih.gov",
-                    "https://www.webmd.com"
-                ]
-                refs = default_refs[:2]  # 取前兩個
-                logger.info(f"使用預設參考連結: {refs}")
-            else:
-                used_refs.extend(refs)
-                save_used_refs(used_refs)
-                logger.info(f"找到 {len(refs)} 個新參考連結")
+# 工作依序經過的階段；publishing 表示 slug 已保留、文章可能已送出
+JOB_STAGES = ["new", "searched", "generated", "publishing", "published"]
 
-            # 生成文章
-            obj = gemini_generate_article(keyword, BRAND, SITE_NAME, refs)
-            
-            # 檢查生成是否成功
+class JobJournal:
+    """
+    以 SQLite 記錄每個關鍵字工作的進度與中間產物（參考連結、SEO 欄位、組合後的 HTML）。
+    程式中斷或發佈失敗後，下次執行會從最後完成的階段接續，不必重新搜尋或產文。
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, keyword TEXT NOT NULL, stage TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, refs TEXT, obj TEXT, slug TEXT, result TEXT,"
+            " created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_stage ON jobs(stage)")
+
+    def _row_to_job(self, row):
+        job_id, keyword, stage, attempts, refs, obj, slug, result = row
+        return {
+            "id": job_id,
+            "keyword": keyword,
+            "stage": stage,
+            "attempts": attempts,
+            "refs": json.loads(refs) if refs else None,
+            "obj": json.loads(obj) if obj else None,
+            "slug": slug,
+            "result": json.loads(result) if result else None,
+        }
+
+    def create(self, keyword):
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO jobs (keyword, stage, created_at, updated_at) VALUES (?, 'new', ?, ?)",
+                (keyword, now, now)
+            )
+        return {"id": cur.lastrowid, "keyword": keyword, "stage": "new", "attempts": 0,
+                "refs": None, "obj": None, "slug": None, "result": None}
+
+    def pending(self):
+        """回傳尚未完成且未放棄的工作（由舊到新）"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, keyword, stage, attempts, refs, obj, slug, result FROM jobs"
+                " WHERE stage NOT IN ('published', 'abandoned') ORDER BY id"
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def advance(self, job, stage):
+        """將工作推進到指定階段並寫入目前的中間產物"""
+        job["stage"] = stage
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET stage = ?, refs = ?, obj = ?, slug = ?, result = ?, updated_at = ? WHERE id = ?",
+                (stage,
+                 json.dumps(job.get("refs"), ensure_ascii=False) if job.get("refs") is not None else None,
+                 json.dumps(job.get("obj"), ensure_ascii=False) if job.get("obj") is not None else None,
+                 job.get("slug"),
+                 json.dumps(job.get("result"), ensure_ascii=False) if job.get("result") is not None else None,
+                 datetime.now().isoformat(timespec="seconds"),
+                 job["id"])
+            )
+
+    def fail(self, job):
+        """記錄一次失敗；累計達 JOB_MAX_ATTEMPTS 次後放棄該工作"""
+        if job.get("stage") == "abandoned":
+            return
+        job["attempts"] = job.get("attempts", 0) + 1
+        stage = job["stage"]
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            logger.warning(f"關鍵字 {job['keyword']} 已失敗 {job['attempts']} 次，放棄此工作")
+            stage = "abandoned"
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET stage = ?, attempts = ?, updated_at = ? WHERE id = ?",
+                (stage, job["attempts"], datetime.now().isoformat(timespec="seconds"), job["id"])
+            )
+
+    def abandon(self, job):
+        """直接放棄工作（重試也不會成功的情況，例如產出的文章與既有文章重複）"""
+        job["stage"] = "abandoned"
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET stage = 'abandoned', updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(timespec="seconds"), job["id"])
+            )
+
+    def published_since(self, since):
+        """since（ISO 時間字串）之後發佈完成的工作數"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE stage = 'published' AND updated_at >= ?", (since,)
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_job_journal(site):
+    os.makedirs(site.state_dir, exist_ok=True)
+    return JobJournal(os.path.join(site.state_dir, JOBS_DB_NAME))
+
+def reached(job, stage):
+    """工作是否已完成指定階段"""
+    return JOB_STAGES.index(job.get("stage", "new")) >= JOB_STAGES.index(stage)
+
+class KeywordScheduler:
+    """
+    關鍵字排程，取代每次執行隨機打亂關鍵字清單：以最小堆積挑選「加權後最久未涵蓋」的關鍵字。
+    每個關鍵字有一個 pass 值，每發佈一篇增加 1/權重（stride scheduling），權重 2 的關鍵字涵蓋頻率是權重 1 的兩倍；
+    新加入的關鍵字從目前最小的 pass 開始，與最久未涵蓋的關鍵字一同優先挑選。工作被放棄時關鍵字進入退避，期間不會被挑選。
+    每篇文章的結果以單一 SQLite 交易寫入，程式中斷也不會遺失涵蓋紀錄。
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_state_db(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS keywords ("
+            " keyword TEXT PRIMARY KEY, weight REAL NOT NULL DEFAULT 1, pass REAL NOT NULL DEFAULT 0,"
+            " published INTEGER NOT NULL DEFAULT 0, last_published TEXT, failures INTEGER NOT NULL DEFAULT 0,"
+            " retry_after REAL NOT NULL DEFAULT 0, active INTEGER NOT NULL DEFAULT 1)"
+        )
+        # 關鍵字 -> {"pass", "weight", "failures", "retry_after", "version"}；堆積項目的 version 不符時為過期項目
+        self.state = {}
+        self.heap = []
+
+    def __len__(self):
+        return len(self.state)
+
+    def _push(self, keyword):
+        entry = self.state[keyword]
+        entry["version"] += 1
+        # 相同 pass 的關鍵字以隨機值決定先後
+        heapq.heappush(self.heap, (entry["pass"], random.random(), entry["version"], keyword))
+
+    def sync(self, keywords):
+        """
+        以站台目前的關鍵字清單（{關鍵字: 權重}）重建排程：新增的關鍵字加入，移除的停用但保留涵蓋紀錄。
+        新增或重新啟用的關鍵字 pass 不低於目前最小值，避免長期停用的關鍵字連續被挑中
+        """
+        with self.lock:
+            rows = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT keyword, weight, pass, failures, retry_after, active FROM keywords")}
+            base = min((rows[k][1] for k in keywords if k in rows and rows[k][4]), default=0.0)
+            inserts, updates = [], []
+            self.state = {}
+            for keyword, weight in keywords.items():
+                row = rows.get(keyword)
+                if row is None:
+                    inserts.append((keyword, weight, base))
+                    row = (weight, base, 0, 0.0, 1)
+                elif row[0] != weight or not row[4] or row[1] < base:
+                    row = (weight, max(row[1], base), row[2], row[3], 1)
+                    updates.append((weight, row[1], keyword))
+                self.state[keyword] = {"weight": weight, "pass": row[1], "failures": row[2],
+                                       "retry_after": row[3], "version": 0}
+            removed = [(k,) for k, row in rows.items() if row[4] and k not in keywords]
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT INTO keywords (keyword, weight, pass) VALUES (?, ?, ?)", inserts)
+            self.conn.executemany("UPDATE keywords SET weight = ?, pass = ?, active = 1 WHERE keyword = ?", updates)
+            self.conn.executemany("UPDATE keywords SET active = 0 WHERE keyword = ?", removed)
+            self.conn.execute("COMMIT")
+            self.heap = [(entry["pass"], random.random(), 0, keyword) for keyword, entry in self.state.items()]
+            heapq.heapify(self.heap)
+        now = time.time()
+        waiting = sum(1 for entry in self.state.values() if entry["retry_after"] > now)
+        logger.info(f"關鍵字排程: {len(self.state)} 個關鍵字（新增 {len(inserts)}、停用 {len(removed)}、退避中 {waiting}）")
+
+    def pick(self, count, exclude=()):
+        """
+        挑選接下來要處理的 count 個關鍵字（略過 exclude 與退避中的關鍵字）。
+        挑出的關鍵字暫時離開排程，直到以 published / failed / release 回報結果
+        """
+        now = time.time()
+        picked, skipped = [], []
+        with self.lock:
+            while self.heap and len(picked) < count:
+                item = heapq.heappop(self.heap)
+                keyword = item[3]
+                entry = self.state.get(keyword)
+                if entry is None or entry["version"] != item[2]:
+                    continue
+                if keyword in exclude or entry["retry_after"] > now:
+                    skipped.append(item)
+                    continue
+                entry["version"] += 1
+                picked.append(keyword)
+            for item in skipped:
+                heapq.heappush(self.heap, item)
+        return picked
+
+    def published(self, keyword):
+        """關鍵字發佈了一篇文章：推進 pass 並清除失敗紀錄"""
+        with self.lock:
+            entry = self.state.get(keyword)
+            if entry is not None:
+                entry.update({"pass": entry["pass"] + 1 / entry["weight"], "failures": 0, "retry_after": 0.0})
+                self._push(keyword)
+            self.conn.execute(
+                "UPDATE keywords SET pass = pass + 1 / weight, published = published + 1, last_published = ?,"
+                " failures = 0, retry_after = 0 WHERE keyword = ?",
+                (datetime.now().isoformat(timespec="seconds"), keyword)
+            )
+
+    def failed(self, keyword):
+        """關鍵字的工作被放棄：依連續失敗次數退避"""
+        with self.lock:
+            row = self.conn.execute("SELECT failures FROM keywords WHERE keyword = ?", (keyword,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            hours = min(KEYWORD_BACKOFF_HOURS * 2 ** (failures - 1), KEYWORD_BACKOFF_MAX_HOURS)
+            retry_after = time.time() + hours * 3600
+            self.conn.execute("UPDATE keywords SET failures = ?, retry_after = ? WHERE keyword = ?",
+                              (failures, retry_after, keyword))
+            entry = self.state.get(keyword)
+            if entry is not None:
+                entry.update({"failures": failures, "retry_after": retry_after})
+                self._push(keyword)
+        logger.warning(f"關鍵字 {keyword} 暫停挑選 {hours:g} 小時（連續失敗 {failures} 次）")
+
+    def release(self, keyword):
+        """挑出的關鍵字沒有結果（延後或留待下次接續）：放回排程，涵蓋紀錄不變"""
+        with self.lock:
+            if keyword in self.state:
+                self._push(keyword)
+
+    def close(self):
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+def load_keyword_scheduler(site):
+    os.makedirs(site.state_dir, exist_ok=True)
+    scheduler = KeywordScheduler(os.path.join(site.state_dir, KEYWORDS_DB_NAME))
+    scheduler.sync(site.keywords)
+    return scheduler
+
+# ---------------------------------------------------------------
+# 處理階段（搜尋 → 產文 → 發佈）
+# ---------------------------------------------------------------
+# 預設參考資料（找不到新連結時使用）
+DEFAULT_REFS = [
+    "https://www.healthline.com",
+    "https://pubmed.ncbi.nlm.nih.gov",
+    "https://www.webmd.com"
+]
+
+# 多個 worker 同時存取 used_refs 與 slug 時使用的鎖
+_refs_lock = threading.Lock()
+_slug_lock = threading.Lock()
+
+def stage_search(job, ctx):
+    """搜尋階段：取得參考連結並記錄為已使用"""
+    keyword = job["keyword"]
+    logger.info(f"開始處理主題: {keyword}")
+    if reached(job, "searched"):
+        logger.info(f"沿用上次執行取得的參考連結: {job['refs']}")
+        return job
+
+    used_refs = ctx["used_refs"]
+    refs = get_reference_links(keyword, used_refs, cache=ctx.get("search_cache"))
+    with _refs_lock:
+        # 其他 worker 可能在搜尋期間已使用相同連結
+        refs = [r for r in refs if r not in used_refs]
+        if refs:
+            used_refs.add(refs, keyword)
+
+    if not refs:
+        logger.warning(f"沒找到新連結，使用預設參考資料")
+        refs = DEFAULT_REFS[:REFS_PER_ARTICLE]
+        logger.info(f"使用預設參考連結: {refs}")
+    else:
+        logger.info(f"找到 {len(refs)} 個新參考連結")
+
+    job["refs"] = refs
+    ctx["journal"].advance(job, "searched")
+    return job
+
+def stage_generate(job, ctx):
+    """產文階段：呼叫 Gemini 並驗證生成內容"""
+    keyword = job["keyword"]
+    if reached(job, "generated"):
+        logger.info(f"沿用上次執行生成的文章: {job['obj']['seo_title']}")
+        return job
+
+    index = ctx.get("similar")
+    avoid = []
+    while True:
+        obj = gemini_generate_article(keyword, ctx["site"], job["refs"], job.get("excerpts", ""), avoid)
+
+        # 檢查生成是否成功
+        if obj is None or not obj.get("seo_title") or not obj.get("content"):
+            with _gemini_stats_lock:
+                gemini_stats["failures"] += 1
             if obj is None:
                 logger.error(f"文章生成失敗，跳過關鍵字: {keyword}")
-                failure_count += 1
-                continue
-                
-            # 驗證生成內容
-            if not obj.get("seo_title") or not obj.get("content"):
+            else:
+                # 驗證生成內容
                 logger.error(f"生成內容不完整，跳過關鍵字: {keyword}")
-                logger.error(f"生成物件: {obj}")
-                failure_count += 1
-                continue
+                logger.error(f"生成物件: {log_excerpt(str(obj))}")
+            return None
 
-            # 準備發佈內容
-            seo_title = obj["seo_title"].strip()
-            meta_desc = obj["meta_desc"].strip()
-            content_html = obj["content"]  # 已經包含參考資料
-            focus_keyword = obj.get("focus_keyword", "")
-
-            # 檢查標題是否過短
-            if len(seo_title) < 10:
-                logger.warning(f"標題過短: {seo_title}")
-
-            # 生成唯一 slug
-            slug = slugify(seo_title)
-            tries = 0
-            while wp_post_exists_by_slug(slug) and tries < 5:
-                tries += 1
-                slug = f"{slug}-{tries}"
-
-            # 發佈到 WordPress（使用新的安全發佈函數）
-            logger.info(f"準備發佈文章: {seo_title}")
-            result = safe_publish_to_wp(
-                seo_title, 
-                content_html, 
-                meta_desc, 
-                slug, 
-                focus_keyword
-            )
-            
+        # 與站台既有文章（及本次執行中其他剛產出的文章）比對
+        match = index.claim(f"job:{job['id']}", obj["seo_title"], obj["content"]) if index else None
+        if match is None:
+            break
+        similarity, title, _ = match
+        with _gemini_stats_lock:
+            gemini_stats["duplicates"] += 1
+        if len(avoid) >= DUP_RETRIES:
+            logger.warning(f"文章與既有文章「{title}」相似度 {similarity:.2f}，放棄關鍵字: {keyword}")
+            ctx["journal"].abandon(job)
+            return None
+        logger.warning(f"文章與既有文章「{title}」相似度 {similarity:.2f}，換個角度重新產文")
+        avoid.append(title)
+
+    with _gemini_stats_lock:
+        gemini_stats["articles"] += 1
+
+    job["obj"] = obj
+    ctx["journal"].advance(job, "generated")
+    return job
+
+def stage_fetch(job, ctx):
+    """擷取階段：下載參考頁面並產生注入提示的摘錄（未啟用 REF_FETCH 時略過）"""
+    cache = ctx.get("page_cache")
+    if cache is None or reached(job, "generated"):
+        return job
+    try:
+        job["excerpts"] = fetch_reference_excerpts(job["refs"], cache)
+    except Exception as e:
+        # 摘錄只是輔助資料，失敗時仍以純連結產文
+        logger.warning(f"擷取參考頁面時發生錯誤，改以純連結產文: {e}")
+    return job
+
+# 每次發佈前一併向 WordPress 驗證的候選 slug 數量
+SLUG_VERIFY_CANDIDATES = 5
+
+# 單一 ?slug= 查詢最多包含的 slug 數與查詢字串長度（非 ASCII slug 編碼後很長，避免超過伺服器的 URL 上限）
+SLUG_QUERY_MAX = 100
+SLUG_QUERY_MAX_CHARS = 6000
+
+def check_slugs(site, candidates):
+    """向 WordPress 驗證多個候選 slug，必要時分成數個請求；任一請求失敗時回傳 None"""
+    existing = set()
+    chunk, length = [], 0
+    for slug in candidates + [None]:
+        size = len(quote(slug)) + 1 if slug else 0
+        if chunk and (slug is None or len(chunk) >= SLUG_QUERY_MAX or length + size > SLUG_QUERY_MAX_CHARS):
+            found = wp_existing_slugs(site, chunk)
+            if found is None:
+                return None
+            existing |= found
+            chunk, length = [], 0
+        if slug:
+            chunk.append(slug)
+            length += size
+    return existing
+
+def reserve_slugs(titles, slugs):
+    """
+    依站台的本地 slug 索引為多篇文章選出可用 slug，並以盡量少的請求向 WordPress 驗證以避免競態
+    （單篇發佈時為一個請求，一批文章通常也只需要一個請求）。
+    """
+    per_title = max(2, min(SLUG_VERIFY_CANDIDATES, SLUG_QUERY_MAX // max(1, len(titles))))
+    bases = [slugify(title) for title in titles]
+    chosen = [None] * len(titles)
+    with _slug_lock:
+        while None in chosen:
+            taken = slugs.reserved | {c for c in chosen if c}
+            wanted = {i: slugs.candidates(bases[i], per_title, taken) for i, c in enumerate(chosen) if c is None}
+            candidates = list(dict.fromkeys(c for group in wanted.values() for c in group))
+            existing = check_slugs(slugs.site, candidates)
+            if existing is not None:
+                slugs.add(existing)
+            for i, group in wanted.items():
+                # 無法驗證時以本地索引為準
+                free = [c for c in group if existing is None or normalize_slug(c) not in existing]
+                free = [c for c in free if c not in chosen]
+                if free:
+                    chosen[i] = free[0]
+        slugs.reserved.update(chosen)
+    return chosen
+
+def reserve_slug(seo_title, slugs):
+    return reserve_slugs([seo_title], slugs)[0]
+
+def stage_publish(job, ctx):
+    """發佈階段：決定 slug 並送出至 WordPress；以保留的 slug 確保重試時不會重複發文"""
+    keyword = job["keyword"]
+    obj = job["obj"]
+    site = ctx["site"]
+    slugs = ctx["slugs"]
+    journal = ctx["journal"]
+
+    # 準備發佈內容
+    seo_title = obj["seo_title"].strip()
+    meta_desc = obj["meta_desc"].strip()
+    content_html = obj["content"]  # 已經包含參考資料
+    focus_keyword = obj.get("focus_keyword", "")
+
+    # 上次執行已送出但未確認結果：先確認文章是否已存在
+    result = None
+    if job.get("stage") == "publishing" and job.get("slug"):
+        result = wp_find_post_by_slug(site, job["slug"])
+        if result:
+            logger.info(f"文章已於先前執行發佈，不重複送出: {result.get('link', job['slug'])}")
+
+    if not result:
+        # 檢查標題是否過短
+        if len(seo_title) < 10:
+            logger.warning(f"標題過短: {seo_title}")
+
+        # 生成唯一 slug，並在送出前寫入日誌（上次保留的 slug 已確認未建立文章，先歸還）
+        if job.get("slug"):
+            slugs.release(job["slug"])
+        slug = reserve_slug(seo_title, slugs)
+        job["slug"] = slug
+        journal.advance(job, "publishing")
+
+        # 發佈到 WordPress（使用新的安全發佈函數）
+        logger.info(f"準備發佈文章: {seo_title}")
+        result = safe_publish_to_wp(
+            site,
+            seo_title,
+            content_html,
+            meta_desc,
+            slug,
+            focus_keyword,
+            ctx["profile"]
+        )
+
+        # 逾時或 5xx 時文章可能已建立，以 slug 確認
+        if not result:
+            result = wp_find_post_by_slug(site, slug)
             if result:
-                success_count += 1
-                logger.info(f"✅ 成功處理關鍵字: {keyword}")
+                logger.info(f"發佈回應失敗，但文章已建立: {result.get('link', slug)}")
+
+    if not result:
+        logger.error(f"❌ 發佈失敗，跳過關鍵字: {keyword}")
+        return None
+    return finish_publish(job, ctx, result)
+
+def finish_publish(job, ctx, result):
+    """文章已建立：更新 slug 索引並在工作日誌中標記為已發佈"""
+    ctx["slugs"].add([result.get("slug") or job["slug"]])
+    job["result"] = {"id": result.get("id"), "link": result.get("link"), "slug": result.get("slug")}
+    if ctx.get("similar") is not None and result.get("id"):
+        ctx["similar"].commit(f"job:{job['id']}", result["id"], job["obj"]["seo_title"], job["obj"]["content"])
+    ctx["journal"].advance(job, "published")
+    logger.info(f"✅ 成功處理關鍵字: {job['keyword']}")
+    return job
+
+def publish_batch(jobs, ctx):
+    """
+    以一個 /batch/v1 請求發佈多篇文章，回傳 [(job, 是否成功)]。
+    各篇的 slug 在送出前寫入日誌；個別失敗或整批結果不明（逾時、5xx）的文章改走單篇發佈，
+    單篇發佈會先以 slug 確認文章是否已建立，不會重複發文。
+    """
+    site = ctx["site"]
+    profile = ctx["profile"]
+    journal = ctx["journal"]
+    outcome = {}
+    retry = []
+
+    # 上次執行已送出但未確認結果的工作逐篇確認
+    fresh = []
+    for job in jobs:
+        (retry if job.get("stage") == "publishing" and job.get("slug") else fresh).append(job)
+
+    if fresh:
+        titles = [job["obj"]["seo_title"].strip() for job in fresh]
+        for job, slug in zip(fresh, reserve_slugs(titles, ctx["slugs"])):
+            job["slug"] = slug
+            journal.advance(job, "publishing")
+        items = []
+        for job in fresh[:]:
+            obj = job["obj"]
+            args = (site, obj["seo_title"].strip(), obj["content"], obj["meta_desc"].strip(), job["slug"],
+                    obj.get("focus_keyword", ""), profile)
+            try:
+                payload = build_post_payload(*args)
+            except Exception as e:
+                # 標籤解析失敗不影響同批的其他文章，該篇改為不附標籤
+                logger.warning(f"建立發佈內容時發生錯誤（{job['keyword']}），改為不附標籤: {e}")
+                try:
+                    payload = build_post_payload(*args, tags=False)
+                except Exception as e:
+                    logger.error(f"處理關鍵字 {job['keyword']} 時發生錯誤: {e}")
+                    outcome[id(job)] = False
+                    fresh.remove(job)
+                    continue
+            items.append({"method": "POST", "path": "/wp/v2/posts", "body": payload})
+
+    if fresh:
+        logger.info(f"[{site.name}] 以 batch 發佈 {len(items)} 篇文章")
+        responses = None
+        try:
+            # 整批送出不是冪等操作：5xx 或逾時時不重送，改由逐篇以 slug 確認
+            r = api_request("wp", "POST", f"{wp_rest_root(site)}/batch/v1", op="wp.publish_batch", idempotent=False,
+                            auth=site.wp_auth, json={"validation": "normal", "requests": items},
+                            timeout=60 + 5 * len(items))
+            if r.status_code in (200, 207):
+                responses = r.json().get("responses")
+            elif r.status_code == 404:
+                logger.warning(f"[{site.name}] 站台沒有 /batch/v1 端點，改為逐篇發佈")
+                profile.batch_unavailable()
             else:
-                failure_count += 1
-                logger.error(f"❌ 發佈失敗，跳過關鍵字: {keyword}")
-                continue
-            
+                logger.error(f"batch 發佈失敗，狀態碼: {r.status_code}，改為逐篇發佈: {log_excerpt(r.text, 300)}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"batch 發佈請求失敗，改為逐篇確認與發佈: {e}")
+
+        if not isinstance(responses, list) or len(responses) != len(fresh):
+            retry += fresh
+        else:
+            for job, item in zip(fresh, responses):
+                status, body = item.get("status"), item.get("body") or {}
+                if status == 201:
+                    outcome[id(job)] = finish_publish(job, ctx, body) is not None
+                    continue
+                logger.warning(f"batch 中的文章發佈失敗（{job['keyword']}），狀態碼: {status}，"
+                               f"{body.get('message', '')}；改為單篇發佈")
+                if status == 403 and "meta" in str(body.get("message", "")).lower():
+                    profile.meta_blocked()
+                retry.append(job)
+
+    for job in retry:
+        try:
+            outcome[id(job)] = call_stage("publish", stage_publish, job, ctx) is not None
         except Exception as e:
-            logger.error(f"處理關鍵字 {keyword} 時發生錯誤: {e}")
-            failure_count += 1
-            
-        # 等待一下再處理下一個
-        time.sleep(5)
+            logger.error(f"處理關鍵字 {job['keyword']} 時發生錯誤: {e}")
+            outcome[id(job)] = False
+    return [(job, outcome[id(job)]) for job in jobs]
+
+class PublishBatcher:
+    """
+    批次發佈（WP_BATCH_PUBLISH=1）：收集產文完成的工作，每個站台累積到一批（WP_BATCH_SIZE 與站台 batch 上限取小者）
+    時以一個請求送出，結束時送出剩餘的工作；站台不支援 batch 或只剩一篇時改走單篇發佈。
+    每篇的結果以 done(job, 是否成功) 回報。
+    """
+
+    def __init__(self, contexts, done):
+        self.contexts = contexts
+        self.done = done
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def batch_size(self, ctx):
+        caps = ctx["profile"].caps
+        if not caps or not caps.get("batch"):
+            return 1
+        return max(1, min(WP_BATCH_SIZE, caps.get("batch_max") or WP_BATCH_SIZE))
+
+    def add(self, job):
+        ctx = self.contexts[job["site"]]
+        with self.lock:
+            queued = self.pending.setdefault(job["site"], [])
+            queued.append(job)
+            if len(queued) < self.batch_size(ctx):
+                return
+            batch = self.pending.pop(job["site"])
+        self._publish(batch, ctx)
+
+    def flush(self):
+        with self.lock:
+            batches, self.pending = self.pending, {}
+        for name, batch in batches.items():
+            self._publish(batch, self.contexts[name])
+
+    def _publish(self, batch, ctx):
+        if len(batch) == 1:
+            results = [(batch[0], call_stage("publish", stage_publish, batch[0], ctx) is not None)]
+        else:
+            token = current_job.set({"site": ctx["site"].name, "keyword": None, "stage": "publish"})
+            start = time.perf_counter()
+            try:
+                results = publish_batch(batch, ctx)
+            except Exception as e:
+                logger.error(f"[{ctx['site'].name}] batch 發佈時發生錯誤: {e}")
+                results = [(job, False) for job in batch]
+            finally:
+                metrics.observe("stage.publish_batch", time.perf_counter() - start)
+                current_job.reset(token)
+        for job, ok in results:
+            if not ok:
+                ctx["journal"].fail(job)
+            self.done(job, ok)
+
+def profile_stage(name, func, job, ctx):
+    """以 cProfile 與 tracemalloc 剖析單一階段，結果寫入 METRICS_DIR"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    prefix = os.path.join(METRICS_DIR, f"profile-{metrics.run_id}-{slugify(job['keyword'])}-{name}")
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(25)
+    try:
+        return profiler.runcall(func, job, ctx)
+    finally:
+        profiler.dump_stats(prefix + ".prof")
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+        with open(prefix + ".mem.txt", "w", encoding="utf-8") as f:
+            f.write(f"current={current} peak={peak}\n")
+            for stat in snapshot.statistics("lineno")[:30]:
+                f.write(f"{stat}\n")
+        logger.info(f"已輸出剖析結果: {prefix}.prof / .mem.txt")
+
+def call_stage(name, func, job, ctx):
+    """執行單一階段並記錄耗時；PROFILE_KEYWORD 指定的關鍵字會一併剖析"""
+    token = current_job.set({"site": ctx["site"].name, "keyword": job["keyword"], "stage": name})
+    start = time.perf_counter()
+    result = None
+    try:
+        if PROFILE_KEYWORD and job["keyword"] == PROFILE_KEYWORD:
+            result = profile_stage(name, func, job, ctx)
+        else:
+            result = func(job, ctx)
+        return result
+    finally:
+        metrics.observe(f"stage.{name}", time.perf_counter() - start, error=result is None)
+        current_job.reset(token)
+
+def run_stages(job, stages, ctx):
+    """依序執行各階段，失敗時記錄到工作日誌，回傳是否成功"""
+    keyword = job["keyword"]
+    try:
+        for name, stage in stages:
+            if call_stage(name, stage, job, ctx) is None:
+                break
+        else:
+            return True
+    except Exception as e:
+        logger.error(f"處理關鍵字 {keyword} 時發生錯誤: {e}")
+    ctx["journal"].fail(job)
+    return False
+
+def article_cost(job):
+    """完成工作預估還需要的 Google API 呼叫數（已完成的階段不再計算）"""
+    cost = {}
+    if not reached(job, "searched"):
+        cost["cse"] = 1
+    if not reached(job, "generated"):
+        # JSON 模式可能需要一次欄位修正請求
+        cost["gemini"] = 2 if GEMINI_JSON_MODE else 1
+    return cost
+
+def budget_allows(job):
+    """剩餘配額不足以完成整篇文章時不開始此工作（留在工作日誌中，下次執行再處理）"""
+    if api_keys is None or api_keys.can_afford(article_cost(job)):
+        return True
+    logger.warning(f"剩餘 API 配額不足以完成一篇文章，延後關鍵字: {job['keyword']}")
+    return False
+
+def post_counter(contexts):
+    """
+    回傳 (counts, done)：done(job, ok) 記錄一篇文章的結果（ok 為 None 表示延後到配額重置後）並回報給關鍵字排程，
+    可在多個執行緒中呼叫
+    """
+    counts = {"success": 0, "failure": 0, "deferred": 0}
+    lock = threading.Lock()
+
+    def done(job, ok):
+        ctx = contexts[job["site"]]
+        if not ok and ctx.get("similar") is not None:
+            # 沒有發佈的文章不再佔用暫存的簽章，否則之後相似主題的文章會被誤判為重複
+            ctx["similar"].release(f"job:{job['id']}")
+        if job.get("slug") and ctx.get("slugs") is not None and (ok or job.get("stage") != "publishing"):
+            # 保留的 slug 不再需要：發佈成功的已加入索引，放棄的不會再發佈。
+            # 發佈結果不明而失敗的工作仍以此 slug 確認是否已建立，接續發佈時才歸還
+            ctx["slugs"].release(job["slug"])
+        scheduler = ctx["keywords"]
+        if ok:
+            scheduler.published(job["keyword"])
+        elif ok is False and job.get("stage") == "abandoned":
+            scheduler.failed(job["keyword"])
+        else:
+            # 失敗但未放棄的工作留在工作日誌中，下次執行會優先接續
+            scheduler.release(job["keyword"])
+        if ok is not None:
+            metrics.record_post(job["site"], ok)
+        with lock:
+            counts["deferred" if ok is None else "success" if ok else "failure"] += 1
+
+    return counts, done
+
+def run_sequential(jobs, contexts):
+    """逐一處理工作（contexts 為站台名稱對應的 ctx），回傳 (成功數, 失敗數)"""
+    stages = [("search", stage_search), ("fetch", stage_fetch), ("generate", stage_generate), ("publish", stage_publish)]
+    counts, done = post_counter(contexts)
+    batcher = None
+    if WP_BATCH_PUBLISH:
+        # 發佈交給 PublishBatcher，累積成批後一次送出
+        stages = stages[:-1]
+        batcher = PublishBatcher(contexts, done)
+
+    for idx, job in enumerate(jobs):
+        if not budget_allows(job):
+            logger.warning(f"停止開始新的關鍵字，{len(jobs) - idx} 個工作延後到配額重置後")
+            # 與管線模式相同：未開始的工作計為延後，挑出的關鍵字放回排程
+            for deferred in jobs[idx:]:
+                done(deferred, None)
+            break
+        ok = run_stages(job, stages, contexts[job["site"]])
+        if ok and batcher is not None:
+            batcher.add(job)
+        else:
+            done(job, ok)
+
+    if batcher is not None:
+        batcher.flush()
+    return counts["success"], counts["failure"]
+
+# 管線佇列的結束標記
+_STOP = object()
+
+def _put_while_alive(q, item, consumers):
+    """
+    放入有界佇列；佇列已滿時定期確認消費端的 worker 是否仍在執行，
+    全部已結束（不會再有人取出）時放棄並回傳 False，避免永久阻塞
+    """
+    while True:
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            if not any(t.is_alive() for t in consumers):
+                return False
+
+def _stage_worker(name, func, in_q, out_q, contexts, done, first_q, finish=None, consumers=()):
+    """
+    管線 worker：從 in_q 取出工作，處理後交給 out_q；最後一階段交給 finish（未指定時計入成功）。
+    第一階段先確認剩餘配額。單一工作的任何錯誤都只讓該工作失敗，worker 會繼續處理直到收到 _STOP。
+    """
+    while True:
+        job = in_q.get()
+        if job is _STOP:
+            return
+        try:
+            _stage_item(name, func, job, out_q, contexts, done, first_q, in_q, finish, consumers)
+        except Exception as e:
+            logger.error(f"[{name}] 處理關鍵字 {job.get('keyword')} 的結果時發生錯誤: {e}")
+            try:
+                contexts[job["site"]]["journal"].fail(job)
+                done(job, False)
+            except Exception as e:
+                logger.error(f"[{name}] 無法記錄關鍵字 {job.get('keyword')} 的失敗: {e}")
+
+def _stage_item(name, func, job, out_q, contexts, done, first_q, in_q, finish, consumers):
+    """_stage_worker 處理單一工作：確認配額、執行階段，再交給下一階段或回報結果"""
+    ctx = contexts[job["site"]]
+    if in_q is first_q and not budget_allows(job):
+        # 配額不足：不計為失敗，工作留在日誌中等下次執行
+        done(job, None)
+        return
+    try:
+        ok = call_stage(name, func, job, ctx) is not None
+    except Exception as e:
+        logger.error(f"[{name}] 處理關鍵字 {job['keyword']} 時發生錯誤: {e}")
+        ok = False
+
+    if ok and out_q is not None:
+        if _put_while_alive(out_q, job, consumers):
+            return
+        logger.error(f"[{name}] 下一階段的 worker 已全部結束，關鍵字 {job['keyword']} 無法繼續處理")
+        ok = False
+    if not ok:
+        ctx["journal"].fail(job)
+        done(job, False)
+    elif finish is not None:
+        finish(job)
+    else:
+        done(job, True)
+
+def run_pipeline(jobs, contexts):
+    """以管線方式處理工作：各階段擁有獨立 worker 數，階段間以有界佇列串接"""
+    stages = [
+        ("search", stage_search, SEARCH_WORKERS),
+        ("fetch", stage_fetch, SEARCH_WORKERS),
+        ("generate", stage_generate, GENERATE_WORKERS),
+        ("publish", stage_publish, PUBLISH_WORKERS),
+    ]
+    counts, done = post_counter(contexts)
+    batcher = None
+    if WP_BATCH_PUBLISH:
+        # 產文完成的工作交給 PublishBatcher，由填滿一批的 worker 送出
+        stages = stages[:-1]
+        batcher = PublishBatcher(contexts, done)
+    logger.info("管線模式啟動 - " + ", ".join(f"{name}: {n} workers" for name, _, n in stages)
+                + ("，批次發佈" if batcher else ""))
+
+    # 第一個佇列放入所有工作，之後的佇列有界，避免產文過快堆積
+    queues = [queue.Queue()] + [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stages[1:]] + [None]
+    # 先建立所有 worker，讓每個階段都能確認下一階段的 worker 是否仍在執行
+    pools = [[] for _ in stages] + [[]]
+    for idx, (name, func, workers) in enumerate(stages):
+        for n in range(max(1, workers)):
+            pools[idx].append(threading.Thread(
+                target=_stage_worker,
+                args=(name, func, queues[idx], queues[idx + 1], contexts, done, queues[0],
+                      batcher.add if batcher else None, pools[idx + 1]),
+                name=f"{name}-{n}",
+                daemon=True
+            ))
+    for threads in pools:
+        for t in threads:
+            t.start()
+
+    for job in jobs:
+        queues[0].put(job)
+
+    # 依序關閉各階段：前一階段全部結束後才通知下一階段停止；
+    # 某階段的 worker 意外結束時不在已滿的佇列上等待
+    for idx, threads in enumerate(pools[:-1]):
+        for _ in threads:
+            if not _put_while_alive(queues[idx], _STOP, threads):
+                break
+        for t in threads:
+            t.join()
+    if batcher is not None:
+        batcher.flush()
+
+    if counts["deferred"]:
+        logger.warning(f"API 配額不足，{counts['deferred']} 個工作延後到配額重置後")
+    return counts["success"], counts["failure"]
+
+def open_site_stores(site, shared):
+    """開啟單一站台的 ctx：站台自己的狀態資料庫，加上所有站台共用的快取"""
+    return {
+        "site": site,
+        "used_refs": load_used_refs(site),
+        "slugs": load_slug_index(site),
+        "journal": load_job_journal(site),
+        "keywords": load_keyword_scheduler(site),
+        "profile": load_wp_profile(site),
+        "similar": load_similarity_index(site),
+        **shared,
+    }
+
+def open_stores(sites):
+    """開啟所有站台的 ctx，回傳 {站台名稱: ctx}；搜尋與頁面快取只開啟一次"""
+    shared = {"search_cache": load_search_cache(), "page_cache": load_page_cache()}
+    return {site.name: open_site_stores(site, shared) for site in sites}
+
+def close_stores(contexts):
+    closed = set()
+    for ctx in contexts.values():
+        for key, store in ctx.items():
+            if key == "site" or store is None or id(store) in closed:
+                continue
+            closed.add(id(store))
+            store.close()
+
+def plan_jobs(ctx, limit):
+    """先接續站台上次未完成的工作，再由關鍵字排程挑選最久未涵蓋的關鍵字補足本次篇數"""
+    journal = ctx["journal"]
+    site = ctx["site"]
+    pending = journal.pending()
+    jobs = pending[:limit]
+    if jobs:
+        logger.info(f"[{site.name}] 接續 {len(jobs)} 個未完成的工作: "
+                    + ", ".join(f"{j['keyword']}({j['stage']})" for j in jobs))
+    busy = {j["keyword"] for j in pending}
+    for keyword in ctx["keywords"].pick(limit - len(jobs), busy):
+        jobs.append(journal.create(keyword))
+    for job in jobs:
+        job["site"] = site.name
+    return jobs
+
+def interleave_jobs(batches, contexts):
+    """
+    依站台權重以平滑加權輪詢（smooth weighted round-robin）交錯各站台的工作，
+    讓管線入口也按比例分配，而不是先處理完某個站台再輪到下一個。
+    """
+    pending = {name: list(jobs) for name, jobs in batches.items() if jobs}
+    current = {name: 0.0 for name in pending}
+    order = []
+    while pending:
+        total = sum(contexts[name]["site"].weight for name in pending)
+        for name in pending:
+            current[name] += contexts[name]["site"].weight
+        pick = max(pending, key=current.get)
+        current[pick] -= total
+        order.append(pending[pick].pop(0))
+        if not pending[pick]:
+            del pending[pick], current[pick]
+    return order
+
+def plan_all_jobs(sites, contexts):
+    """為每個站台規劃本次篇數的工作，並依權重交錯"""
+    batches = {}
+    for site in sites:
+        batches[site.name] = plan_jobs(contexts[site.name], site.posts_per_day)
+    return interleave_jobs(batches, contexts)
+
+# ---------------------------------------------------------------
+# 主流程
+# ---------------------------------------------------------------
+def main():
+    """主程式流程，包含完整的錯誤處理和日誌記錄"""
+    global metrics, api_keys, model_stats
+    metrics = RunMetrics(new_run_id())
+    logger.info(f"=== WordPress 文章自動生成器開始執行（run {metrics.run_id}）===")
+    
+    sites = load_sites()
+    api_keys = load_api_keys()
+    model_stats = load_model_stats()
+    configure_fair_share(sites)
+
+    # 檢查環境變數
+    for site in sites:
+        check_env_vars(site)
+    
+    contexts = open_stores(sites)
+    jobs = plan_all_jobs(sites, contexts)
+
+    if PIPELINE_MODE:
+        success_count, failure_count = run_pipeline(jobs, contexts)
+    else:
+        success_count, failure_count = run_sequential(jobs, contexts)
     
     # 總結報告
     logger.info(f"=== 執行完成 ===")
     logger.info(f"成功: {success_count} 篇")
     logger.info(f"失敗: {failure_count} 篇")
     
+    if len(sites) > 1:
+        for name, posts in metrics.site_posts.items():
+            logger.info(f"[{name}] 成功 {posts['success']} 篇，失敗 {posts['failure']} 篇")
+    
     if failure_count > 0:
         logger.warning(f"有 {failure_count} 個關鍵字處理失敗，請檢查日誌檔案: {LOG_FILE}")
 
+    log_gemini_stats(success_count)
+    metrics.posts = {"success": success_count, "failure": failure_count}
+    write_run_report(metrics)
+    close_stores(contexts)
+    context_cache.close()
+    api_keys.close()
+    model_stats.close()
+
+# ---------------------------------------------------------------
+# 常駐模式
+# ---------------------------------------------------------------
+# 由訊號處理函式設定，主迴圈在等待時被喚醒後處理
+_daemon_wake = threading.Event()
+_daemon_flags = {"reload": False, "stop": False}
+
+def parse_time_ranges(spec):
+    """解析 "HH:MM-HH:MM,..." 為一天內的分鐘區間清單；跨午夜的區間會拆成兩段"""
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            start_text, end_text = part.split("-")
+            start = sum(int(x) * m for x, m in zip(start_text.strip().split(":"), (60, 1)))
+            end = sum(int(x) * m for x, m in zip(end_text.strip().split(":"), (60, 1)))
+        except ValueError:
+            logger.warning(f"無法解析時段設定: {part}")
+            continue
+        if start < end:
+            ranges.append((start, end))
+        elif start > end:
+            ranges += [(start, 24 * 60), (0, end)]
+    return sorted(ranges)
+
+def open_minutes(after=0):
+    """PUBLISH_WINDOW 扣除 QUIET_HOURS 後、從第 after 分鐘起可發佈的分鐘區間"""
+    spans = [(max(start, after), end) for start, end in parse_time_ranges(PUBLISH_WINDOW) if end > after]
+    for quiet_start, quiet_end in parse_time_ranges(QUIET_HOURS):
+        remaining = []
+        for start, end in spans:
+            if quiet_end <= start or quiet_start >= end:
+                remaining.append((start, end))
+                continue
+            if start < quiet_start:
+                remaining.append((start, quiet_start))
+            if quiet_end < end:
+                remaining.append((quiet_end, end))
+        spans = remaining
+    return [(start, end) for start, end in spans if end > start]
+
+def plan_slots(day, count, after=None):
+    """
+    將 count 篇平均分散在當天可發佈的時間內，每個時間點再加上隨機偏移。
+    after 之前的時間不再安排（程式中途啟動或重新載入設定時只排剩下的時段）。
+    """
+    midnight = datetime.combine(day, datetime.min.time())
+    offset = 0 if after is None else max(0, (after - midnight).total_seconds() / 60)
+    spans = open_minutes(offset)
+    total = sum(end - start for start, end in spans)
+    if count <= 0 or total <= 0:
+        return []
+
+    spacing = total / count
+    jitter = min(SLOT_JITTER_MINUTES, spacing * 0.4)
+    slots = []
+    for i in range(count):
+        position = (i + 0.5) * spacing + random.uniform(-jitter, jitter)
+        for start, end in spans:
+            if position < end - start:
+                slots.append(midnight + timedelta(minutes=start + position))
+                break
+            position -= end - start
+    return slots
+
+def _daemon_signal(signum, frame):
+    if signum == signal.SIGHUP:
+        _daemon_flags["reload"] = True
+    else:
+        _daemon_flags["stop"] = True
+    _daemon_wake.set()
+
+def reload_settings():
+    """重新讀取 .env（覆寫目前的環境變數）並更新可即時變更的設定"""
+    load_dotenv(override=True)
+    load_settings()
+    logger.info(f"已重新載入設定：時段 {PUBLISH_WINDOW}，靜默 {QUIET_HOURS or '無'}")
+
+def sync_contexts(contexts, sites):
+    """重新載入站台設定後更新 ctx：沿用既有站台的資料庫連線，開啟新站台，關閉已移除的站台"""
+    shared = {key: value for key, value in next(iter(contexts.values())).items()
+              if key in ("search_cache", "page_cache")}
+    updated = {}
+    for site in sites:
+        ctx = contexts.get(site.name)
+        if ctx is None:
+            logger.info(f"新增站台: {site.name}")
+            ctx = open_site_stores(site, shared)
+        else:
+            ctx["site"] = site
+            ctx["keywords"].sync(site.keywords)
+            ctx["slugs"].site = site
+            ctx["profile"].site = site
+            if ctx["similar"] is not None:
+                ctx["similar"].site = site
+        updated[site.name] = ctx
+    for name, ctx in contexts.items():
+        if name not in updated:
+            logger.info(f"移除站台: {name}")
+            for key in ("used_refs", "slugs", "journal", "keywords", "profile", "similar"):
+                if ctx[key] is not None:
+                    ctx[key].close()
+    return updated
+
+def plan_day(sites, contexts, day, now):
+    """為每個站台安排當天剩下的發佈時段，回傳依時間排序的 (時間, 站台名稱) 清單"""
+    midnight = datetime.combine(day, datetime.min.time()).isoformat(timespec="seconds")
+    slots = []
+    for site in sites:
+        done = contexts[site.name]["journal"].published_since(midnight)
+        planned = plan_slots(day, site.posts_per_day - done, after=now)
+        logger.info(f"[{site.name}] {day} 已發佈 {done} 篇，安排 {len(planned)} 個時段: "
+                    + ", ".join(slot.strftime("%H:%M") for slot in planned))
+        slots += [(slot, site.name) for slot in planned]
+    return sorted(slots)
+
+def wait_until(target):
+    """等待到 target 為止；收到訊號時提前返回 False。每分鐘重新比對時鐘以應付系統時間調整"""
+    while True:
+        if _daemon_flags["stop"] or _daemon_flags["reload"]:
+            return False
+        remaining = (target - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return True
+        _daemon_wake.wait(min(remaining, 60))
+        _daemon_wake.clear()
+
+def run_daemon():
+    """
+    常駐執行：狀態資料庫與各 API 的連線只建立一次並持續重用，
+    每天依 PUBLISH_WINDOW / QUIET_HOURS 為每個站台排出 posts_per_day 個帶隨機偏移的時間點逐篇發佈，
+    讓 WordPress 承受平均的寫入量而不是每天一次的尖峰。
+    SIGHUP 重新載入 .env 與站台設定，SIGTERM / SIGINT 在目前文章處理完後結束。
+    """
+    global metrics, api_keys, model_stats
+    signal.signal(signal.SIGHUP, _daemon_signal)
+    signal.signal(signal.SIGTERM, _daemon_signal)
+    signal.signal(signal.SIGINT, _daemon_signal)
+
+    metrics = RunMetrics(new_run_id())
+    logger.info(f"=== WordPress 文章自動生成器以常駐模式啟動（PID {os.getpid()}，run {metrics.run_id}）===")
+    sites = load_sites()
+    api_keys = load_api_keys()
+    model_stats = load_model_stats()
+    configure_fair_share(sites)
+    for site in sites:
+        check_env_vars(site)
+    contexts = open_stores(sites)
+    day = None
+    slots = []
+
+    while not _daemon_flags["stop"]:
+        if _daemon_flags["reload"]:
+            _daemon_flags["reload"] = False
+            reload_settings()
+            api_keys.set_keys(GOOGLE_API_KEYS)
+            try:
+                sites = load_sites()
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"站台設定有誤，沿用目前的站台: {e}")
+            else:
+                contexts = sync_contexts(contexts, sites)
+                configure_fair_share(sites)
+            # 以新設定重新安排今天剩下的時段
+            day = None
+
+        now = datetime.now()
+        if day != now.date():
+            if day is not None and day < now.date():
+                # 新的一天：另開一份執行報告、增量同步 slug 與相似度索引，站台能力超過有效時間時重新探測
+                metrics = RunMetrics(new_run_id())
+                for ctx in contexts.values():
+                    ctx["profile"].probe()
+                    try:
+                        ctx["slugs"].sync()
+                        if ctx["similar"] is not None:
+                            ctx["similar"].sync()
+                    except requests.exceptions.RequestException as e:
+                        logger.warning(f"[{ctx['site'].name}] 同步站台索引時發生錯誤，將沿用現有索引: {e}")
+            day = now.date()
+            slots = plan_day(sites, contexts, day, now)
+
+        if not slots:
+            # 今天已排完，等到隔天再重新安排
+            wait_until(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+            continue
+
+        if not wait_until(slots[0][0]):
+            continue
+        _, name = slots.pop(0)
+
+        ctx = contexts[name]
+        jobs = plan_jobs(ctx, 1)
+        if not jobs:
+            logger.warning(f"[{name}] 沒有可處理的關鍵字，略過此時段")
+            continue
+        success, failure = run_sequential(jobs, contexts)
+        metrics.posts["success"] += success
+        metrics.posts["failure"] += failure
+        write_run_report(metrics)
+
+    logger.info("收到結束訊號，常駐模式結束")
+    log_gemini_stats(metrics.posts["success"])
+    write_run_report(metrics)
+    close_stores(contexts)
+    context_cache.close()
+    api_keys.close()
+    model_stats.close()
+
 if __name__ == "__main__":
-    main()
+    if DAEMON_MODE:
+        run_daemon()
+    else:
+        main()
@@ -0,0 +1,919 @@
+"""
+WordPress 文章自動生成器 - 效能基準測試
+
+以本機假伺服器取代外部 API 進行量測，不會呼叫真正的 Google / WordPress 服務。
+
+使用方式：
+    python bench.py stream     # Gemini 串流解析與提前中止
+    python bench.py hedge      # Gemini 備援模型對沖請求的尾端延遲
+    python bench.py similar    # 重複內容偵測：MinHash 簽章與 LSH 索引查詢
+    python bench.py html       # 發佈前的 HTML 清理：吞吐量、線性程度與節省的大小
+    python bench.py e2e        # 端對端：假 CSE / Gemini / WordPress 伺服器 + 完整執行 app.py
+    python bench.py check      # 回歸檢查：以假伺服器與固定輸入確認已修正的問題不再出現
+"""
+import os, re, sys, html, json, time, math, random, hashlib, argparse, statistics, threading, logging, tempfile, subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# app 於 import 時讀取環境變數並建立日誌檔，先切換到暫存目錄並填入假設定
+os.chdir(tempfile.mkdtemp(prefix="wp-bench-"))
+os.environ.setdefault("GOOGLE_API_KEY", "bench-key")
+os.environ.setdefault("GOOGLE_CSE_ID", "bench-cse")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+
+# 量測時不需要逐筆日誌（提前中止等預期中的錯誤也不輸出）
+logging.getLogger().setLevel(logging.CRITICAL)
+
+# ---------------------------------------------------------------
+# 假資料
+# ---------------------------------------------------------------
+# 產生內容各不相同的假文章用的字元集（CJK 統一漢字開頭的 3000 字）
+HANZI = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+def fake_body(size, seed=None):
+    """文章 HTML；指定 seed 時每段為依 seed 產生的隨機漢字（相同 seed 內容相同），否則為固定內容"""
+    if seed is None:
+        return "".join(f"<h2>段落 {i}</h2><p>{'補充營養與健康知識。' * 20}</p>" for i in range(size // 200 + 1))[:size]
+    rng = random.Random(seed)
+    return "".join(f"<h2>段落 {i}</h2><p>{''.join(rng.choices(HANZI, k=180))}。</p>"
+                   for i in range(size // 200 + 1))[:size]
+
+def fake_article(size=4000, malformed=False, title="維他命C的五大好處｜健康誌", seed=None):
+    """產生符合（或刻意不符合）輸出格式的 Gemini 文字"""
+    body = fake_body(size, seed)
+    if malformed:
+        # 模型忽略格式、直接輸出文章
+        return "以下是您要的文章：\n" + body
+    return (
+        f"```\nSEO_TITLE: {title}\n"
+        "SEO_DESC: 一次了解維他命C的功效、攝取量與注意事項。\n"
+        "SEO_KEYWORD: 維他命C,抗氧化\n---\nARTICLE:\n" + body + "\n```"
+    )
+
+# ---------------------------------------------------------------
+# 假 Gemini 伺服器（generateContent / streamGenerateContent SSE）
+# ---------------------------------------------------------------
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    text = fake_article()
+    chunk_size = 200       # 每個 SSE 事件的字元數
+    chunk_delay = 0.01     # 每個事件之間的延遲（模擬生成速度）
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        text = self.text
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        if "streamGenerateContent" in self.path:
+            write_sse(self, chunks, self.chunk_delay)
+        else:
+            # 非串流：等到全部「生成」完畢才回應
+            time.sleep(self.chunk_delay * len(chunks))
+            payload = json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+class FakeModelHandler(FakeGeminiHandler):
+    """依 URL 中的模型名稱套用不同延遲分布（首個位元組前的等待）的假 Gemini 伺服器"""
+    latency = {}
+    requests = {}
+
+    def do_POST(self):
+        model = self.path.split("/models/", 1)[1].split(":", 1)[0]
+        self.requests[model] = self.requests.get(model, 0) + 1
+        time.sleep(self.latency[model].sample())
+        super().do_POST()
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # 對沖請求勝出後，落後的串流由用戶端關閉連線
+            pass
+
+def write_sse(handler, chunks, delay, usage=None):
+    """以 chunked 編碼逐一送出 SSE 事件；最後一個事件附上 usageMetadata"""
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/event-stream")
+    handler.send_header("Transfer-Encoding", "chunked")
+    handler.end_headers()
+    try:
+        for idx, chunk in enumerate(chunks):
+            time.sleep(delay)
+            event = {"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+            if usage and idx == len(chunks) - 1:
+                event["usageMetadata"] = usage
+            data = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+            handler.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+    except (BrokenPipeError, ConnectionResetError):
+        # 用戶端提前中止
+        pass
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+# ---------------------------------------------------------------
+# 端對端假伺服器（CSE / Gemini / WordPress / 參考頁面共用一個埠）
+# ---------------------------------------------------------------
+class Latency:
+    """
+    延遲分布，格式：
+      fixed:0.05            固定秒數
+      uniform:0.02,0.2      均勻分布
+      lognormal:0.1,0.5     對數常態（中位數, sigma），長尾最接近真實 API
+      exp:0.1               指數分布（平均值）
+    """
+
+    def __init__(self, spec):
+        kind, _, params = spec.partition(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(x) for x in params.split(",") if x]
+        if kind not in ("fixed", "uniform", "lognormal", "exp"):
+            raise argparse.ArgumentTypeError(f"未知的延遲分布: {spec}")
+
+    def sample(self):
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return random.uniform(p[0], p[1])
+        if self.kind == "lognormal":
+            return random.lognormvariate(math.log(p[0]), p[1])
+        return random.expovariate(1 / p[0])
+
+    def __repr__(self):
+        return self.spec
+
+YOAST_META = ("_yoast_wpseo_title", "_yoast_wpseo_metadesc", "_yoast_wpseo_focuskw")
+
+def texturize(text):
+    """模擬 WordPress 的 wptexturize 與輸出跳脫：直引號改為彎引號、-- 改為破折號、... 改為刪節號"""
+    text = html.escape(text, quote=False).replace("&amp;", "&#038;")
+    text = text.replace("...", "&#8230;").replace("--", "&#8211;").replace("'", "&#8217;")
+    return re.sub(r'"([^"]*)"', r"&#8220;\1&#8221;", text)
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    依路徑模擬三個外部 API：
+      GET  /customsearch/v1                     Custom Search
+      POST /v1beta/models/*:generateContent     Gemini（含 streamGenerateContent 與 JSON 模式）
+      POST /v1beta/cachedContents               Gemini 快取（另支援 PATCH 延長與 DELETE）
+      GET  /wp-json/wp/v2/posts                 slug 查詢與索引同步
+      POST /wp-json/wp/v2/posts                 發佈（可依機率以 403 拒絕 meta 欄位，或建立後回應 502）
+      GET/POST /wp-json/wp/v2/tags              標籤查詢與建立
+      POST /wp-json/batch/v1                    batch 請求
+      OPTIONS / GET /wp-json/...                站台能力探測（meta 欄位 schema、namespaces、分類法）
+      GET  /page/*                              參考頁面（REF_FETCH=1 時使用）
+    每個 API 的延遲、錯誤率（429/5xx）與回應大小由 config 設定。
+    WordPress 的 lost_rate 模擬代理在寫入完成後回傳 502（寫入已生效但用戶端收到錯誤，依比例平均分散，結果可重現）；
+    以相同標題建立第二篇文章時計入 wp.duplicates。
+    """
+    protocol_version = "HTTP/1.1"
+    base = ""
+    config = {}
+    lock = threading.Lock()
+    posts = {}
+    titles = set()
+    terms = {}
+    caches = {}
+    stats = {}
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.posts = {}
+            cls.titles = set()
+            cls.terms = {}
+            cls.caches = {}
+            cls.stats = {}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def send_json(self, status, obj, headers=None):
+        payload = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def inject(self, api):
+        """套用延遲；依錯誤率回傳 429 或 5xx，已處理時回傳 True"""
+        cfg = self.config[api]
+        time.sleep(cfg["latency"].sample())
+        self.count(f"{api}.requests")
+        if random.random() < cfg["error_rate"]:
+            status = random.choice((429, 500, 502, 503))
+            self.count(f"{api}.{status}")
+            self.send_json(status, {"error": {"code": status, "message": "injected"}}, {"Retry-After": "0"})
+            return True
+        return False
+
+    def lost(self):
+        """寫入已完成，但其中 lost_rate 比例（平均分散）改以 502 回應（模擬代理逾時），已處理時回傳 True"""
+        rate = self.config["wp"].get("lost_rate", 0)
+        with self.lock:
+            writes = self.stats.get("wp.writes", 0)
+            self.stats["wp.writes"] = writes + 1
+        if int((writes + 1) * rate) == int(writes * rate):
+            return False
+        self.count("wp.lost_502")
+        self.send_json(502, {"code": "bad_gateway", "message": "injected after write"})
+        return True
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.startswith("/customsearch/"):
+            self.handle_cse(query)
+        elif url.path.rstrip("/") == "/wp-json":
+            self.handle_wp_index()
+        elif url.path.endswith("/wp/v2/taxonomies"):
+            self.send_json(200, {"category": {"rest_base": "categories"}, "post_tag": {"rest_base": "tags"}})
+        elif url.path.endswith("/wp/v2/tags"):
+            self.handle_tags_list(query)
+        elif url.path.startswith("/wp-json/"):
+            self.handle_wp_list(query)
+        elif url.path.startswith("/page/"):
+            self.handle_page(url.path)
+        else:
+            self.send_json(404, {})
+
+    def do_POST(self):
+        body = self.read_body()
+        if "/models/" in self.path:
+            self.handle_gemini(json.loads(body))
+        elif self.path.endswith("/cachedContents"):
+            self.handle_cache_create(json.loads(body))
+        elif self.path.endswith("/batch/v1"):
+            self.handle_batch(json.loads(body))
+        elif self.path.startswith("/wp-json/"):
+            if self.inject("wp"):
+                return
+            status, reply = self.wp_dispatch(self.path.split("/wp-json", 1)[1], json.loads(body))
+            if not self.lost():
+                self.send_json(status, reply)
+        else:
+            self.send_json(404, {})
+
+    def do_OPTIONS(self):
+        if self.path.endswith("/batch/v1"):
+            self.send_json(200, {"endpoints": [{"methods": ["POST"], "args": {"requests": {"maxItems": 25}}}]})
+        elif self.path.startswith("/wp-json/wp/v2/posts"):
+            meta = {key: {"type": "string"} for key in YOAST_META} if self.config["wp"].get("meta_registered", True) else {}
+            self.send_json(200, {"schema": {"properties": {"meta": {"type": "object", "properties": meta}}}})
+        else:
+            self.send_json(404, {})
+
+    def do_PATCH(self):
+        self.read_body()
+        name = self.path.split("/v1beta/", 1)[-1]
+        with self.lock:
+            found = name in self.caches
+        self.send_json(200 if found else 404, {"name": name} if found else {"error": {"message": "CachedContent not found"}})
+
+    def do_DELETE(self):
+        with self.lock:
+            self.caches.pop(self.path.split("/v1beta/", 1)[-1], None)
+        self.send_json(200, {})
+
+    def handle_cache_create(self, body):
+        self.count("gemini.cache_create")
+        with self.lock:
+            name = f"cachedContents/c{len(self.caches) + 1}"
+            self.caches[name] = len(json.dumps(body["systemInstruction"], ensure_ascii=False)) // 2
+        self.send_json(200, {"name": name, "model": body["model"]})
+
+    def handle_cse(self, query):
+        if self.inject("cse"):
+            return
+        start = int(query.get("start", 1))
+        num = int(query.get("num", 10))
+        tag = hashlib.md5(query.get("q", "").encode("utf-8")).hexdigest()[:10]
+        snippet = "x" * self.config["cse"]["size"]
+        items = [{"link": f"{self.base}/page/{tag}-{start + i}", "title": f"{tag} #{start + i}", "snippet": snippet}
+                 for i in range(num)]
+        self.send_json(200, {"items": items})
+
+    def handle_page(self, path):
+        if self.inject("page"):
+            return
+        text = fake_body(self.config["page"]["size"])
+        payload = f"<html><head><title>{path}</title></head><body><article>{text}</article></body></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_gemini(self, body):
+        if self.inject("gemini"):
+            return
+        prompt = body["contents"][0]["parts"][0]["text"]
+        tag = hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8]
+        # 含引號、連字號與刪節號：WordPress 輸出的 title.rendered 會被 wptexturize 轉換，與送出的標題不同
+        title = f"Article {tag} -- it's 完整指南...｜健康誌"
+        size = self.config["gemini"]["size"]
+        # 依 dup_rate 的機率產出與其他重複文章內容相同的文章，其餘每篇內容不同
+        seed = "duplicate" if random.random() < self.config["gemini"].get("dup_rate", 0) else tag
+        usage = {"promptTokenCount": len(prompt) // 2, "candidatesTokenCount": size // 2}
+        if "systemInstruction" in body:
+            usage["promptTokenCount"] += len(json.dumps(body["systemInstruction"], ensure_ascii=False)) // 2
+        if "cachedContent" in body:
+            with self.lock:
+                cached = self.caches.get(body["cachedContent"])
+            if cached is None:
+                self.send_json(404, {"error": {"code": 404, "message": "CachedContent not found (or permission denied)"}})
+                return
+            usage["promptTokenCount"] += cached
+            usage["cachedContentTokenCount"] = cached
+        usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+        config = body.get("generationConfig") or {}
+        if config.get("responseMimeType") == "application/json":
+            text = json.dumps({"seo_title": title, "seo_desc": "一次了解功效、攝取量與注意事項。",
+                               "focus_keyword": "維他命C,抗氧化", "article_html": fake_body(size, seed)}, ensure_ascii=False)
+        else:
+            text = fake_article(size, title=title, seed=seed)
+        if "streamGenerateContent" in self.path:
+            chunks = [text[i:i + 200] for i in range(0, len(text), 200)]
+            write_sse(self, chunks, 0, usage)
+        else:
+            self.send_json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage})
+
+    def handle_wp_list(self, query):
+        if self.inject("wp"):
+            return
+        with self.lock:
+            posts = list(self.posts.values())
+        if "_fields" in query:
+            fields = query["_fields"].split(",")
+            posts = [{k: p[k] for k in fields if k in p} for p in posts]
+        if "slug" in query:
+            wanted = set(query["slug"].split(","))
+            self.send_json(200, [p for p in posts if p["slug"] in wanted])
+            return
+        per_page = int(query.get("per_page", 10))
+        page = int(query.get("page", 1))
+        pages = max(1, math.ceil(len(posts) / per_page))
+        self.send_json(200, posts[(page - 1) * per_page:page * per_page], {"X-WP-TotalPages": str(pages)})
+
+    def handle_wp_index(self):
+        if self.inject("wp"):
+            return
+        namespaces = ["wp/v2"] + (["batch/v1"] if self.config["wp"].get("batch", True) else [])
+        self.send_json(200, {"namespaces": namespaces})
+
+    def handle_tags_list(self, query):
+        if self.inject("wp"):
+            return
+        if self.config["wp"].get("tags_broken"):
+            # 模擬改寫 REST 回應的外掛：狀態碼 200，但內容不是標籤清單
+            self.send_json(200, {"success": True, "data": []})
+            return
+        wanted = {s.lower() for s in query.get("slug", "").split(",") if s}
+        with self.lock:
+            terms = [t for t in self.terms.values() if t["slug"] in wanted]
+        self.send_json(200, terms)
+
+    def handle_batch(self, payload):
+        if self.inject("wp"):
+            return
+        self.count("wp.batch")
+        responses = []
+        for item in payload.get("requests", []):
+            status, body = self.wp_dispatch(item["path"], item.get("body") or {})
+            responses.append({"status": status, "body": body, "headers": {}})
+        if not self.lost():
+            self.send_json(207, {"responses": responses})
+
+    def wp_dispatch(self, path, payload):
+        """依 REST 路徑（/wp/v2/...）處理寫入請求，回傳 (狀態碼, 回應)；單筆請求與 batch 共用"""
+        if path.startswith("/wp/v2/tags"):
+            return self.create_term(payload)
+        if path.startswith("/wp/v2/posts"):
+            return self.create_post(payload)
+        return 404, {"code": "rest_no_route"}
+
+    def create_term(self, payload):
+        name = payload.get("name", "")
+        with self.lock:
+            existing = self.terms.get(name.lower())
+            if existing:
+                return 400, {"code": "term_exists", "message": "A term with the name provided already exists.",
+                             "data": {"status": 400, "term_id": existing["id"]}}
+            term = {"id": 1000 + len(self.terms), "name": name, "slug": name.lower()}
+            self.terms[name.lower()] = term
+        self.count("wp.terms_created")
+        return 201, term
+
+    def create_post(self, payload):
+        cfg = self.config["wp"]
+        if payload.get("meta") and (not cfg.get("meta_registered", True) or random.random() < cfg["meta_403"]):
+            self.count("wp.403_meta")
+            return 403, {"code": "rest_cannot_update", "message": "Sorry, you are not allowed to edit the meta custom field."}
+        with self.lock:
+            known = {t["id"] for t in self.terms.values()}
+            if any(t not in known for t in payload.get("tags", [])):
+                return 400, {"code": "rest_invalid_param", "message": "Invalid parameter(s): tags"}
+            if payload.get("title") in self.titles:
+                self.stats["wp.duplicates"] = self.stats.get("wp.duplicates", 0) + 1
+            self.titles.add(payload.get("title"))
+            post_id = len(self.posts) + 1
+            slug = payload.get("slug") or f"post-{post_id}"
+            while slug in self.posts:
+                slug = f"{slug}-2"
+            post = {"id": post_id, "slug": slug, "link": f"{self.base}/{slug}/",
+                    "title": {"rendered": texturize(payload.get("title", ""))},
+                    "content": {"rendered": payload.get("content", "")},
+                    "tags": payload.get("tags", []),
+                    "modified_gmt": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())}
+            self.posts[slug] = post
+        self.count("wp.created")
+        return 201, post
+
+# ---------------------------------------------------------------
+# 基準測試
+# ---------------------------------------------------------------
+def timed(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+def bench_stream(args):
+    """比較串流與非串流：完整文章的總時間、格式錯誤時的中止時間，以及解析器吞吐量"""
+    server, base = start_server(FakeGeminiHandler)
+    app.GENAI_BASE_URL = f"{base}/v1beta"
+    app.API_MIN_INTERVAL["gemini"] = 0
+    FakeGeminiHandler.chunk_delay = args.chunk_delay
+    headers = {"Content-Type": "application/json"}
+    body = {"contents": [{"parts": [{"text": "bench"}]}]}
+
+    print(f"== Gemini 串流（文章 {args.size} 字元，每 {FakeGeminiHandler.chunk_size} 字元延遲 {args.chunk_delay}s）==")
+    for malformed in (False, True):
+        FakeGeminiHandler.text = fake_article(args.size, malformed)
+        label = "格式錯誤" if malformed else "格式正確"
+        t_full, _ = timed(lambda: app.gemini_generate(headers, body), args.repeat)
+        t_stream, (text, _) = timed(lambda: app.gemini_stream_generate(headers, body), args.repeat)
+        outcome = "中止" if text is None else "完成"
+        print(f"{label}: generateContent {t_full * 1000:8.1f} ms | streamGenerateContent {t_stream * 1000:8.1f} ms（{outcome}）")
+
+    print("== 解析器吞吐量（單次掃描，分段餵入）==")
+    for size in (1000, 10000, 100000):
+        text = fake_article(size)
+        pieces = [text[i:i + 50] for i in range(0, len(text), 50)]
+
+        def parse():
+            parser = app.GeminiOutputParser()
+            for piece in pieces:
+                parser.feed(piece)
+            return parser.finish()
+
+        elapsed, _ = timed(parse, args.repeat * 10)
+        print(f"{size:>7} 字元: {elapsed * 1e6:9.1f} µs（{len(text) / elapsed / 1e6:6.1f} M 字元/秒）")
+    server.shutdown()
+
+def bench_hedge(args):
+    """比較只用主要模型與啟用對沖請求時，每篇產文的延遲分布（p50/p95/p99）與額外請求數"""
+    server, base = start_server(FakeModelHandler)
+    FakeModelHandler.latency = {"primary": args.primary_latency, "fallback": args.fallback_latency}
+    FakeModelHandler.chunk_delay = 0.001
+    FakeModelHandler.text = fake_article(args.size)
+    app.GENAI_BASE_URL = f"{base}/v1beta"
+    app.GENAI_MODEL = "primary"
+    app.GEMINI_STREAM = args.stream
+    app.API_MIN_INTERVAL["gemini"] = 0
+    # 假伺服器的延遲是毫秒等級，取消門檻下限以便由 p95 決定
+    app.GEMINI_HEDGE_MIN_SECONDS = 0
+    app.model_stats = app.ModelStats(os.path.join(tempfile.mkdtemp(prefix="hedge-"), "gemini_models.db"))
+    site = app.Site()
+
+    print(f"== Gemini 對沖請求（primary={args.primary_latency}，fallback={args.fallback_latency}，"
+          f"{'串流' if args.stream else '非串流'}，{args.count} 篇）==")
+    for label, models in (("只用主要模型", ["primary"]), ("啟用對沖", ["primary", "fallback"])):
+        # 只用主要模型的那一輪同時累積延遲統計，對沖門檻由此計算
+        app.GENAI_MODELS = models
+        FakeModelHandler.requests = {}
+        app.gemini_stats.update(hedges=0, fallback_wins=0)
+        samples = []
+        for i in range(args.count):
+            start = time.perf_counter()
+            if app.gemini_generate_article(f"kw{i}", site, []) is None:
+                raise RuntimeError("產文失敗")
+            samples.append(time.perf_counter() - start)
+        requests_sent = sum(FakeModelHandler.requests.values())
+        print(f"{label:<8} p50 {app.percentile(samples, 0.5) * 1000:7.0f} ms | p95 {app.percentile(samples, 0.95) * 1000:7.0f} ms"
+              f" | p99 {app.percentile(samples, 0.99) * 1000:7.0f} ms | max {max(samples) * 1000:7.0f} ms"
+              f" | 請求 {requests_sent}（+{(requests_sent - args.count) / args.count:.0%}）"
+              f" | 對沖 {app.gemini_stats['hedges']}，備援勝出 {app.gemini_stats['fallback_wins']}")
+    print(f"對沖門檻: {app.model_stats.threshold('primary') * 1000:.0f} ms")
+    app.model_stats.close()
+    server.shutdown()
+
+def mutate(text, rate, rng):
+    """將文字中 rate 比例的字元換成隨機漢字，模擬改寫幅度不同的近似重複文章"""
+    chars = list(text)
+    for i in rng.sample(range(len(chars)), int(len(chars) * rate)):
+        chars[i] = rng.choice(HANZI)
+    return "".join(chars)
+
+def bench_similar(args):
+    """量測重複內容偵測：簽章計算時間、不同索引大小的查詢延遲、載入時間，以及不同改寫幅度的偵出率"""
+    rng = random.Random(1)
+    rates = (0.02, 0.05, 0.1, 0.15, 0.2)
+    print(f"== 重複內容偵測（文章 {args.size} 字元，shingle {app.DUP_SHINGLE} 字，"
+          f"{app.DUP_BANDS}x{app.DUP_ROWS} LSH，門檻 {app.DUP_THRESHOLD}）==")
+    sample = fake_body(args.size, "sig")
+    elapsed, _ = timed(lambda: app.minhash(sample), args.queries)
+    print(f"簽章計算: {elapsed * 1e6:.0f} µs / 篇")
+    header = f"{'索引篇數':>8} {'建立秒數':>8} {'載入秒數':>8} {'查詢 p50':>9} {'查詢 p99':>9} {'誤判':>6}"
+    header += "".join(f" {'改寫 ' + format(r, '.0%'):>9}" for r in rates)
+    print(header)
+
+    for count in args.docs:
+        path = os.path.join(tempfile.mkdtemp(prefix="similar-"), app.SIMILAR_DB_NAME)
+        index = app.SimilarityIndex(path, None)
+        bodies = [fake_body(args.size, f"doc{i}") for i in range(count)]
+        start = time.perf_counter()
+        for i in range(0, count, 500):
+            index._store([(f"post:{n}", f"doc{n}", app.minhash(bodies[n])) for n in range(i, min(count, i + 500))])
+        build = time.perf_counter() - start
+        index.close()
+        start = time.perf_counter()
+        index = app.SimilarityIndex(path, None)
+        load = time.perf_counter() - start
+
+        # 與索引無關的新文章：量測查詢延遲與誤判
+        samples = []
+        false_hits = 0
+        for q in range(args.queries):
+            sig = app.minhash(fake_body(args.size, f"query{q}"))
+            start = time.perf_counter()
+            false_hits += index._nearest(sig) is not None
+            samples.append(time.perf_counter() - start)
+        line = (f"{count:>8} {build:>8.2f} {load:>8.2f} {app.percentile(samples, 0.5) * 1e6:>7.0f}µs"
+                f" {app.percentile(samples, 0.99) * 1e6:>7.0f}µs {false_hits / args.queries:>6.1%}")
+        # 改寫既有文章部分字元後的偵出率
+        for rate in rates:
+            picks = rng.sample(range(count), min(count, args.queries))
+            found = sum(index._nearest(app.minhash(mutate(bodies[n], rate, rng))) is not None for n in picks)
+            line += f" {found / len(picks):>9.1%}"
+        print(line)
+        index.close()
+
+def messy_article(size, seed=0):
+    """模型常見的雜亂輸出：多餘屬性與包裝元素、未關閉的標籤、Markdown 殘留、大量空白與重複的參考資料區塊"""
+    rng = random.Random(seed)
+    refs = "".join(f'<li><a href="https://example.com/ref{n}?utm_source=x" target="_blank">來源 {n}</a></li>\n'
+                   for n in range(3))
+    parts = ["```html\n<div class='article' style='font-size:16px'>\n"]
+    length = 0
+    while length < size:
+        text = "".join(rng.choices(HANZI, k=120))
+        part = rng.choice((
+            f"<h2 id='s{length}'>  段落標題 </h2>\n\n",
+            f"<p class='lead'  data-x=\"1\">{text[:60]}   **重點**   {text[60:]}\n",
+            f"<p>{text}</p>\n<span style='color:red'>  {text[:30]} </span>\n",
+            f"<ul>\n  <li>{text[:40]}\n  <li><b>{text[40:80]}</b>\n</ul>\n",
+            f"<p onclick='x()'>{text}<script>track()</script></strong></p>\n",
+        ))
+        parts.append(part)
+        length += len(part)
+    parts.append(f"<h3>參考資料</h3>\n<ul>\n{refs}{refs}</ul>\n<h3>參考資料</h3>\n<ul>\n{refs}</ul>\n</div>\n```")
+    return "".join(parts)
+
+def bench_html(args):
+    """量測發佈前的 HTML 清理：各文章大小的處理時間與吞吐量、每字元時間（線性程度）與清理後節省的大小"""
+    print("== HTML 清理（ArticleSanitizer 單次掃描）==")
+    print(f"{'輸入字元':>10} {'處理時間':>10} {'MB/s':>7} {'ns/字元':>8} {'清理前 bytes':>12} {'清理後 bytes':>12} {'節省':>6}")
+    for size in args.sizes:
+        article = messy_article(size)
+        elapsed, cleaned = timed(lambda: app.sanitize_article_html(article), args.repeat)
+        before, after = len(article.encode("utf-8")), len(cleaned.encode("utf-8"))
+        print(f"{len(article):>10} {elapsed * 1e3:>8.2f}ms {before / elapsed / 1e6:>7.1f} "
+              f"{elapsed * 1e9 / len(article):>8.0f} {before:>12} {after:>12} {1 - after / before:>6.1%}")
+
+    # 病態輸入：大量未關閉的巢狀標籤與多餘的結束標籤，時間仍應與長度成正比
+    print("-- 病態輸入 --")
+    for name, build in (("未關閉的 <strong>", lambda n: "<p>" + "<strong>字" * n),
+                        ("多餘的結束標籤", lambda n: "<p>字" + "</em></li></ul>" * n),
+                        ("未關閉的 <li>", lambda n: "<ul>" + "<li>字" * n)):
+        for count in (1000, 10000):
+            article = build(count)
+            elapsed, _ = timed(lambda: app.sanitize_article_html(article), args.repeat)
+            print(f"{name:<16} x{count:<6} {elapsed * 1e3:>8.2f}ms {elapsed * 1e9 / len(article):>8.0f} ns/字元")
+
+def run_app(keywords, base, args, workdir):
+    """以子行程執行一次完整的 app.py，回傳 (執行報告, 峰值 RSS MB, 牆鐘秒數)"""
+    env = dict(os.environ)
+    env.update({
+        "WP_URL": f"{base}/wp-json/wp/v2/posts",
+        "WP_USER": "bench",
+        "WP_APP_PASS": "bench",
+        "GOOGLE_API_KEY": "bench-key",
+        "GOOGLE_CSE_ID": "bench-cse",
+        "CSE_URL": f"{base}/customsearch/v1",
+        "GENAI_BASE_URL": f"{base}/v1beta",
+        "KEYWORDS_FILE": os.path.join(workdir, "keywords.txt"),
+        "POSTS_PER_DAY": str(len(keywords)),
+        "STATE_DIR": os.path.join(workdir, "state"),
+        # 量測的是程式本身的吞吐量，預設不做節流；退避縮短以免注入的錯誤拖長執行時間
+        "CSE_MIN_INTERVAL": "0",
+        "GEMINI_MIN_INTERVAL": "0",
+        "WP_MIN_INTERVAL": "0",
+        "HTTP_BACKOFF_BASE": "0.05",
+        "HTTP_BACKOFF_MAX": "0.5",
+        # 不受 Custom Search 免費額度（每天 100 次）限制，上千個關鍵字也能跑完
+        "CSE_DAILY_LIMIT": "0",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    with open(env["KEYWORDS_FILE"], "w", encoding="utf-8") as f:
+        f.write("".join(f"{keyword}\n" for keyword in keywords))
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, script], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"app.py 結束碼 {proc.returncode}，日誌: {workdir}")
+
+    with open(os.path.join(workdir, "state", "metrics", "latest.json"), encoding="utf-8") as f:
+        report = json.load(f)
+    # Linux 的 ru_maxrss 單位為 KB
+    return report, usage.ru_maxrss / 1024, wall
+
+def bench_e2e(args):
+    """以假伺服器執行完整流程，量測每分鐘發佈篇數、各階段 p50/p95 與峰值 RSS"""
+    FakeApiHandler.config = {
+        "cse": {"latency": args.cse_latency, "error_rate": args.error_rate, "size": args.cse_size},
+        "gemini": {"latency": args.gemini_latency, "error_rate": args.error_rate, "size": args.article_size,
+                   "dup_rate": args.dup_rate},
+        "wp": {"latency": args.wp_latency, "error_rate": args.error_rate, "meta_403": args.meta_403,
+               "meta_registered": not args.no_meta, "batch": not args.no_batch, "lost_rate": args.lost_rate},
+        "page": {"latency": args.page_latency, "error_rate": args.error_rate, "size": args.page_size},
+    }
+    server, base = start_server(FakeApiHandler)
+    FakeApiHandler.base = base
+    stages = ("search", "fetch", "generate", "publish")
+    settings = " ".join(args.env) or "預設設定"
+
+    print(f"== 端對端（{settings}）==")
+    print(f"延遲 cse={args.cse_latency} gemini={args.gemini_latency} wp={args.wp_latency}，"
+          f"錯誤率 {args.error_rate:.0%}，meta 403 機率 {args.meta_403:.0%}，文章 {args.article_size} 字元")
+    header = f"{'關鍵字':>7} {'成功':>6} {'失敗':>5} {'秒數':>8} {'篇/分':>8} {'RSS MB':>7}"
+    header += "".join(f" {name + ' p50/p95':>18}" for name in stages)
+    print(header)
+
+    results = []
+    for count in args.keywords:
+        FakeApiHandler.reset()
+        keywords = [f"kw{i:05d}" for i in range(count)]
+        workdir = tempfile.mkdtemp(prefix=f"e2e-{count}-", dir=os.getcwd())
+        report, rss, wall = run_app(keywords, base, args, workdir)
+
+        posts = report["posts"]
+        seconds = report["duration_seconds"]
+        per_minute = posts["success"] / seconds * 60 if seconds else 0.0
+        line = f"{count:>7} {posts['success']:>6} {posts['failure']:>5} {seconds:>8.1f} {per_minute:>8.1f} {rss:>7.1f}"
+        for name in stages:
+            op = report["operations"].get(f"stage.{name}")
+            line += f" {op['p50_seconds']:>8.3f}/{op['p95_seconds']:<8.3f}" if op else f" {'-':>18}"
+        print(line)
+        results.append({"keywords": count, "posts": posts, "duration_seconds": seconds, "wall_seconds": round(wall, 3),
+                        "posts_per_minute": round(per_minute, 2), "peak_rss_mb": round(rss, 1),
+                        "server": dict(FakeApiHandler.stats), "operations": report["operations"]})
+
+    injected = {}
+    for result in results:
+        for key, value in result["server"].items():
+            injected[key] = injected.get(key, 0) + value
+    print("伺服器端統計: " + ", ".join(f"{k}={v}" for k, v in sorted(injected.items())))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args) | {"func": None}, "results": results}, f, ensure_ascii=False, indent=2,
+                      default=str)
+        print(f"詳細結果已寫入 {args.output}")
+    server.shutdown()
+
+# ---------------------------------------------------------------
+# 回歸檢查
+# ---------------------------------------------------------------
+def check_no_duplicate_posts(args):
+    """WordPress 寫入完成後回應 502 時，單篇與批次發佈都不會重複建立文章"""
+    FakeApiHandler.config = {
+        "cse": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 200},
+        "gemini": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 2000},
+        "wp": {"latency": Latency("fixed:0"), "error_rate": 0, "meta_403": 0, "lost_rate": 0.3},
+        "page": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 2000},
+    }
+    server, base = start_server(FakeApiHandler)
+    FakeApiHandler.base = base
+    try:
+        for env in ([], ["WP_BATCH_PUBLISH=1", "WP_BATCH_SIZE=5"]):
+            FakeApiHandler.reset()
+            keywords = [f"kw{i:03d}" for i in range(30)]
+            workdir = tempfile.mkdtemp(prefix="check-", dir=os.getcwd())
+            report, _, _ = run_app(keywords, base, argparse.Namespace(env=env), workdir)
+            stats = FakeApiHandler.stats
+            label = " ".join(env) or "單篇發佈"
+            assert stats.get("wp.lost_502"), f"{label}: 沒有注入任何寫入後的 502"
+            assert not stats.get("wp.duplicates"), f"{label}: 重複建立 {stats['wp.duplicates']} 篇文章"
+            assert stats.get("wp.created") == report["posts"]["success"] == len(keywords), \
+                f"{label}: 建立 {stats.get('wp.created')} 篇，成功 {report['posts']['success']} 篇"
+    finally:
+        server.shutdown()
+
+def check_broken_tag_lookup(args):
+    """標籤查詢回應格式不符時，單篇與批次發佈都改為不附標籤，文章仍全部發佈"""
+    FakeApiHandler.config = {
+        "cse": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 200},
+        "gemini": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 2000},
+        "wp": {"latency": Latency("fixed:0"), "error_rate": 0, "meta_403": 0, "tags_broken": True},
+        "page": {"latency": Latency("fixed:0"), "error_rate": 0, "size": 2000},
+    }
+    server, base = start_server(FakeApiHandler)
+    FakeApiHandler.base = base
+    try:
+        for env in (["TAGS=保養,健康"], ["TAGS=保養,健康", "WP_BATCH_PUBLISH=1", "WP_BATCH_SIZE=5"]):
+            FakeApiHandler.reset()
+            keywords = [f"kw{i:03d}" for i in range(10)]
+            workdir = tempfile.mkdtemp(prefix="check-", dir=os.getcwd())
+            report, _, _ = run_app(keywords, base, argparse.Namespace(env=env), workdir)
+            label = " ".join(env[1:]) or "單篇發佈"
+            assert report["posts"]["success"] == len(keywords), \
+                f"{label}: 成功 {report['posts']['success']} 篇，失敗 {report['posts']['failure']} 篇"
+    finally:
+        server.shutdown()
+
+def check_deferred_keywords_released(args):
+    """配額用盡時未開始的工作計為延後，挑出的關鍵字放回排程，同一個行程中之後仍能挑選"""
+    workdir = tempfile.mkdtemp(prefix="check-", dir=os.getcwd())
+    scheduler = app.KeywordScheduler(os.path.join(workdir, app.KEYWORDS_DB_NAME))
+    keywords = {f"kw{i}": 1.0 for i in range(5)}
+    scheduler.sync(keywords)
+    journal = app.JobJournal(os.path.join(workdir, "jobs.db"))
+    saved = app.api_keys, app.KEYED_APIS["cse"]
+    app.api_keys = app.KeyPool(os.path.join(workdir, "keys.db"), ["bench-key"])
+    app.KEYED_APIS["cse"] = 1
+    try:
+        # 用掉當日唯一一次 Custom Search 配額，所有工作都無法開始
+        app.api_keys.acquire("cse")
+        jobs = [dict(journal.create(keyword), site="check") for keyword in scheduler.pick(len(keywords))]
+        assert len(jobs) == len(keywords), f"只挑出 {len(jobs)} 個關鍵字"
+        result = app.run_sequential(jobs, {"check": {"keywords": scheduler, "journal": journal}})
+        assert result == (0, 0), f"成功 / 失敗應為 (0, 0)，實際為 {result}"
+        again = scheduler.pick(len(keywords))
+        assert sorted(again) == sorted(keywords), f"放回排程的關鍵字只有 {sorted(again)}"
+    finally:
+        app.api_keys.close()
+        app.api_keys, app.KEYED_APIS["cse"] = saved
+        scheduler.close()
+
+def check_similarity_release(args):
+    """失敗的工作歸還暫存的簽章；兩篇都是空區間的位置不計為相同"""
+    workdir = tempfile.mkdtemp(prefix="check-", dir=os.getcwd())
+    index = app.SimilarityIndex(os.path.join(workdir, app.SIMILAR_DB_NAME), None)
+    try:
+        content = fake_body(3000, seed=1)
+        assert index.claim("job:1", "第一篇", content) is None, "空索引中不應有相似文章"
+        assert index.claim("job:2", "第二篇", content) is not None, "相同內容未被判定為重複"
+        index.release("job:1")
+        assert index.claim("job:2", "第二篇", content) is None, "釋放後仍與失敗工作的簽章比對"
+        index.release("job:2")
+        assert len(index) == 0, f"釋放後索引仍有 {len(index)} 筆"
+    finally:
+        index.conn.close()
+
+    a = [app._EMPTY_BIN] * app.DUP_BINS
+    b = list(a)
+    a[:10], b[:10] = range(10), range(10, 20)
+    similarity = app.minhash_similarity(a, b)
+    assert similarity == 0, f"只有空區間相同的簽章相似度為 {similarity:.2f}"
+
+def check_sanitizer_void_tags(args):
+    """沒有結束標籤的 <embed> 與自我關閉的 <svg/>、<script/>、<iframe/> 之後的內容不會被刪除"""
+    cases = {
+        "<p>a<embed src=x><p>rest</p>": "<p>a</p><p>rest</p>",
+        '<p>a<svg width="1"/><p>rest</p>': "<p>a</p><p>rest</p>",
+        "<p>a<script/><p>rest</p>": "<p>a</p><p>rest</p>",
+        '<p>a<iframe src="x"/>b</p><p>rest</p>': "<p>ab</p><p>rest</p>",
+        '<p>a<svg><embed></embed><path d="x"/></svg>b</p><p>rest</p>': "<p>ab</p><p>rest</p>",
+        "<p>a<script>x<y</script><p>rest": "<p>a</p><p>rest</p>",
+        '<p>a<input name=x><br/>b<img src="/i.png"/></p>': '<p>a<br>b<img src="/i.png"></p>',
+    }
+    for source, expected in cases.items():
+        cleaned = app.sanitize_article_html(source)
+        assert cleaned == expected, f"{source!r} 清理為 {cleaned!r}，預期 {expected!r}"
+
+CHECKS = [check_no_duplicate_posts, check_broken_tag_lookup, check_deferred_keywords_released,
+          check_similarity_release, check_sanitizer_void_tags]
+
+def bench_check(args):
+    """依序執行回歸檢查，有任何一項失敗時以結束碼 1 結束"""
+    failed = 0
+    for check in CHECKS:
+        if args.only and args.only not in check.__name__:
+            continue
+        start = time.perf_counter()
+        try:
+            check(args)
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {check.__name__}: {e}")
+        else:
+            print(f"✓ {check.__name__}（{time.perf_counter() - start:.1f} 秒）")
+    sys.exit(1 if failed else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="WordPress 文章自動生成器效能基準測試")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("stream", help="Gemini 串流解析與提前中止")
+    p.add_argument("--size", type=int, default=4000, help="文章字元數")
+    p.add_argument("--chunk-delay", type=float, default=0.01, help="每個 SSE 事件的延遲（秒）")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser("hedge", help="Gemini 備援模型對沖請求的尾端延遲")
+    p.add_argument("--primary-latency", type=Latency, default=Latency("lognormal:0.1,0.8"))
+    p.add_argument("--fallback-latency", type=Latency, default=Latency("lognormal:0.15,0.3"))
+    p.add_argument("--count", type=int, default=200, help="每種設定產生的文章數")
+    p.add_argument("--size", type=int, default=4000, help="文章字元數")
+    p.add_argument("--stream", action="store_true", help="使用串流模式（落後的請求會被關閉連線）")
+    p.set_defaults(func=bench_hedge)
+
+    p = sub.add_parser("similar", help="重複內容偵測的簽章計算與索引查詢")
+    p.add_argument("--docs", type=lambda v: [int(x) for x in v.split(",")], default=[1000, 10000],
+                   help="逗號分隔的索引篇數")
+    p.add_argument("--size", type=int, default=4000, help="文章字元數")
+    p.add_argument("--queries", type=int, default=200, help="每種設定的查詢篇數")
+    p.set_defaults(func=bench_similar)
+
+    p = sub.add_parser("html", help="發佈前的 HTML 清理")
+    p.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[1000, 10000, 100000],
+                   help="逗號分隔的文章字元數")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_html)
+
+    p = sub.add_parser("e2e", help="端對端吞吐量（假 CSE / Gemini / WordPress）")
+    p.add_argument("--keywords", type=lambda v: [int(x) for x in v.split(",")], default=[10, 100, 1000],
+                   help="逗號分隔的關鍵字數量，例如 10,100,1000,10000")
+    p.add_argument("--cse-latency", type=Latency, default=Latency("lognormal:0.03,0.4"))
+    p.add_argument("--gemini-latency", type=Latency, default=Latency("lognormal:0.2,0.5"))
+    p.add_argument("--wp-latency", type=Latency, default=Latency("lognormal:0.05,0.4"))
+    p.add_argument("--page-latency", type=Latency, default=Latency("lognormal:0.05,0.6"))
+    p.add_argument("--error-rate", type=float, default=0.02, help="每個請求回傳 429/5xx 的機率")
+    p.add_argument("--meta-403", type=float, default=0.0, help="發佈時以 403 拒絕 meta 欄位的機率")
+    p.add_argument("--no-meta", action="store_true", help="模擬未註冊 Yoast meta 欄位的站台（附上 meta 一律 403）")
+    p.add_argument("--no-batch", action="store_true", help="模擬不支援 /batch/v1 的舊版 WordPress")
+    p.add_argument("--lost-rate", type=float, default=0.0, help="WordPress 寫入完成後仍回應 502 的比例")
+    p.add_argument("--article-size", type=int, default=4000, help="Gemini 文章字元數")
+    p.add_argument("--dup-rate", type=float, default=0.0, help="Gemini 產出重複內容文章的機率（搭配 DUP_CHECK=1）")
+    p.add_argument("--cse-size", type=int, default=200, help="每筆搜尋結果的摘要字元數")
+    p.add_argument("--page-size", type=int, default=20000, help="參考頁面字元數")
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                   help="傳給 app.py 的額外設定，例如 --env PIPELINE_MODE=1（可重複）")
+    p.add_argument("--output", help="將詳細結果寫入 JSON 檔")
+    p.set_defaults(func=bench_e2e)
+
+    p = sub.add_parser("check", help="回歸檢查（失敗時結束碼為 1）")
+    p.add_argument("--only", help="只執行名稱包含此字串的檢查")
+    p.set_defaults(func=bench_check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
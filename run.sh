@@ -24,9 +24,10 @@ show_help() {
     echo ""
     echo "選項:"
     echo "  run      - 手動執行一次（執行完就關閉）"
-    echo "  start    - 啟動定時排程服務（每天上午9點執行）"
+    echo "  start    - 啟動常駐排程服務（依 PUBLISH_WINDOW 分散發佈）"
     echo "  stop     - 停止所有服務"
     echo "  restart  - 重新啟動排程服務"
+    echo "  reload   - 重新載入 .env（不重新啟動排程服務）"
     echo "  logs     - 查看服務日誌"
     echo "  local-logs - 查看本地日誌檔案"
     echo "  status   - 查看服務狀態"
@@ -95,6 +96,13 @@ restart_services() {
     echo -e "${GREEN}✅ 服務已重新啟動！${NC}"
 }
 
+# 重新載入設定（送出 SIGHUP，排程服務不中斷）
+reload_config() {
+    echo -e "${YELLOW}🔄 重新載入 .env...${NC}"
+    docker-compose kill -s HUP wp-article-scheduler
+    echo -e "${GREEN}✅ 已通知排程服務重新載入設定！${NC}"
+}
+
 # 查看日誌
 show_logs() {
     echo -e "${BLUE}📋 顯示服務日誌...${NC}"
@@ -160,6 +168,9 @@ main() {
         "restart")
             restart_services
             ;;
+        "reload")
+            reload_config
+            ;;
         "logs")
             show_logs
             ;;